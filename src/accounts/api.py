@@ -1,22 +1,21 @@
 import logging
 import secrets
 from datetime import datetime, timedelta
-import asyncio
 import time
 
-import httpx
+from asgiref.sync import sync_to_async
 from django.conf import settings
 from django.shortcuts import redirect
 from django.http import HttpResponse
 from ninja_extra import api_controller, route
 
+from core.background import run_in_background
 from .models import OAuthState, Repository, Branch
 from .schemas import *
+from .services.github_client import get_github_client
+from .services.enrichment import request_enrichment
 from .services.github_service import GitHubService
 from telegram_bot.utils import notify_user
-from telegram import Bot
-
-bot = Bot(token=settings.TELEGRAM_BOT_TOKEN)
 
 logger = logging.getLogger(__name__)
 github_service = GitHubService()
@@ -64,6 +63,10 @@ class GitHubAuthController:
     )
     async def callback(self, request):
         """GitHub OAuth callback handler"""
+        # On the process-wide loop, where the GitHub and Telegram clients live
+        return await run_in_background(self._complete_login(request))
+
+    async def _complete_login(self, request):
         try:
             state = request.GET.get("state")
             if (
@@ -93,15 +96,13 @@ class GitHubAuthController:
                 "redirect_uri": settings.GITHUB_REDIRECT_URI,
             }
 
-            async with httpx.AsyncClient() as client:
-                token_response = await client.post(
-                    "https://github.com/login/oauth/access_token",
-                    headers={"Accept": "application/json"},
-                    data=token_data,
-                    timeout=10,
-                )
-                token_response.raise_for_status()
-                token_json = token_response.json()
+            token_response = await get_github_client().post(
+                "https://github.com/login/oauth/access_token",
+                headers={"Accept": "application/json"},
+                data=token_data,
+            )
+            token_response.raise_for_status()
+            token_json = token_response.json()
 
             access_token = token_json.get("access_token")
             if not access_token:
@@ -109,13 +110,11 @@ class GitHubAuthController:
 
             start_time = time.perf_counter()
 
-        # Step 1: Get user + repos
+        # Step 1: Get user
             t1 = time.perf_counter()
             logger.info("Access token used: %s", access_token)
-            user_data = github_service.get_user_data(access_token)
-            repos_task = github_service.get_all_repos(access_token)
-            user_data, repos = await asyncio.gather(user_data, repos_task)
-            logger.info(f"Fetched user + repos in {time.perf_counter() - t1:.2f}s")
+            user_data = await github_service.get_user_data(access_token)
+            logger.info(f"Fetched user in {time.perf_counter() - t1:.2f}s")
 
         # Update user
             t2 = time.perf_counter()
@@ -123,13 +122,22 @@ class GitHubAuthController:
             user.chat_id = tg_id
             await user.asave(update_fields=["chat_id"])
             logger.info(f"Updated user in {time.perf_counter() - t2:.2f}s")
-            
-            t3 = time.perf_counter()
-            created_count = await github_service.update_repository(user, repos)
 
-            logger.info(f"Repositories synced: {created_count} created")
+        # Stream repo pages into the DB while later pages are still loading
+            sync = await github_service.sync_repositories(user, access_token)
+            logger.info(
+                f"Repositories synced: {sync['created']} created, "
+                f"{sync['updated']} updated, {sync['deleted']} deleted, "
+                f"{sync['unchanged']} unchanged"
+            )
+            logger.info(
+                f"Fetched {sync['pages']} repo pages in {sync['fetch_seconds']:.2f}s, "
+                f"DB writes took {sync['write_seconds']:.2f}s, "
+                f"sync total {sync['total_seconds']:.2f}s"
+            )
 
-            logger.info(f"Processed all {len(repos)} repos in {time.perf_counter() - t3:.2f}s")
+        # Prefetch branches/topics/license/permissions off the request path
+            await sync_to_async(request_enrichment)(user.id)
 
         # Step 5: Total time
             logger.info(f"TOTAL callback time: {time.perf_counter() - start_time:.2f}s")
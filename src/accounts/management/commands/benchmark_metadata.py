@@ -0,0 +1,166 @@
+import asyncio
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+from accounts.models import Repository, User
+from accounts.services.metadata import METADATA_BACKENDS, get_metadata_backend
+
+
+class _StubGitHub(BaseHTTPRequestHandler):
+    """
+    Minimal GitHub serving synthetic repositories over REST and GraphQL,
+    with a fixed latency per request.
+    """
+
+    latency = 0.05
+    branches = 5
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, data, headers=None):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _branches(self, name):
+        return [
+            {"name": f"branch-{i}", "sha": f"{i:040d}", "protected": i == 0}
+            for i in range(self.branches)
+        ]
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        match = re.match(r"/repos/[^/]+/([^/?]+)(/branches)?", self.path)
+        if not match:
+            self.send_error(404)
+            return
+        name, branches = match.groups()
+        if branches:
+            self._send(
+                [
+                    {
+                        "name": b["name"],
+                        "protected": b["protected"],
+                        "commit": {"sha": b["sha"], "url": "http://stub/commit"},
+                    }
+                    for b in self._branches(name)
+                ]
+            )
+            return
+        self._send(
+            {
+                "topics": ["stub"],
+                "default_branch": "branch-0",
+                "license": {"key": "mit", "name": "MIT", "spdx_id": "MIT", "node_id": "L"},
+                "permissions": {"admin": True, "push": True, "pull": True},
+            }
+        )
+
+    def do_POST(self):
+        time.sleep(self.latency)
+        query = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        ids = query["variables"]["ids"]
+        nodes = [
+            {
+                "id": node_id,
+                "defaultBranchRef": {"name": "branch-0"},
+                "viewerPermission": "ADMIN",
+                "licenseInfo": {"key": "mit", "name": "MIT", "spdxId": "MIT", "url": None, "id": "L"},
+                "repositoryTopics": {"nodes": [{"topic": {"name": "stub"}}]},
+                "refs": {
+                    "pageInfo": {"hasNextPage": False},
+                    "nodes": [
+                        {
+                            "name": b["name"],
+                            "target": {"oid": b["sha"]},
+                            "branchProtectionRule": {"id": "P"} if b["protected"] else None,
+                        }
+                        for b in self._branches(node_id)
+                    ],
+                },
+            }
+            for node_id in ids
+        ]
+        # GitHub charges about one point per 100 requested nodes
+        cost = max(1, len(ids) * (self.branches + 2) // 100)
+        self._send(
+            {"data": {"rateLimit": {"cost": cost, "remaining": 5000, "resetAt": ""}, "nodes": nodes}}
+        )
+
+
+class Command(BaseCommand):
+    help = "Compares the REST and GraphQL metadata backends (nothing is written)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--backends", default=",".join(METADATA_BACKENDS), help="Comma separated"
+        )
+        parser.add_argument(
+            "--user", type=int, help="Benchmark against GitHub with this user's repositories"
+        )
+        parser.add_argument(
+            "--repos", type=int, default=100, help="Number of repositories"
+        )
+        parser.add_argument(
+            "--latency", type=float, default=50, help="Stub latency per request in ms"
+        )
+
+    def handle(self, *args, **options):
+        backends = [name for name in options["backends"].split(",") if name]
+
+        if options["user"]:
+            user = User.objects.filter(id=options["user"]).first()
+            if user is None:
+                raise CommandError("User not found")
+            token = user.access_token
+            repositories = list(
+                Repository.objects.filter(user=user).order_by("-pushed_at")[: options["repos"]]
+            )
+            self._run(backends, token, repositories)
+            return
+
+        # Local stub server with synthetic repositories
+        _StubGitHub.latency = options["latency"] / 1000
+        server = ThreadingHTTPServer(("127.0.0.1", 0), _StubGitHub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}"
+        repositories = [
+            Repository(id=i, full_name=f"stub/repo-{i}", node_id=f"R_{i}")
+            for i in range(1, options["repos"] + 1)
+        ]
+        try:
+            with override_settings(
+                GITHUB_API_URL=url,
+                GITHUB_GRAPHQL_URL=f"{url}/graphql",
+                GITHUB_CACHE_BACKEND="",
+            ):
+                self._run(backends, "stub-token", repositories)
+        finally:
+            server.shutdown()
+
+    def _run(self, backends, token, repositories):
+        for name in backends:
+
+            async def run():
+                backend = get_metadata_backend(token, name)
+                start = time.perf_counter()
+                results = await backend.fetch(repositories)
+                return backend, results, time.perf_counter() - start
+
+            backend, results, elapsed = asyncio.run(run())
+            self.stdout.write(
+                f"{name:>8}: {len(results)}/{len(repositories)} repositories, "
+                f"{backend.requests} requests, {elapsed:.2f}s"
+            )
@@ -0,0 +1,20 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from accounts.services.enrichment import run_worker
+
+
+class Command(BaseCommand):
+    help = "Runs queued repository enrichments (GITHUB_ENRICH_MODE=queue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no enrichment is left"
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Processing enrichments...")
+        try:
+            asyncio.run(run_worker(once=options["once"]))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_githubresponsecache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='sync_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash of the synced GitHub fields, used to skip unchanged rows', max_length=40),
+        ),
+    ]
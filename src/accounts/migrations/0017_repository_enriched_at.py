@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_repository_sync_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repository',
+            name='enriched_at',
+            field=models.DateTimeField(blank=True, help_text='When branches, topics, license and permissions were last fetched', null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_repository_enriched_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='enrich_requested_at',
+            field=models.DateTimeField(blank=True, help_text="Set while an enrichment of the user's repositories is queued", null=True),
+        ),
+    ]
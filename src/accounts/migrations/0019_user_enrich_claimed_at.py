@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_user_enrich_requested_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='enrich_claimed_at',
+            field=models.DateTimeField(blank=True, help_text='Set while a worker runs the queued enrichment', null=True),
+        ),
+    ]
@@ -24,6 +24,16 @@ class User(AbstractUser,models.Model):
     current_branch = models.CharField(max_length=255, null=True, blank=True)
     followers = models.IntegerField(default=0)
     following = models.IntegerField(default=0)
+    enrich_requested_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Set while an enrichment of the user's repositories is queued",
+    )
+    enrich_claimed_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Set while a worker runs the queued enrichment",
+    )
 
     def __str__(self):
         return self.github_login
@@ -77,6 +87,17 @@ class Repository(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     pushed_at = models.DateTimeField(null=True, blank=True)
+    sync_hash = models.CharField(
+        max_length=40,
+        blank=True,
+        default="",
+        help_text="Hash of the synced GitHub fields, used to skip unchanged rows",
+    )
+    enriched_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="When branches, topics, license and permissions were last fetched",
+    )
 
     class Meta:
         unique_together = ("user", "repo_id")  # Prevents duplicates per user
@@ -147,3 +168,17 @@ class OAuthState(models.Model):
 
     def __str__(self):
         return f"OAuthState (expires: {self.expires_at})"
+
+
+class GitHubResponseCache(models.Model):
+    """Conditional-request cache entry for a GitHub REST response."""
+
+    key = models.CharField(max_length=64, unique=True)
+    etag = models.CharField(max_length=255, null=True, blank=True)
+    last_modified = models.CharField(max_length=64, null=True, blank=True)
+    headers = models.JSONField(default=dict)
+    body = models.BinaryField()
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"GitHub response {self.key[:12]} ({self.etag})"
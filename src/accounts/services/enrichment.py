@@ -0,0 +1,184 @@
+# src/accounts/services/enrichment.py
+"""
+Background enrichment after login: branches, topics, license and
+permissions of the user's most recently pushed repositories are fetched
+ahead of time, so selecting one of them in the bot needs no GitHub calls.
+Repositories not covered (or not yet reached) are still fetched lazily by
+select_repo_callback.
+A login queues the work on the user row (enrich_requested_at); it is run
+by manage.py process_enrichment, or on the background loop with
+GITHUB_ENRICH_MODE=inline. A running enrichment is marked with
+enrich_claimed_at and only dequeued once it finished.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from core.background import submit
+from preview.fetcher import FetchScheduler
+from preview.jobs import refresh_moved_branches
+from ..models import Repository, User
+from .github_service import GitHubService
+from .metadata import RepositoryMetadata, RestMetadataBackend, get_metadata_backend
+
+logger = logging.getLogger(__name__)
+
+github_service = GitHubService()
+
+
+def _expired_before():
+    return timezone.now() - timedelta(seconds=settings.GITHUB_ENRICH_TTL)
+
+
+def needs_enrichment(repository: Repository) -> bool:
+    """
+    True if the repository was never enriched, was pushed to since, or was
+    enriched more than GITHUB_ENRICH_TTL ago (topics, license and
+    permissions change without a push).
+    """
+    if repository.enriched_at is None or repository.enriched_at < _expired_before():
+        return True
+    return bool(repository.pushed_at and repository.pushed_at > repository.enriched_at)
+
+
+async def store_metadata(
+    repository: Repository, meta: RepositoryMetadata, service: GitHubService = github_service
+):
+    """
+    Write fetched metadata to the repository's related rows; previews of
+    branches whose head moved are queued for a refresh.
+    """
+    branch_sync = await service._update_branches_in_db(repository, meta.branches)
+    if branch_sync.moved:
+        await refresh_moved_branches(repository, branch_sync.moved)
+    await service._update_topics_in_db(repository, meta.topics)
+    await service._update_license(repository, meta.license)
+    await service._update_permissions(repository, meta.permissions)
+
+    repository.enriched_at = timezone.now()
+    await repository.asave(update_fields=["enriched_at"])
+
+
+async def enrich_repository(repository: Repository, scheduler: FetchScheduler):
+    """Fetch (over REST) and store the metadata of a single repository."""
+    meta = await RestMetadataBackend(scheduler.github_token, scheduler).fetch_one(repository)
+    await store_metadata(repository, meta)
+
+
+async def enrich_user_repositories(user_id: int, limit: int = None) -> int:
+    """
+    Enrich up to limit of the user's most recently pushed repositories that
+    need it, through the GITHUB_METADATA_BACKEND backend. Both backends stop
+    early when the token's budget runs low, leaving the rest to interactive
+    use. Returns the number of repositories enriched.
+    """
+    limit = limit or settings.GITHUB_ENRICH_REPOS
+    user = await User.objects.filter(id=user_id).afirst()
+    if user is None:
+        return 0
+
+    stale = (
+        Q(enriched_at__isnull=True)
+        | Q(enriched_at__lt=_expired_before())
+        | Q(pushed_at__gt=F("enriched_at"))
+    )
+    repositories = [
+        repo
+        async for repo in Repository.objects.filter(stale, user=user).order_by(
+            F("pushed_at").desc(nulls_last=True)
+        )[:limit]
+    ]
+    if not repositories:
+        return 0
+
+    backend = get_metadata_backend(user.access_token)
+    metadata = await backend.fetch(repositories)
+    for repository in repositories:
+        if repository.id in metadata:
+            await store_metadata(repository, metadata[repository.id])
+
+    logger.info(
+        f"[enrich] {user.github_login}: enriched {len(metadata)} of "
+        f"{len(repositories)} repositories with {backend.requests} requests"
+    )
+    return len(metadata)
+
+
+def request_enrichment(user_id: int):
+    """Queue an enrichment of the user's repositories; started right away in inline mode."""
+    User.objects.filter(id=user_id).update(enrich_requested_at=timezone.now())
+    if settings.GITHUB_ENRICH_MODE == "inline":
+        submit(process_enrichments(user_id=user_id))
+
+
+def release_stale_enrichments() -> int:
+    """Hand enrichments of crashed or failed runs back to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=settings.GITHUB_ENRICH_STALE_AFTER)
+    return User.objects.filter(enrich_claimed_at__lt=cutoff).update(enrich_claimed_at=None)
+
+
+@transaction.atomic
+def claim_enrichments(limit: int, user_id: int = None) -> Tuple[datetime, List[int]]:
+    """
+    Claim up to limit queued enrichments, oldest first. The request stays
+    on the row until finish_enrichment, so a run that never finishes is
+    picked up again once its claim is stale.
+    """
+    rows = User.objects.filter(
+        enrich_requested_at__isnull=False, enrich_claimed_at__isnull=True
+    ).order_by("enrich_requested_at")
+    if user_id is not None:
+        rows = rows.filter(id=user_id)
+    if connection.features.has_select_for_update_skip_locked:
+        rows = rows.select_for_update(skip_locked=True)
+    claimed_at = timezone.now()
+    ids = list(rows.values_list("id", flat=True)[:limit])
+    User.objects.filter(id__in=ids).update(enrich_claimed_at=claimed_at)
+    return claimed_at, ids
+
+
+@transaction.atomic
+def finish_enrichment(user_id: int, claimed_at: datetime):
+    """Dequeue a finished enrichment, unless it was requested again while running."""
+    claim = User.objects.filter(id=user_id, enrich_claimed_at=claimed_at)
+    claim.filter(enrich_requested_at__lte=claimed_at).update(enrich_requested_at=None)
+    claim.update(enrich_claimed_at=None)
+
+
+async def process_enrichments(limit: int = 1, user_id: int = None) -> int:
+    """
+    Run up to limit queued enrichments one after another; returns how many
+    ran. A failed run keeps its claim and is retried once the claim is
+    stale (GITHUB_ENRICH_STALE_AFTER).
+    """
+    released = await sync_to_async(release_stale_enrichments)()
+    if released:
+        logger.warning(f"[enrich] re-queued {released} stale enrichments")
+
+    claimed_at, user_ids = await sync_to_async(claim_enrichments)(limit, user_id=user_id)
+    for id_ in user_ids:
+        try:
+            await enrich_user_repositories(id_)
+        except Exception as e:
+            logger.error(f"[enrich] user {id_} failed: {str(e)}", exc_info=True)
+            continue
+        await sync_to_async(finish_enrichment)(id_, claimed_at)
+    return len(user_ids)
+
+
+async def run_worker(poll_interval: float = None, once: bool = False):
+    """Run queued enrichments until cancelled (or drained, with once)."""
+    poll_interval = poll_interval or settings.GITHUB_ENRICH_POLL_INTERVAL
+    while True:
+        if await process_enrichments():
+            continue
+        if once:
+            return
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,113 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+# Response headers worth replaying when a 304 is served from the cache
+CACHED_HEADERS = ("etag", "last-modified", "link", "content-type")
+
+
+class CachedResponse(NamedTuple):
+    etag: Optional[str]
+    last_modified: Optional[str]
+    headers: Dict[str, str]
+    body: bytes
+
+
+def cache_key(access_token: str, url: str, params: dict = None, accept: str = "") -> str:
+    """Per (token, URL) key; the token is hashed so it is never stored."""
+    query = "&".join(f"{k}={v}" for k, v in sorted((params or {}).items()))
+    raw = f"{access_token}\n{url}?{query}\n{accept}"
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class InMemoryCacheBackend:
+    """Process-local LRU of the last GITHUB_CACHE_MAX_ENTRIES responses."""
+
+    def __init__(self):
+        self.max_entries = settings.GITHUB_CACHE_MAX_ENTRIES
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    async def set(self, key: str, entry: CachedResponse):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DjangoCacheBackend:
+    """Stores responses in the Django cache named by GITHUB_CACHE_ALIAS."""
+
+    def __init__(self):
+        self.cache = caches[settings.GITHUB_CACHE_ALIAS]
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        value = await self.cache.aget(f"github:{key}")
+        return CachedResponse(*value) if value else None
+
+    async def set(self, key: str, entry: CachedResponse):
+        await self.cache.aset(f"github:{key}", tuple(entry), timeout=None)
+
+
+class DatabaseCacheBackend:
+    """Stores responses in the GitHubResponseCache table (shared by all workers)."""
+
+    async def get(self, key: str) -> Optional[CachedResponse]:
+        from ..models import GitHubResponseCache
+
+        row = await GitHubResponseCache.objects.filter(key=key).afirst()
+        if row is None:
+            return None
+        return CachedResponse(row.etag, row.last_modified, row.headers, bytes(row.body))
+
+    async def set(self, key: str, entry: CachedResponse):
+        from ..models import GitHubResponseCache
+
+        await GitHubResponseCache.objects.aupdate_or_create(
+            key=key,
+            defaults={
+                "etag": entry.etag,
+                "last_modified": entry.last_modified,
+                "headers": entry.headers,
+                "body": entry.body,
+            },
+        )
+
+
+CACHE_BACKENDS = {
+    "memory": InMemoryCacheBackend,
+    "django": DjangoCacheBackend,
+    "database": DatabaseCacheBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend():
+    """
+    Backend selected by GITHUB_CACHE_BACKEND: "memory", "django", "database",
+    a dotted path to a class with async get/set, or "" to disable caching.
+    """
+    global _backend
+    name = settings.GITHUB_CACHE_BACKEND
+    if not name:
+        return None
+    with _backend_lock:
+        if _backend is None:
+            backend_class = CACHE_BACKENDS.get(name) or import_string(name)
+            _backend = backend_class()
+        return _backend
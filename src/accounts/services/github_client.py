@@ -0,0 +1,168 @@
+import asyncio
+import contextlib
+import functools
+import importlib.util
+import logging
+import weakref
+
+import httpx
+from django.conf import settings
+
+from core.background import on_shutdown
+from .github_cache import CACHED_HEADERS, CachedResponse, cache_key, get_cache_backend
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HEADERS = {"Accept": "application/vnd.github.v3+json"}
+
+# One pooled client per event loop: httpx clients cannot be shared across
+# loops. Web requests use the one of the process-wide background loop
+# (core.background), since sync Django runs each async view in its own
+# short-lived loop; workers use the one of their own loop.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+    weakref.WeakKeyDictionary()
+)
+# Concurrent paged requests per event loop, shared by every caller of the
+# loop's client so parallel syncs do not add up to a burst
+_limiters: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _http2_enabled() -> bool:
+    if not settings.GITHUB_HTTP2:
+        return False
+    # HTTP/2 needs the optional "h2" package (pip install httpx[http2])
+    if importlib.util.find_spec("h2") is None:
+        logger.warning("GITHUB_HTTP2 is set but h2 is not installed, using HTTP/1.1")
+        return False
+    return True
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_enabled(),
+        headers=DEFAULT_HEADERS,
+        limits=httpx.Limits(
+            max_connections=settings.GITHUB_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.GITHUB_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.GITHUB_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(settings.GITHUB_TIMEOUT),
+    )
+
+
+def get_github_client() -> httpx.AsyncClient:
+    """Shared keep-alive client for the running event loop, created lazily."""
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        client = _build_client()
+        _clients[loop] = client
+    return client
+
+
+def get_request_limiter() -> asyncio.Semaphore:
+    """Semaphore of GITHUB_FETCH_CONCURRENCY slots for the running event loop."""
+    loop = asyncio.get_running_loop()
+    limiter = _limiters.get(loop)
+    if limiter is None:
+        limiter = _limiters[loop] = asyncio.Semaphore(settings.GITHUB_FETCH_CONCURRENCY)
+    return limiter
+
+
+@on_shutdown
+async def close_github_client():
+    """Close the running loop's client; runs at shutdown of the background loop."""
+    client = _clients.pop(asyncio.get_running_loop(), None)
+    if client is not None and not client.is_closed:
+        await client.aclose()
+
+
+async def github_request(
+    access_token: str,
+    url: str,
+    params: dict = None,
+    headers: dict = None,
+    method: str = "GET",
+    cache: bool = False,
+    **kwargs,
+) -> httpx.Response:
+    """
+    Send an authenticated request through the shared client.
+    With cache=True a GET is sent as a conditional request against the
+    response cache; a 304 (free in GitHub's rate limit) is answered from it.
+    """
+    request_headers = {**DEFAULT_HEADERS, **(headers or {})}
+    if access_token:
+        request_headers["Authorization"] = f"Bearer {access_token}"
+
+    backend = get_cache_backend() if cache and method == "GET" else None
+    if backend is None:
+        return await get_github_client().request(
+            method, url, params=params, headers=request_headers, **kwargs
+        )
+
+    key = cache_key(access_token, url, params, request_headers.get("Accept", ""))
+    entry = await backend.get(key)
+    if entry is not None:
+        if entry.etag:
+            request_headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            request_headers["If-Modified-Since"] = entry.last_modified
+
+    response = await get_github_client().request(
+        method, url, params=params, headers=request_headers, **kwargs
+    )
+
+    if response.status_code == 304 and entry is not None:
+        # Replay the cached body, keeping the fresh rate limit headers
+        fresh = {
+            k: v for k, v in response.headers.items() if k.lower().startswith("x-ratelimit")
+        }
+        return httpx.Response(
+            200,
+            headers={**entry.headers, **fresh},
+            content=entry.body,
+            request=response.request,
+        )
+
+    if response.status_code == 200 and (
+        "etag" in response.headers or "last-modified" in response.headers
+    ):
+        await backend.set(
+            key,
+            CachedResponse(
+                etag=response.headers.get("etag"),
+                last_modified=response.headers.get("last-modified"),
+                headers={
+                    k: response.headers[k] for k in CACHED_HEADERS if k in response.headers
+                },
+                body=response.content,
+            ),
+        )
+    return response
+
+
+@contextlib.asynccontextmanager
+async def github_stream(
+    access_token: str,
+    url: str,
+    params: dict = None,
+    headers: dict = None,
+    method: str = "GET",
+    **kwargs,
+):
+    """
+    Like github_request, for bodies too large to hold in memory: yields the
+    response of the shared client unread (see response.aiter_bytes()).
+    Streamed responses are never cached.
+    """
+    request_headers = {**DEFAULT_HEADERS, **(headers or {})}
+    if access_token:
+        request_headers["Authorization"] = f"Bearer {access_token}"
+    async with get_github_client().stream(
+        method, url, params=params, headers=request_headers, **kwargs
+    ) as response:
+        yield response
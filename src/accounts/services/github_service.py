@@ -1,13 +1,97 @@
+import asyncio
+import hashlib
+import json
 import logging
-from datetime import datetime, timedelta
-from typing import List, Optional
+import time
+from datetime import timedelta
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional
+from urllib.parse import parse_qs, urlparse
 
 import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from ..models import *
+from .github_client import get_request_limiter, github_request
 
 logger = logging.getLogger(__name__)
 
+# Repository fields copied verbatim from the GitHub repository payload
+REPOSITORY_FIELDS = [
+    "node_id",
+    "name",
+    "full_name",
+    "private",
+    "description",
+    "fork",
+    "url",
+    "html_url",
+    "git_url",
+    "ssh_url",
+    "clone_url",
+    "svn_url",
+    "homepage",
+    "size",
+    "stargazers_count",
+    "watchers_count",
+    "language",
+    "has_issues",
+    "has_projects",
+    "has_downloads",
+    "has_wiki",
+    "has_pages",
+    "has_discussions",
+    "forks_count",
+    "mirror_url",
+    "archived",
+    "disabled",
+    "open_issues_count",
+    "allow_forking",
+    "is_template",
+    "web_commit_signoff_required",
+    "visibility",
+    "default_branch",
+]
+
+
+class BranchSync(NamedTuple):
+    """Outcome of a branch sync; moved are the branches whose head changed."""
+
+    branches: List[Branch]
+    created: List[Branch]
+    moved: List[Branch]
+    deleted: List[str]
+
+
+def repository_values(repo: dict) -> dict:
+    """Model field values for a GitHub repository payload."""
+    values = {}
+    for field in REPOSITORY_FIELDS:
+        value = repo.get(field)
+        model_field = Repository._meta.get_field(field)
+        if value is None:
+            # Missing keys fall back to the model default; nullable fields keep None
+            if not model_field.null:
+                value = model_field.get_default()
+        elif isinstance(value, str) and len(value) > (model_field.max_length or len(value)):
+            # Bulk writes skip validation, and the database would reject the
+            # whole page: a cut URL is useless, so nullable fields are dropped
+            value = None if model_field.null else value[: model_field.max_length]
+        values[field] = value
+    if values["homepage"] == "":
+        values["homepage"] = None
+    values["pushed_at"] = parse_datetime(repo["pushed_at"]) if repo.get("pushed_at") else None
+    return values
+
+
+def sync_hash(values: dict) -> str:
+    """Fingerprint of the synced fields, to skip rows that did not change."""
+    payload = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
 
 class GitHubService:
     def __init__(self):
@@ -17,66 +101,135 @@ class GitHubService:
         self, access_token: str, url: str, params: dict = None, headers: dict = None
     ) -> dict:
         """Async helper method to make GitHub API requests"""
-        if headers is None:
-            headers = {**self.headers, "Authorization": f"Bearer {access_token}"}
-        else:
-            headers = {**headers, "Authorization": f"Bearer {access_token}"}
-
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=params, timeout=10)
-            response.raise_for_status()
-            return response.json()
+        response = await github_request(
+            access_token, url, params=params, headers=headers or self.headers, cache=True
+        )
+        response.raise_for_status()
+        return response.json()
 
     async def get_user_data(self, access_token: str) -> dict:
         """Fetch user data from GitHub"""
-        return await self._make_request(access_token, "https://api.github.com/user")
+        return await self._make_request(access_token, f"{settings.GITHUB_API_URL}/user")
 
-    async def get_all_repos(self, access_token: str) -> List[dict]:
-        """Fetch all repositories with pagination"""
-        repos = []
-        page = 1
-        per_page = 100
+    async def _get_page(
+        self, access_token: str, url: str, params: dict, page: int
+    ) -> httpx.Response:
+        try:
+            response = await github_request(
+                access_token,
+                url,
+                params={**params, "page": page},
+                headers=self.headers,
+                cache=True,
+            )
+            response.raise_for_status()
+            return response
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to fetch {url} page {page}: {str(e)}")
+            raise
+
+    async def iter_pages(
+        self,
+        access_token: str,
+        url: str,
+        params: dict = None,
+        per_page: int = 100,
+        window: int = None,
+    ) -> AsyncIterator[List[dict]]:
+        """
+        Yield every page of a paginated list endpoint. The first response's
+        Link rel="last" gives the page count; the remaining pages are then
+        requested concurrently and yielded as they arrive, so not necessarily
+        in page order. At most window pages (GITHUB_FETCH_CONCURRENCY by
+        default) are in flight or waiting to be yielded: a new request starts
+        only once the consumer took a page, so a slow consumer slows the
+        fetching down instead of having the listing pile up in memory.
+        """
+        params = {**(params or {}), "per_page": per_page}
+        first = await self._get_page(access_token, url, params, 1)
+        yield first.json()
+
+        last = first.links.get("last")
+        if last is None:
+            # No rel="last": single page, or an endpoint that only links "next"
+            page, response = 1, first
+            while "next" in response.links:
+                page += 1
+                response = await self._get_page(access_token, url, params, page)
+                yield response.json()
+            return
 
-        while True:
-            try:
-                batch = await self._make_request(
-                    access_token,
-                    "https://api.github.com/user/repos",
-                    params={"page": page, "per_page": per_page, "sort": "updated"},
-                )
-                if not batch:
-                    break
+        last_page = int(parse_qs(urlparse(last["url"]).query)["page"][0])
+        window = window or settings.GITHUB_FETCH_CONCURRENCY
+        limiter = get_request_limiter()
 
-                repos.extend(batch)
-                page += 1
+        async def fetch(page):
+            async with limiter:
+                response = await self._get_page(access_token, url, params, page)
+            return response.json()
 
-                if len(batch) < per_page:
-                    break
-            except httpx.HTTPError as e:
-                logger.error(f"Failed to fetch repos page {page}: {str(e)}")
-                break
+        pages = iter(range(2, last_page + 1))
+        pending = set()
+        try:
+            while True:
+                for page in pages:
+                    pending.add(asyncio.create_task(fetch(page)))
+                    if len(pending) >= window:
+                        break
+                if not pending:
+                    return
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # Consumer stopped early or a page failed: drop the rest
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def iter_repo_pages(self, access_token: str) -> AsyncIterator[List[dict]]:
+        """Pages of the authenticated user's repositories."""
+        # A stable sort: with "updated", a push during the concurrent page
+        # requests could shift a repository across pages and drop it
+        return self.iter_pages(
+            access_token,
+            f"{settings.GITHUB_API_URL}/user/repos",
+            params={"sort": "full_name"},
+        )
 
-        return repos
+    async def get_all_repos(self, access_token: str) -> List[dict]:
+        """
+        Fetch all repositories.
+        Errors are raised rather than returning a partial list, which
+        update_repository would take as the other repositories being gone.
+        """
+        repos = {}
+        async for page in self.iter_repo_pages(access_token):
+            # Keyed by id: a repository created meanwhile can shift another
+            # one onto the next page as well
+            repos.update((repo["id"], repo) for repo in page)
+        return list(repos.values())
 
     async def get_repo_branches(self, access_token: str, full_name: str) -> List[dict]:
-        """Fetch branches for a repository"""
-        return await self._make_request(
-            access_token, f"https://api.github.com/repos/{full_name}/branches"
-        )
+        """Fetch all branches of a repository (pages are requested concurrently)"""
+        branches = {}
+        async for page in self.iter_pages(
+            access_token, f"{settings.GITHUB_API_URL}/repos/{full_name}/branches"
+        ):
+            branches.update((branch["name"], branch) for branch in page)
+        return list(branches.values())
 
     async def get_repo_topics(self, access_token: str, full_name: str) -> dict:
         """Fetch repository topics"""
         return await self._make_request(
             access_token,
-            f"https://api.github.com/repos/{full_name}/topics",
+            f"{settings.GITHUB_API_URL}/repos/{full_name}/topics",
             headers={"Accept": "application/vnd.github.mercy-preview+json"},
         )
 
     async def update_user_data(self, user_data: dict, access_token: str) -> User:
         """Create or update user from GitHub data"""
-        
-
-        user, created = User.objects.update_or_create(
+        user, created = await User.objects.aupdate_or_create(
             github_id=user_data["id"],
             defaults={
                 "username": user_data["login"],
@@ -87,117 +240,248 @@ class GitHubService:
                 "followers": user_data.get("followers", 0),
                 "following": user_data.get("following", 0),
                 "access_token": access_token,
-                "sso_token_expiry": datetime.now() + timedelta(days=7),
+                "sso_token_expiry": timezone.now() + timedelta(days=7),
             },
         )
         return user
 
-    async def update_repository(self, user: User, repos: dict) -> List[Repository]:
-        """Version that returns created repositories"""
-        if not repos:
-            return 0
-
-        repo_ids = [r["id"] for r in repos]
-        existing_ids = set(
-            [
-                r.repo_id
-                async for r in Repository.objects.filter(
-                    user=user, repo_id__in=repo_ids
-                )
-            ]
+    async def update_repository(self, user: User, repos: List[dict]) -> Dict[str, int]:
+        """
+        Sync the user's repositories with the full GitHub listing: new ones
+        are created, rows whose sync_hash changed are updated and the ones no
+        longer listed are deleted. Returns counts per outcome.
+        """
+        return await sync_to_async(self._sync_repositories)(user, repos)
+
+    @transaction.atomic
+    def _sync_repositories(self, user: User, repos: List[dict]) -> Dict[str, int]:
+        # One query for the current state, then one bulk statement (per
+        # batch) for each of create / update / delete
+        existing = self._repository_hashes(user)
+        seen = set()
+        created, updated = self._write_repository_batch(user, repos, existing, seen)
+        deleted = self._delete_vanished_repositories(user, existing, seen)
+
+        counts = {
+            "created": created,
+            "updated": updated,
+            "deleted": deleted,
+            "unchanged": len(seen) - created - updated,
+        }
+        logger.info(f"Synced repositories of {user.github_login}: {counts}")
+        return counts
+
+    async def sync_repositories(self, user: User, access_token: str) -> Dict[str, float]:
+        """
+        Streaming version of get_all_repos + update_repository: pages flow
+        from the fetcher through a bounded queue (GITHUB_SYNC_QUEUE_PAGES) to
+        a writer that stores each page while later ones are still in flight.
+        A full queue holds the fetcher back (see iter_pages), so at most
+        GITHUB_SYNC_QUEUE_PAGES + GITHUB_FETCH_CONCURRENCY pages are held in
+        memory however slow the writes are. Vanished repositories are
+        deleted once every page has arrived.
+        Returns the sync counts plus per-stage timings in seconds.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=settings.GITHUB_SYNC_QUEUE_PAGES)
+        stats = {
+            "pages": 0,
+            "created": 0,
+            "updated": 0,
+            "deleted": 0,
+            "fetch_seconds": 0.0,
+            "write_seconds": 0.0,
+        }
+
+        async def produce():
+            start = time.perf_counter()
+            try:
+                async for page in self.iter_repo_pages(access_token):
+                    stats["pages"] += 1
+                    await queue.put(page)
+            finally:
+                stats["fetch_seconds"] = time.perf_counter() - start
+                await queue.put(None)
+
+        start = time.perf_counter()
+        existing = await sync_to_async(self._repository_hashes)(user)
+        seen = set()
+        producer = asyncio.create_task(produce())
+        try:
+            while (page := await queue.get()) is not None:
+                t = time.perf_counter()
+                created, updated = await sync_to_async(
+                    transaction.atomic(self._write_repository_batch)
+                )(user, page, existing, seen)
+                stats["created"] += created
+                stats["updated"] += updated
+                stats["write_seconds"] += time.perf_counter() - t
+            # Raises if a page failed, before anything is deleted
+            await producer
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+
+        t = time.perf_counter()
+        # Pages are offsets into a listing that can shift while they are
+        # fetched, so a repository missing from every page may still exist
+        vanished = [repo_id for repo_id in existing if repo_id not in seen]
+        seen |= await self._still_existing(access_token, vanished)
+        stats["deleted"] = await sync_to_async(self._delete_vanished_repositories)(
+            user, existing, seen
         )
+        stats["write_seconds"] += time.perf_counter() - t
+        stats["unchanged"] = len(seen) - stats["created"] - stats["updated"]
+        stats["total_seconds"] = time.perf_counter() - start
+        logger.info(f"Synced repositories of {user.github_login}: {stats}")
+        return stats
+
+    def _repository_hashes(self, user: User) -> Dict[int, tuple]:
+        """{repo_id: (pk, sync_hash)} of the user's stored repositories."""
+        return {
+            repo_id: (pk, stored_hash)
+            for pk, repo_id, stored_hash in Repository.objects.filter(
+                user=user
+            ).values_list("id", "repo_id", "sync_hash")
+        }
 
-        to_create = [
-            Repository(
-                repo_id=repo["id"],
-                user=user,
-                node_id=repo["node_id"],
-                name=repo["name"],
-                full_name=repo["full_name"],
-                private=repo["private"],
-                description=repo.get("description"),
-            )
-            for repo in repos
-            if repo["id"] not in existing_ids
-        ]
+    def _write_repository_batch(
+        self, user: User, repos: List[dict], existing: Dict[int, tuple], seen: set
+    ) -> tuple:
+        """Create the new and update the changed repos; adds their ids to seen."""
+        now = timezone.now()
+        to_create, to_update = [], []
+        for repo in repos:
+            if repo["id"] in seen:
+                continue
+            seen.add(repo["id"])
+            values = repository_values(repo)
+            values["sync_hash"] = sync_hash(values)
+            if repo["id"] not in existing:
+                to_create.append(Repository(user=user, repo_id=repo["id"], **values))
+                continue
+            pk, stored_hash = existing[repo["id"]]
+            if stored_hash != values["sync_hash"]:
+                to_update.append(
+                    Repository(id=pk, user=user, repo_id=repo["id"], updated_at=now, **values)
+                )
 
         if to_create:
-            created = await Repository.objects.abulk_create(to_create, batch_size=100)
-            return created
-        return []
-
-    async def update_branches(self, access_token: str, repository: Repository):
+            Repository.objects.bulk_create(to_create, batch_size=100)
+        if to_update:
+            Repository.objects.bulk_update(
+                to_update,
+                fields=REPOSITORY_FIELDS + ["pushed_at", "sync_hash", "updated_at"],
+                batch_size=100,
+            )
+        return len(to_create), len(to_update)
+
+    async def _still_existing(self, access_token: str, repo_ids: List[int]) -> set:
+        """
+        The ids among repo_ids that GitHub still serves to the token. Only a
+        404 counts as gone; any other failure keeps the repository, to be
+        checked again on the next sync.
+        """
+        limiter = get_request_limiter()
+
+        async def exists(repo_id):
+            async with limiter:
+                try:
+                    response = await github_request(
+                        access_token,
+                        f"{settings.GITHUB_API_URL}/repositories/{repo_id}",
+                        headers=self.headers,
+                    )
+                except httpx.HTTPError as e:
+                    logger.warning(f"Could not re-check repository {repo_id}: {str(e)}")
+                    return True
+            return response.status_code != 404
+
+        found = await asyncio.gather(*(exists(repo_id) for repo_id in repo_ids))
+        kept = {repo_id for repo_id, exists in zip(repo_ids, found) if exists}
+        if kept:
+            logger.info(f"Kept {len(kept)} repositories missing from the listing")
+        return kept
+
+    def _delete_vanished_repositories(
+        self, user: User, existing: Dict[int, tuple], seen: set
+    ) -> int:
+        vanished = [repo_id for repo_id in existing if repo_id not in seen]
+        if vanished:
+            Repository.objects.filter(user=user, repo_id__in=vanished).delete()
+        return len(vanished)
+
+    async def update_branches(self, access_token: str, repository: Repository) -> "BranchSync":
         """Update branches for a repository"""
         try:
             branches = await self.get_repo_branches(access_token, repository.full_name)
-            db_branches = await self._update_branches_in_db(repository, branches)
-            return db_branches
+            return await self._update_branches_in_db(repository, branches)
         except Exception as e:
             logger.error(f"Failed to update branches for {repository.full_name}: {str(e)}")
-            return []
+            return BranchSync([], [], [], [])
 
     @sync_to_async
     @transaction.atomic
-    async def _update_branches_in_db(self, repository: Repository, branches: List[dict]):
-
-        """Async method to update branches in database using bulk operations and return refreshed objects"""
-
-        existing_branches_query = repository.branches.all()
-        existing_branches = {
-            branch.name: branch async for branch in existing_branches_query
-        }
+    def _update_branches_in_db(self, repository: Repository, branches: List[dict]) -> "BranchSync":
+        """
+        Diff the fetched branches against the stored ones in one transaction:
+        vanished branches are deleted, new ones created, and only rows whose
+        head, protection or commit URL changed are updated.
+        """
+        existing_branches = {branch.name: branch for branch in repository.branches.all()}
         current_branch_names = {branch["name"] for branch in branches}
-        """Sync method to update branches in database"""
+
         # Delete old branches not present anymore
-        to_delete = [
+        deleted = [
             name for name in existing_branches if name not in current_branch_names
         ]
-        if to_delete:
-            await repository.branches.filter(name__in=to_delete).adelete()
+        if deleted:
+            repository.branches.filter(name__in=deleted).delete()
 
-        # Prepare batches for bulk operations
         to_create = []
         to_update = []
+        moved = []
 
         for branch in branches:
-            branch_name = branch["name"]
             commit = branch.get("commit", {})
-            defaults = {
+            values = {
                 "protected": branch.get("protected", False),
                 "last_commit_sha": commit.get("sha", ""),
                 "last_commit_url": commit.get("url", ""),
             }
 
-            if branch_name in existing_branches:
-                # Update existing branch
-                db_branch = existing_branches[branch_name]
-                for field, value in defaults.items():
-                    setattr(db_branch, field, value)
-                to_update.append(db_branch)
-            else:
-                # Create new branch
+            db_branch = existing_branches.get(branch["name"])
+            if db_branch is None:
                 to_create.append(
-                    Branch(repository=repository, name=branch_name, **defaults)
+                    Branch(repository=repository, name=branch["name"], **values)
                 )
+                continue
+            if all(getattr(db_branch, field) == value for field, value in values.items()):
+                continue
+            if db_branch.last_commit_sha != values["last_commit_sha"]:
+                moved.append(db_branch)
+            for field, value in values.items():
+                setattr(db_branch, field, value)
+            to_update.append(db_branch)
 
-        # Perform bulk operations
         if to_create:
-            await Branch.objects.abulk_create(to_create)
-
+            Branch.objects.bulk_create(to_create, batch_size=500)
         if to_update:
-            await Branch.objects.abulk_update(
-                to_update, fields=["protected", "last_commit_sha", "last_commit_url"]
+            Branch.objects.bulk_update(
+                to_update,
+                fields=["protected", "last_commit_sha", "last_commit_url"],
+                batch_size=500,
             )
 
-        # Refresh all branches from DB to get complete updated instances
-        refreshed_branches = [
-            branch
-            async for branch in repository.branches.filter(
-                name__in=current_branch_names
-            )
-        ]
-
-        return refreshed_branches
+        logger.info(
+            f"Synced branches of {repository.full_name}: {len(to_create)} created, "
+            f"{len(moved)} moved, {len(deleted)} deleted"
+        )
+        return BranchSync(
+            branches=list(repository.branches.filter(name__in=current_branch_names)),
+            created=to_create,
+            moved=moved,
+            deleted=deleted,
+        )
 
     async def _update_permissions(self, repository: Repository, permissions: dict):
         """Update repository permissions using bulk operations"""
@@ -273,7 +557,7 @@ class GitHubService:
         try:
             topics_response = await self._make_request(
                 access_token,
-                f"https://api.github.com/repos/{repository.full_name}/topics",
+                f"{settings.GITHUB_API_URL}/repos/{repository.full_name}/topics",
                 headers={"Accept": "application/vnd.github.mercy-preview+json"},
             )
             topics = topics_response.get("names", [])
@@ -298,12 +582,18 @@ class GitHubService:
         # Identify topics that need to be created
         topics_to_create = [name for name in topics if name not in existing_topics]
 
-        # Bulk create missing topics
+        # Bulk create missing topics; another repo may be creating the same
+        # ones concurrently, so re-read them instead of trusting the insert
         if topics_to_create:
-            new_topics = await Topic.objects.abulk_create(
-                [Topic(name=name) for name in topics_to_create]
+            await Topic.objects.abulk_create(
+                [Topic(name=name) for name in topics_to_create], ignore_conflicts=True
+            )
+            existing_topics.update(
+                {
+                    topic.name: topic
+                    async for topic in Topic.objects.filter(name__in=topics_to_create)
+                }
             )
-            existing_topics.update({topic.name: topic for topic in new_topics})
 
         # Bulk add all topics to repository
         topic_objects = [existing_topics[name] for name in topics]
@@ -313,7 +603,7 @@ class GitHubService:
         try:
             return await self._make_request(
                 access_token,
-                f"https://api.github.com/repos/{owner}/{repository}/git/trees/{branch}",
+                f"{settings.GITHUB_API_URL}/repos/{owner}/{repository}/git/trees/{branch}",
             )
         except Exception as e:
             logger.error(f"Failed to fetch codebase for {repository}: {str(e)}")
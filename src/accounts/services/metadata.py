@@ -0,0 +1,265 @@
+# src/accounts/services/metadata.py
+"""
+Backends that fetch repository metadata for enrichment: topics, license,
+viewer permissions, default branch and branch heads. Both return the same
+REST-shaped RepositoryMetadata, so they can be swapped with
+GITHUB_METADATA_BACKEND and compared with manage.py benchmark_metadata.
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from preview.fetcher import FetchScheduler
+from ..models import Repository
+from .github_client import github_request
+from .github_service import GitHubService
+
+logger = logging.getLogger(__name__)
+
+
+class RepositoryMetadata(NamedTuple):
+    topics: List[str]
+    license: Optional[dict]
+    permissions: dict
+    branches: List[dict]
+    default_branch: Optional[str]
+
+
+# Branches per page of the REST listing (GitHub's maximum)
+REST_BRANCHES = 100
+
+
+class RestMetadataBackend:
+    """Two REST calls per repository: the repository itself and its branches."""
+
+    def __init__(self, access_token: str, scheduler: FetchScheduler = None):
+        self.access_token = access_token
+        self.scheduler = scheduler or FetchScheduler(
+            access_token, concurrency=settings.GITHUB_ENRICH_CONCURRENCY, cache=True
+        )
+        self.requests = 0
+
+    async def _get_json(self, url: str, params: dict = None):
+        self.requests += 1
+        return await self.scheduler.get_json(url, params=params)
+
+    async def fetch_one(self, repository: Repository) -> RepositoryMetadata:
+        base = f"{settings.GITHUB_API_URL}/repos/{repository.full_name}"
+        # The repository payload carries topics, license and permissions at once
+        repo_data, branches = await asyncio.gather(
+            self._get_json(base),
+            self._get_json(f"{base}/branches", params={"per_page": REST_BRANCHES}),
+        )
+        metadata = RepositoryMetadata(
+            topics=repo_data.get("topics", []),
+            license=repo_data.get("license"),
+            permissions=repo_data.get("permissions", {}),
+            branches=branches,
+            default_branch=repo_data.get("default_branch"),
+        )
+        if len(branches) >= REST_BRANCHES:
+            # A full first page: the rest are paged in, since a partial
+            # listing would delete the missing branches on store
+            all_branches = await self.all_branches(repository)
+            if all_branches is None:
+                raise ValueError("incomplete branch listing")
+            metadata = metadata._replace(branches=all_branches)
+        return metadata
+
+    async def fetch(self, repositories: Iterable[Repository]) -> Dict[int, RepositoryMetadata]:
+        """
+        Metadata keyed by Repository.id. Stops starting new repositories once
+        the token is down to GITHUB_ENRICH_RATE_RESERVE requests.
+        """
+        semaphore = asyncio.Semaphore(settings.GITHUB_ENRICH_CONCURRENCY)
+        results = {}
+
+        async def fetch(repository):
+            async with semaphore:
+                remaining = self.scheduler.remaining
+                if remaining is not None and remaining <= settings.GITHUB_ENRICH_RATE_RESERVE:
+                    return
+                try:
+                    results[repository.id] = await self.fetch_one(repository)
+                except Exception as e:
+                    logger.error(f"[metadata] {repository.full_name} failed: {str(e)}")
+
+        await asyncio.gather(*(fetch(repo) for repo in repositories))
+        return results
+
+    async def all_branches(self, repository: Repository) -> Optional[List[dict]]:
+        """Every branch of the repository, or None if a page failed."""
+        branches = []
+        try:
+            async for page in GitHubService().iter_pages(
+                self.access_token,
+                f"{settings.GITHUB_API_URL}/repos/{repository.full_name}/branches",
+            ):
+                self.requests += 1
+                branches.extend(page)
+        except Exception as e:
+            logger.error(f"[metadata] branches of {repository.full_name} failed: {str(e)}")
+            return None
+        return branches
+
+
+# Branch heads beyond this many refs are paged in through REST
+GRAPHQL_BRANCHES = 100
+
+GRAPHQL_QUERY = """
+query($ids: [ID!]!, $branches: Int!) {
+  rateLimit { cost remaining resetAt }
+  nodes(ids: $ids) {
+    ... on Repository {
+      id
+      defaultBranchRef { name }
+      viewerPermission
+      licenseInfo { key name spdxId url id }
+      repositoryTopics(first: 20) { nodes { topic { name } } }
+      refs(refPrefix: "refs/heads/", first: $branches) {
+        pageInfo { hasNextPage }
+        nodes { name target { oid } branchProtectionRule { id } }
+      }
+    }
+  }
+}
+"""
+
+# viewerPermission -> the REST permissions object
+PERMISSION_LEVELS = {
+    "ADMIN": {"admin": True, "maintain": True, "push": True, "triage": True, "pull": True},
+    "MAINTAIN": {"maintain": True, "push": True, "triage": True, "pull": True},
+    "WRITE": {"push": True, "triage": True, "pull": True},
+    "TRIAGE": {"triage": True, "pull": True},
+    "READ": {"pull": True},
+}
+
+
+class GraphQLMetadataBackend:
+    """
+    Batches many repositories (looked up by node_id) into one GraphQL query.
+    Batches are sized by the cost the previous query reported through the
+    rateLimit node, aiming at GITHUB_GRAPHQL_TARGET_COST points per query.
+    """
+
+    def __init__(self, access_token: str):
+        self.access_token = access_token
+        self.batch_size = settings.GITHUB_GRAPHQL_BATCH_SIZE
+        self.remaining: Optional[int] = None
+        self.rest = RestMetadataBackend(access_token)
+        self._requests = 0
+
+    @property
+    def requests(self) -> int:
+        return self._requests + self.rest.requests
+
+    async def _query(self, node_ids: List[str]) -> dict:
+        self._requests += 1
+        response = await github_request(
+            self.access_token,
+            settings.GITHUB_GRAPHQL_URL,
+            method="POST",
+            json={
+                "query": GRAPHQL_QUERY,
+                "variables": {"ids": node_ids, "branches": GRAPHQL_BRANCHES},
+            },
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("errors"):
+            # Partial results still come back for the nodes that resolved
+            logger.warning(f"[metadata] GraphQL errors: {payload['errors']}")
+        if not payload.get("data"):
+            raise ValueError("GraphQL response without data")
+        return payload["data"]
+
+    def _resize(self, batch_len: int, rate_limit: dict):
+        cost = rate_limit.get("cost") or 1
+        self.remaining = rate_limit.get("remaining")
+        per_repo = cost / batch_len
+        self.batch_size = max(
+            1, min(100, int(settings.GITHUB_GRAPHQL_TARGET_COST / per_repo))
+        )
+
+    def _metadata(self, repository: Repository, node: dict) -> RepositoryMetadata:
+        license_info = node.get("licenseInfo")
+        license_data = None
+        if license_info:
+            license_data = {
+                "key": license_info["key"],
+                "name": license_info["name"],
+                "spdx_id": license_info.get("spdxId") or "",
+                "url": license_info.get("url"),
+                "node_id": license_info["id"],
+            }
+        branches = [
+            {
+                "name": ref["name"],
+                "protected": ref.get("branchProtectionRule") is not None,
+                "commit": {
+                    "sha": ref["target"]["oid"],
+                    "url": f"{settings.GITHUB_API_URL}/repos/{repository.full_name}"
+                    f"/commits/{ref['target']['oid']}",
+                },
+            }
+            for ref in node["refs"]["nodes"]
+        ]
+        default_branch = node.get("defaultBranchRef") or {}
+        return RepositoryMetadata(
+            topics=[t["topic"]["name"] for t in node["repositoryTopics"]["nodes"]],
+            license=license_data,
+            permissions=PERMISSION_LEVELS.get(node.get("viewerPermission"), {}),
+            branches=branches,
+            default_branch=default_branch.get("name"),
+        )
+
+    async def fetch(self, repositories: Iterable[Repository]) -> Dict[int, RepositoryMetadata]:
+        """Metadata keyed by Repository.id; stops at GITHUB_GRAPHQL_RATE_RESERVE points."""
+        pending = list(repositories)
+        results = {}
+        truncated = []
+
+        while pending:
+            if self.remaining is not None and self.remaining <= settings.GITHUB_GRAPHQL_RATE_RESERVE:
+                logger.warning(f"[metadata] GraphQL budget low, {len(pending)} repositories left")
+                break
+            batch, pending = pending[: self.batch_size], pending[self.batch_size :]
+            try:
+                data = await self._query([repo.node_id for repo in batch])
+            except Exception as e:
+                logger.error(f"[metadata] GraphQL batch of {len(batch)} failed: {str(e)}")
+                continue
+            self._resize(len(batch), data.get("rateLimit") or {})
+
+            for repository, node in zip(batch, data["nodes"]):
+                if not node:
+                    continue
+                results[repository.id] = self._metadata(repository, node)
+                if node["refs"]["pageInfo"]["hasNextPage"]:
+                    truncated.append(repository)
+
+        # Rare repositories with more branches than one query returns
+        all_branches = await asyncio.gather(*(self.rest.all_branches(repo) for repo in truncated))
+        for repository, branches in zip(truncated, all_branches):
+            if branches is None:
+                # Storing the truncated listing would delete the other branches
+                del results[repository.id]
+            else:
+                results[repository.id] = results[repository.id]._replace(branches=branches)
+        return results
+
+
+METADATA_BACKENDS = {
+    "rest": RestMetadataBackend,
+    "graphql": GraphQLMetadataBackend,
+}
+
+
+def get_metadata_backend(access_token: str, name: str = None):
+    """Backend named by GITHUB_METADATA_BACKEND ("rest", "graphql" or a dotted path)."""
+    name = name or settings.GITHUB_METADATA_BACKEND
+    backend_class = METADATA_BACKENDS.get(name) or import_string(name)
+    return backend_class(access_token)
@@ -1,3 +1,164 @@
-from django.test import TestCase
+import asyncio
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+from .models import Repository, User
+from .services import enrichment, github_service
+from .services.github_service import GitHubService
+
+
+def repo_payload(repo_id, **fields):
+    """A /user/repos entry with the fields the sync reads."""
+    payload = {
+        "id": repo_id,
+        "node_id": f"R_{repo_id}",
+        "name": f"repo{repo_id}",
+        "full_name": f"octo/repo{repo_id}",
+        "private": False,
+        "url": f"https://api.github.com/repos/octo/repo{repo_id}",
+        "html_url": f"https://github.com/octo/repo{repo_id}",
+        "git_url": f"git://github.com/octo/repo{repo_id}.git",
+        "ssh_url": f"git@github.com:octo/repo{repo_id}.git",
+        "clone_url": f"https://github.com/octo/repo{repo_id}.git",
+        "svn_url": f"https://github.com/octo/repo{repo_id}",
+        "homepage": "",
+        "visibility": "public",
+        "default_branch": "main",
+        "pushed_at": "2024-01-01T00:00:00Z",
+    }
+    payload.update(fields)
+    return payload
+
+
+class PagedGitHubService(GitHubService):
+    """Serves /user/repos from memory, counting the pages handed out."""
+
+    def __init__(self, pages):
+        super().__init__()
+        self.pages = pages
+        self.fetched = 0
+
+    async def _get_page(self, access_token, url, params, page):
+        await asyncio.sleep(0.001)
+        self.fetched += 1
+        headers = {}
+        if page == 1 and len(self.pages) > 1:
+            headers["Link"] = f'<{url}?page={len(self.pages)}>; rel="last"'
+        return httpx.Response(
+            200, json=self.pages[page - 1], headers=headers, request=httpx.Request("GET", url)
+        )
+
+
+class RepositorySyncTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="octo", github_login="octo")
+
+    @override_settings(GITHUB_FETCH_CONCURRENCY=2, GITHUB_SYNC_QUEUE_PAGES=1)
+    def test_slow_writer_bounds_pages_in_memory(self):
+        pages = [[repo_payload(page * 10 + i) for i in range(10)] for page in range(20)]
+        service = PagedGitHubService(pages)
+        written, held = [0], []
+        write_batch = service._write_repository_batch
+
+        def slow_write(*args):
+            held.append(service.fetched - written[0])
+            time.sleep(0.01)
+            result = write_batch(*args)
+            written[0] += 1
+            return result
+
+        service._write_repository_batch = slow_write
+        stats = asyncio.run(service.sync_repositories(self.user, "token"))
+
+        self.assertEqual((stats["pages"], stats["created"]), (20, 200))
+        # Fetch window + queue + the page being put + the page being written
+        self.assertLessEqual(max(held), 5)
+
+    def test_vanished_repositories_are_rechecked_before_deletion(self):
+        service = PagedGitHubService([[repo_payload(1)]])
+        asyncio.run(service.sync_repositories(self.user, "token"))
+        for repo_id in (2, 3):
+            Repository.objects.create(
+                user=self.user, repo_id=repo_id, full_name=f"octo/repo{repo_id}"
+            )
+
+        async def lookup(access_token, url, **kwargs):
+            # Repository 2 slipped between two pages; 3 is really gone
+            status = 200 if url.endswith("/repositories/2") else 404
+            return httpx.Response(status, request=httpx.Request("GET", url))
+
+        with mock.patch.object(github_service, "github_request", lookup):
+            stats = asyncio.run(service.sync_repositories(self.user, "token"))
+
+        self.assertEqual(stats["deleted"], 1)
+        self.assertEqual(
+            sorted(Repository.objects.values_list("repo_id", flat=True)), [1, 2]
+        )
+
+    def test_over_long_values_fit_their_columns(self):
+        service = PagedGitHubService(
+            [[repo_payload(1, homepage="https://example.com/" + "a" * 300, name="n" * 300)]]
+        )
+        asyncio.run(service.sync_repositories(self.user, "token"))
+
+        repository = Repository.objects.get(repo_id=1)
+        self.assertIsNone(repository.homepage)
+        self.assertEqual(repository.name, "n" * 255)
+
+
+@override_settings(GITHUB_ENRICH_MODE="queue", GITHUB_ENRICH_STALE_AFTER=60)
+class EnrichmentQueueTests(TransactionTestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="octo", github_login="octo")
+        enrichment.request_enrichment(self.user.id)
+
+    def run_worker(self, enrich):
+        with mock.patch.object(enrichment, "enrich_user_repositories", enrich):
+            asyncio.run(enrichment.run_worker(once=True))
+        return User.objects.get(id=self.user.id)
+
+    def test_finished_enrichment_is_dequeued(self):
+        async def enrich(user_id):
+            return 0
+
+        user = self.run_worker(enrich)
+        self.assertIsNone(user.enrich_requested_at)
+        self.assertIsNone(user.enrich_claimed_at)
+
+    def test_failed_enrichment_is_retried_once_stale(self):
+        async def fail(user_id):
+            raise httpx.ConnectError("down")
+
+        user = self.run_worker(fail)
+        self.assertIsNotNone(user.enrich_requested_at)
+        self.assertIsNotNone(user.enrich_claimed_at)
+        self.assertEqual(enrichment.claim_enrichments(1)[1], [])
+
+        User.objects.filter(id=user.id).update(
+            enrich_claimed_at=timezone.now() - timedelta(minutes=5)
+        )
+        ran = []
+
+        async def enrich(user_id):
+            ran.append(user_id)
+
+        user = self.run_worker(enrich)
+        self.assertEqual(ran, [self.user.id])
+        self.assertIsNone(user.enrich_requested_at)
+
+    def test_request_during_a_run_stays_queued(self):
+        async def enrich(user_id):
+            await asyncio.sleep(0.01)
+            await asyncio.to_thread(enrichment.request_enrichment, user_id)
+
+        with mock.patch.object(enrichment, "enrich_user_repositories", enrich):
+            asyncio.run(enrichment.process_enrichments())
+
+        user = User.objects.get(id=self.user.id)
+        self.assertIsNotNone(user.enrich_requested_at)
+        self.assertIsNone(user.enrich_claimed_at)
@@ -7,10 +7,38 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 """
 
+import asyncio
+import logging
 import os
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+logger = logging.getLogger(__name__)
+
+
+async def application(scope, receive, send):
+    """Django app plus ASGI lifespan events for process-wide clients."""
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    from core.background import run_in_background, stop_background_loop
+    from telegram_bot.services.bot import get_bot_app
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await run_in_background(get_bot_app())
+            except Exception as e:
+                # Not fatal: the webhook initializes the bot on first use
+                logger.error(f"Bot warm-up failed: {e}")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            # Shuts down the bot, the notifier and the clients on the background loop
+            await asyncio.to_thread(stop_background_loop)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
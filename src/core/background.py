@@ -0,0 +1,115 @@
+# src/core/background.py
+"""
+A process-wide event loop running on a daemon thread.
+
+Sync Django (the WSGI deploy) runs every async view in an event loop of its
+own, closed when the request ends. Objects meant to be reused across
+requests (the bot application, the GitHub and Telegram HTTP clients) and
+tasks that must outlive a request (inline snapshot jobs) are therefore
+hosted on this loop: entry points hand their work to run_in_background.
+Modules register on_shutdown hooks to close what they opened; they run on
+this loop at interpreter exit (or from the ASGI lifespan shutdown).
+
+Each unit of work handed over (a login, an update, a snapshot job) runs its
+sync_to_async calls, Django's async ORM included, on a thread and database
+connection of its own, as an ASGI request would: without that they would
+all queue on asgiref's single shared sync thread, and a large snapshot
+would hold up every login and bot reply behind it.
+"""
+import asyncio
+import atexit
+import contextvars
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Awaitable, Callable, List
+
+from asgiref.sync import ThreadSensitiveContext, sync_to_async
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+_loop: asyncio.AbstractEventLoop = None
+_lock = threading.Lock()
+_shutdown_hooks: List[Callable[[], Awaitable[None]]] = []
+
+
+def get_background_loop() -> asyncio.AbstractEventLoop:
+    """The background loop, started on first use."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=_loop.run_forever, name="background-loop", daemon=True
+            ).start()
+        return _loop
+
+
+async def _with_own_thread(coro):
+    async with ThreadSensitiveContext():
+        try:
+            return await coro
+        finally:
+            # On the context's thread, which goes away with it
+            await sync_to_async(connections.close_all)()
+
+
+def spawn(coro) -> asyncio.Task:
+    """
+    Start coro as a task of the running loop with a sync thread of its own.
+    The task starts from an empty context, so it never shares the thread
+    of the request (or task) that spawned it, which may end first.
+    """
+    return contextvars.Context().run(asyncio.create_task, _with_own_thread(coro))
+
+
+async def _spawn_and_wait(coro):
+    return await spawn(coro)
+
+
+def submit(coro) -> Future:
+    """Schedule coro on the background loop from any thread."""
+    return asyncio.run_coroutine_threadsafe(_spawn_and_wait(coro), get_background_loop())
+
+
+async def run_in_background(coro):
+    """
+    Await coro on the background loop from any event loop; it is awaited
+    directly when already running there.
+    """
+    if asyncio.get_running_loop() is get_background_loop():
+        return await coro
+    return await asyncio.wrap_future(submit(coro))
+
+
+def on_shutdown(hook: Callable[[], Awaitable[None]]):
+    """Register a coroutine function to run on the background loop at shutdown."""
+    _shutdown_hooks.append(hook)
+    return hook
+
+
+def stop_background_loop(timeout: float = 10):
+    """Run the shutdown hooks, then stop the loop; a later use starts a new one."""
+    global _loop
+    with _lock:
+        loop, _loop = _loop, None
+    if loop is None:
+        return
+
+    async def shutdown():
+        for hook in _shutdown_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Background shutdown hook {hook.__qualname__} failed: {e}")
+
+    try:
+        asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout)
+    except Exception as e:
+        logger.error(f"Background loop shutdown failed: {e}")
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+atexit.register(stop_background_loop)
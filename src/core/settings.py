@@ -13,6 +13,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 from pathlib import Path
 from decouple import config
 import datetime
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -138,12 +139,139 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # TELEGRAM
 TELEGRAM_BOT_TOKEN = config("BOT_TOKEN")
+# Outbound notifier: Telegram allows ~30 messages/s overall, ~1/s per chat
+TELEGRAM_GLOBAL_RATE_LIMIT = config("TELEGRAM_GLOBAL_RATE_LIMIT", default=30, cast=float)
+TELEGRAM_CHAT_RATE_LIMIT = config("TELEGRAM_CHAT_RATE_LIMIT", default=1.0, cast=float)
+TELEGRAM_SEND_CONCURRENCY = config("TELEGRAM_SEND_CONCURRENCY", default=8, cast=int)
+TELEGRAM_SEND_MAX_RETRIES = config("TELEGRAM_SEND_MAX_RETRIES", default=3, cast=int)
+# Progress messages are edited at most once per interval (seconds)
+TELEGRAM_PROGRESS_INTERVAL = config("TELEGRAM_PROGRESS_INTERVAL", default=3.0, cast=float)
+TELEGRAM_PROGRESS_MAX_WAIT = config("TELEGRAM_PROGRESS_MAX_WAIT", default=30.0, cast=float)
+# Webhook: "inline" runs handlers inside the request, "queue" stores the
+# update and acknowledges at once (run manage.py process_telegram_updates)
+TELEGRAM_UPDATE_MODE = config("TELEGRAM_UPDATE_MODE", default="inline")
+TELEGRAM_WEBHOOK_SECRET = config("TELEGRAM_WEBHOOK_SECRET", default="")
+TELEGRAM_WORKER_CONCURRENCY = config("TELEGRAM_WORKER_CONCURRENCY", default=8, cast=int)
+TELEGRAM_WORKER_POLL_INTERVAL = config(
+    "TELEGRAM_WORKER_POLL_INTERVAL", default=0.5, cast=float
+)
+TELEGRAM_UPDATE_STALE_AFTER = config("TELEGRAM_UPDATE_STALE_AFTER", default=900, cast=int)
+TELEGRAM_UPDATE_RETENTION = config("TELEGRAM_UPDATE_RETENTION", default=86400, cast=int)
 GITHUB_CLIENT_ID = config("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = config("GITHUB_CLIENT_SECRET")
 GITHUB_REDIRECT_URI = config("GITHUB_REDIRECT_URI")
+# Secret of the repository push webhook (POST /api/github/webhook); the
+# endpoint rejects every delivery while it is unset
+GITHUB_WEBHOOK_SECRET = config("GITHUB_WEBHOOK_SECRET", default="")
 FIELD_ENCRYPTION_KEY = config("FERNET_KEY")
 FIELD_ENCRYPTION_KEY = config("FERNET_KEY")
 SERVER_URL = config("SERVER_URL")
+GITHUB_API_URL = config("GITHUB_API_URL", default="https://api.github.com")
+# Shared GitHub client (accounts.services.github_client)
+GITHUB_HTTP2 = config("GITHUB_HTTP2", default=True, cast=bool)
+GITHUB_TIMEOUT = config("GITHUB_TIMEOUT", default=10.0, cast=float)
+GITHUB_MAX_CONNECTIONS = config("GITHUB_MAX_CONNECTIONS", default=100, cast=int)
+GITHUB_MAX_KEEPALIVE_CONNECTIONS = config(
+    "GITHUB_MAX_KEEPALIVE_CONNECTIONS", default=20, cast=int
+)
+GITHUB_KEEPALIVE_EXPIRY = config("GITHUB_KEEPALIVE_EXPIRY", default=30.0, cast=float)
+# ETag cache for GitHub REST responses: memory | django | database | "" (off)
+GITHUB_CACHE_BACKEND = config("GITHUB_CACHE_BACKEND", default="memory")
+GITHUB_CACHE_MAX_ENTRIES = config("GITHUB_CACHE_MAX_ENTRIES", default=1024, cast=int)
+GITHUB_CACHE_ALIAS = config("GITHUB_CACHE_ALIAS", default="default")
+# Blob downloads: parallel requests per snapshot, retries on 403/429/5xx and
+# the share of the rate limit that is never spent
+GITHUB_FETCH_CONCURRENCY = config("GITHUB_FETCH_CONCURRENCY", default=16, cast=int)
+GITHUB_FETCH_MAX_RETRIES = config("GITHUB_FETCH_MAX_RETRIES", default=4, cast=int)
+GITHUB_RETRY_BACKOFF = config("GITHUB_RETRY_BACKOFF", default=1.0, cast=float)
+GITHUB_MAX_RETRY_WAIT = config("GITHUB_MAX_RETRY_WAIT", default=60, cast=int)
+GITHUB_RATE_LIMIT_RESERVE = config("GITHUB_RATE_LIMIT_RESERVE", default=50, cast=int)
+# Repository pages buffered between the fetcher and the DB writer
+GITHUB_SYNC_QUEUE_PAGES = config("GITHUB_SYNC_QUEUE_PAGES", default=4, cast=int)
+# Post-login enrichment of the most recently pushed repositories
+GITHUB_ENRICH_REPOS = config("GITHUB_ENRICH_REPOS", default=30, cast=int)
+GITHUB_ENRICH_CONCURRENCY = config("GITHUB_ENRICH_CONCURRENCY", default=4, cast=int)
+GITHUB_ENRICH_RATE_RESERVE = config("GITHUB_ENRICH_RATE_RESERVE", default=500, cast=int)
+# Repositories enriched longer ago than this (seconds) are enriched again
+GITHUB_ENRICH_TTL = config("GITHUB_ENRICH_TTL", default=24 * 3600, cast=int)
+# "inline" runs queued enrichments on the web process's background loop,
+# "queue" leaves them to manage.py process_enrichment
+GITHUB_ENRICH_MODE = config("GITHUB_ENRICH_MODE", default="inline")
+GITHUB_ENRICH_POLL_INTERVAL = config(
+    "GITHUB_ENRICH_POLL_INTERVAL", default=5.0, cast=float
+)
+# Enrichments claimed longer ago than this (seconds) are queued again; a
+# failed run is retried after the same delay
+GITHUB_ENRICH_STALE_AFTER = config("GITHUB_ENRICH_STALE_AFTER", default=900, cast=int)
+# "rest" (2 requests per repository) or "graphql" (batched queries)
+GITHUB_METADATA_BACKEND = config("GITHUB_METADATA_BACKEND", default="rest")
+GITHUB_GRAPHQL_URL = config("GITHUB_GRAPHQL_URL", default=f"{GITHUB_API_URL}/graphql")
+GITHUB_GRAPHQL_BATCH_SIZE = config("GITHUB_GRAPHQL_BATCH_SIZE", default=50, cast=int)
+# Batches are resized so a query costs about this many rate limit points
+GITHUB_GRAPHQL_TARGET_COST = config("GITHUB_GRAPHQL_TARGET_COST", default=5, cast=int)
+GITHUB_GRAPHQL_RATE_RESERVE = config("GITHUB_GRAPHQL_RATE_RESERVE", default=100, cast=int)
+
+# PREVIEW
+# "database" serves each request from RepositoryFile rows, "filesystem" from a
+# materialized snapshot directory (needs a writable PREVIEW_CACHE_DIR)
+PREVIEW_STORAGE_BACKEND = config("PREVIEW_STORAGE_BACKEND", default="database")
+# Materialized snapshots are written once per code state and evicted LRU-first
+PREVIEW_CACHE_DIR = config(
+    "PREVIEW_CACHE_DIR", default=str(Path(tempfile.gettempdir()) / "repo_previews")
+)
+PREVIEW_CACHE_MAX_BYTES = config(
+    "PREVIEW_CACHE_MAX_BYTES", default=512 * 1024 * 1024, cast=int
+)
+PREVIEW_CACHE_MAX_SNAPSHOTS = config("PREVIEW_CACHE_MAX_SNAPSHOTS", default=50, cast=int)
+# Commit-pinned preview URLs (/preview/<repo_id>/<sha>/...) never change and
+# are cached by browsers and proxies for this long
+PREVIEW_IMMUTABLE_MAX_AGE = config(
+    "PREVIEW_IMMUTABLE_MAX_AGE", default=365 * 24 * 60 * 60, cast=int
+)
+# Binary files (images, fonts, media) are stored as raw bytes in chunks of
+# PREVIEW_BLOB_CHUNK_SIZE; larger ones than PREVIEW_BINARY_MAX_BYTES are not
+# stored and answer 404 in previews
+PREVIEW_BINARY_MAX_BYTES = config(
+    "PREVIEW_BINARY_MAX_BYTES", default=20 * 1024 * 1024, cast=int
+)
+PREVIEW_BLOB_CHUNK_SIZE = config("PREVIEW_BLOB_CHUNK_SIZE", default=256 * 1024, cast=int)
+# Snapshots missing more blobs than this are ingested from the repo tarball
+PREVIEW_ARCHIVE_INGEST_THRESHOLD = config(
+    "PREVIEW_ARCHIVE_INGEST_THRESHOLD", default=200, cast=int
+)
+PREVIEW_ARCHIVE_BATCH_SIZE = config("PREVIEW_ARCHIVE_BATCH_SIZE", default=500, cast=int)
+# Incremental snapshot chains deeper than this are folded into a new base state
+PREVIEW_SNAPSHOT_MAX_CHAIN_DEPTH = config(
+    "PREVIEW_SNAPSHOT_MAX_CHAIN_DEPTH", default=10, cast=int
+)
+# Snapshot jobs: "inline" lets the bot run them in its own process, "queue"
+# leaves them to manage.py process_snapshot_jobs. Inline jobs run on the web
+# process's background loop (core.background) with a thread and database
+# connection each, so they do not hold up logins or bot replies, but they
+# share the process's CPU with them and are cut off when it exits (re-queued
+# once stale); use "queue" where snapshots are large or the process short-lived
+PREVIEW_SNAPSHOT_JOB_MODE = config("PREVIEW_SNAPSHOT_JOB_MODE", default="inline")
+PREVIEW_SNAPSHOT_WORKER_CONCURRENCY = config(
+    "PREVIEW_SNAPSHOT_WORKER_CONCURRENCY", default=4, cast=int
+)
+PREVIEW_SNAPSHOT_POLL_INTERVAL = config(
+    "PREVIEW_SNAPSHOT_POLL_INTERVAL", default=1.0, cast=float
+)
+PREVIEW_SNAPSHOT_PROGRESS_INTERVAL = config(
+    "PREVIEW_SNAPSHOT_PROGRESS_INTERVAL", default=1.0, cast=float
+)
+# Running jobs without a progress heartbeat for this long are re-queued
+PREVIEW_SNAPSHOT_JOB_STALE_AFTER = config(
+    "PREVIEW_SNAPSHOT_JOB_STALE_AFTER", default=300, cast=int
+)
+# How long the bot waits on a snapshot job before leaving it to finish alone
+PREVIEW_SNAPSHOT_WAIT_TIMEOUT = config(
+    "PREVIEW_SNAPSHOT_WAIT_TIMEOUT", default=600, cast=int
+)
+# Pushes changing at most this many files are snapshotted from the file lists
+# of the push payload (one GraphQL query), larger ones by diffing the tree of
+# the new head against the stored manifest
+PREVIEW_PUSH_MAX_FILES = config("PREVIEW_PUSH_MAX_FILES", default=100, cast=int)
 
 import logging
 import sys
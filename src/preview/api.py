@@ -0,0 +1,15 @@
+from django.http import HttpRequest
+from ninja_extra import api_controller, http_post
+
+from .webhooks import handle_github_webhook, verify_signature
+
+
+@api_controller("/github", tags=["GitHub Webhooks"], auth=None)
+class GitHubWebhookController:
+    @http_post("/webhook", response={200: dict, 400: dict, 403: dict})
+    async def webhook(self, request: HttpRequest):
+        # GitHub signs each delivery with the webhook's secret
+        body = request.body
+        if not verify_signature(body, request.headers.get("X-Hub-Signature-256", "")):
+            return 403, {"status": "error", "error": "Invalid signature"}
+        return await handle_github_webhook(request.headers.get("X-GitHub-Event", ""), body)
@@ -0,0 +1,144 @@
+# src/preview/archive.py
+"""
+Bulk ingestion of a commit through the repository tarball: one download
+over the shared GitHub client, streamed through tarfile (never written to
+disk), instead of one blob request per file.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+import tarfile
+from typing import Dict, Iterable, Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from .blobstore import blob_from_bytes, save_blobs
+from .fetcher import FetchScheduler
+from .models import Blob
+
+logger = logging.getLogger(__name__)
+
+# Binary chunks held before a batch is flushed early (16MB at the default size)
+_CHUNKS_PER_FLUSH = 64
+
+# Read size when hashing members too large to load
+_HASH_BLOCK = 1024 * 1024
+
+
+def git_blob_sha(data: bytes) -> str:
+    """SHA git assigns to a blob with this content (matches tree entries)."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class _IterStream(io.RawIOBase):
+    """Read-only file object over an iterator of byte chunks."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+def _stream_blob_sha(fileobj, size: int) -> str:
+    """git_blob_sha of a file read in blocks, for members too large to hold."""
+    digest = hashlib.sha1(b"blob %d\0" % size)
+    for block in iter(lambda: fileobj.read(_HASH_BLOCK), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def ingest_archive(
+    chunks: Iterator[bytes], wanted: Iterable[str], label: str = ""
+) -> Dict[str, bool]:
+    """
+    Read a tarball from an iterator of byte chunks and store a Blob (with
+    the chunks of binary files) for every member whose git SHA is in
+    wanted, in batches of PREVIEW_ARCHIVE_BATCH_SIZE.
+    Members over PREVIEW_BINARY_MAX_BYTES are hashed in blocks, never read
+    whole, and stored without content like any binary over the limit.
+    Returns {sha: is_binary} for the blobs found in the archive; symlinks and
+    submodules are not regular members and have to be fetched separately.
+    """
+    wanted = set(wanted)
+    found: Dict[str, bool] = {}
+    batch, chunks_batch = [], []
+    batch_size = settings.PREVIEW_ARCHIVE_BATCH_SIZE
+
+    # "r|*" reads the archive sequentially, whatever the compression
+    with tarfile.open(fileobj=_IterStream(chunks), mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            if member.size > settings.PREVIEW_BINARY_MAX_BYTES:
+                sha = _stream_blob_sha(tar.extractfile(member), member.size)
+                if sha not in wanted or sha in found:
+                    continue
+                blob = Blob(sha=sha, content=None, is_binary=True, size_bytes=member.size)
+                blob_chunks = []
+            else:
+                data = tar.extractfile(member).read()
+                sha = git_blob_sha(data)
+                if sha not in wanted or sha in found:
+                    continue
+                blob, blob_chunks = blob_from_bytes(sha, data)
+
+            found[sha] = blob.is_binary
+            batch.append(blob)
+            chunks_batch.extend(blob_chunks)
+            if len(batch) >= batch_size or len(chunks_batch) >= _CHUNKS_PER_FLUSH:
+                save_blobs(batch, chunks_batch)
+                batch, chunks_batch = [], []
+
+    if batch:
+        save_blobs(batch, chunks_batch)
+
+    logger.info(f"[snapshot] archive {label}: stored {len(found)} of {len(wanted)} blobs")
+    return found
+
+
+async def aingest_archive(owner, repo, ref, wanted, scheduler: FetchScheduler) -> Dict[str, bool]:
+    """
+    Stream the tarball of ref through the scheduler (shared client, rate
+    budget and concurrency) into ingest_archive, which runs in a worker
+    thread and pulls the body from this loop chunk by chunk.
+    """
+    url = f"{settings.GITHUB_API_URL}/repos/{owner}/{repo}/tarball/{ref}"
+    loop = asyncio.get_running_loop()
+
+    async with scheduler.stream(url) as response:
+        body = response.aiter_bytes()
+
+        async def next_chunk():
+            return await anext(body, None)
+
+        def chunks() -> Iterator[bytes]:
+            while True:
+                chunk = asyncio.run_coroutine_threadsafe(next_chunk(), loop).result()
+                if chunk is None:
+                    return
+                yield chunk
+
+        def run():
+            try:
+                return ingest_archive(chunks(), wanted, f"{owner}/{repo}@{ref}")
+            finally:
+                # The worker thread opened its own DB connection
+                connection.close()
+
+        return await sync_to_async(run, thread_sensitive=False)()
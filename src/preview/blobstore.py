@@ -0,0 +1,101 @@
+# src/preview/blobstore.py
+"""
+Raw bytes of binary blobs (images, fonts, media). They are split into
+BlobChunk rows when stored and read back one chunk per query, so serving a
+file, or a byte range of it, never holds more than a chunk in memory (under
+ASGI the view hands the chunks to Django as an async iterator, see
+views._aiter_blocks).
+Binary files over PREVIEW_BINARY_MAX_BYTES keep their Blob row without data.
+"""
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.functions import Length
+
+from .models import Blob, BlobChunk
+
+# Chunks written per INSERT, to keep statements a few MB at most
+_CHUNK_BATCH = 16
+
+
+class BinaryContent(NamedTuple):
+    sha: str
+    size: int
+    # (chunk id, offset, length) in order
+    chunks: List[Tuple[int, int, int]]
+
+
+def split_chunks(sha: str, data: bytes) -> List[BlobChunk]:
+    """Unsaved chunks of data; none when it is too large to store."""
+    if len(data) > settings.PREVIEW_BINARY_MAX_BYTES:
+        return []
+    size = settings.PREVIEW_BLOB_CHUNK_SIZE
+    view = memoryview(data)
+    return [
+        BlobChunk(blob_id=sha, index=index, offset=offset, data=bytes(view[offset : offset + size]))
+        for index, offset in enumerate(range(0, len(data), size))
+    ]
+
+
+def blob_from_bytes(sha: str, data: bytes) -> Tuple[Blob, List[BlobChunk]]:
+    """Unsaved Blob for the raw content of a file: text if it is UTF-8, chunks otherwise."""
+    try:
+        return Blob(sha=sha, content=data.decode("utf-8"), is_binary=False, size_bytes=len(data)), []
+    except UnicodeDecodeError:
+        blob = Blob(sha=sha, content=None, is_binary=True, size_bytes=len(data))
+        return blob, split_chunks(sha, data)
+
+
+def save_blobs(blobs: Iterable[Blob], chunks: Iterable[BlobChunk]):
+    """
+    Store blobs, then their chunks. Existing rows are overwritten, which
+    fills in binary blobs stored before their bytes were kept; a blob left
+    without chunks by an interruption is fetched again (see missing_data).
+    """
+    Blob.objects.bulk_create(
+        list(blobs),
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=["sha"],
+        update_fields=["content", "is_binary", "size_bytes"],
+    )
+    BlobChunk.objects.bulk_create(list(chunks), batch_size=_CHUNK_BATCH, ignore_conflicts=True)
+
+
+def missing_data() -> Q:
+    """Blob filter for binary blobs small enough to store whose bytes are not stored."""
+    return Q(is_binary=True, size_bytes__lte=settings.PREVIEW_BINARY_MAX_BYTES) & ~Exists(
+        BlobChunk.objects.filter(blob_id=OuterRef("sha"))
+    )
+
+
+def open_blob(sha: str) -> Optional[BinaryContent]:
+    """Chunk layout of a binary blob (no data is loaded); None if its bytes are not stored."""
+    chunks = list(
+        BlobChunk.objects.filter(blob_id=sha)
+        .order_by("index")
+        .annotate(length=Length("data"))
+        .values_list("id", "offset", "length")
+    )
+    if not chunks:
+        return None
+    _, offset, length = chunks[-1]
+    return BinaryContent(sha, offset + length, chunks)
+
+
+def iter_range(content: BinaryContent, start: int, end: int) -> Iterator[bytes]:
+    """Bytes start..end (exclusive) of a blob, one chunk query at a time."""
+    for chunk_id, offset, length in content.chunks:
+        if offset + length <= start or offset >= end:
+            continue
+        data = BlobChunk.objects.filter(id=chunk_id).values_list("data", flat=True).get()
+        yield bytes(data[max(start - offset, 0) : end - offset])
+
+
+def read_blob(sha: str) -> Optional[bytes]:
+    """Whole content of a binary blob, for writing it to disk."""
+    content = open_blob(sha)
+    if content is None:
+        return None
+    return b"".join(iter_range(content, 0, content.size))
@@ -0,0 +1,61 @@
+# src/preview/changes.py
+"""
+Change sets built from GitHub push payloads: {"base": sha, "files": {path:
+status}} lists every file that differs between the base commit and the
+pushed head, with status "added", "modified" or "removed". None stands for
+an unknown change set, which the snapshot then works out from GitHub.
+"""
+from typing import Dict, Optional
+
+# Push payloads list at most this many commits
+MAX_PUSH_COMMITS = 2048
+
+
+def apply_change(files: Dict[str, str], path: str, status: str):
+    """Fold a later change of path into files, keeping it relative to the base."""
+    earlier = files.get(path)
+    if status == "removed":
+        if earlier == "added":
+            # Created and deleted again since the base
+            del files[path]
+        else:
+            files[path] = "removed"
+    elif earlier is None:
+        files[path] = status
+    elif earlier != "added":
+        files[path] = "modified"
+
+
+def push_changes(payload: dict) -> Optional[dict]:
+    """
+    Change set of a push, from the added/removed/modified lists of its
+    commits. None when the list cannot describe the push: a new branch, a
+    force push or a truncated commit list.
+    """
+    commits = payload.get("commits") or []
+    if (
+        payload.get("created")
+        or payload.get("forced")
+        or not commits
+        or len(commits) >= MAX_PUSH_COMMITS
+    ):
+        return None
+    files = {}
+    for commit in commits:
+        for status in ("removed", "added", "modified"):
+            for path in commit.get(status, []):
+                apply_change(files, path, status)
+    return {"base": payload["before"], "files": files}
+
+
+def merge_changes(earlier: Optional[dict], head: str, later: Optional[dict]) -> Optional[dict]:
+    """
+    Change set from earlier's base to the head of later, where head is the
+    commit earlier ends at. None unless both are known and line up.
+    """
+    if earlier is None or later is None or later["base"] != head:
+        return None
+    files = dict(earlier["files"])
+    for path, status in later["files"].items():
+        apply_change(files, path, status)
+    return {"base": earlier["base"], "files": files}
@@ -0,0 +1,194 @@
+# src/preview/fetcher.py
+import asyncio
+import contextlib
+import logging
+import random
+import time
+from typing import Awaitable, Callable, Iterable, List, NamedTuple, Optional
+
+import httpx
+from django.conf import settings
+
+from accounts.services.github_client import github_request, github_stream
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = {403, 429, 500, 502, 503, 504}
+
+RAW_MEDIA_TYPE = "application/vnd.github.raw"
+
+
+class FetchResult(NamedTuple):
+    sha: str
+    content: Optional[str]
+    is_binary: bool
+    # True when the blob could not be downloaded; it must not be stored and
+    # is retried by a later sync instead of being persisted as binary
+    failed: bool = False
+    error: str = ""
+    size: int = 0
+    # Raw bytes of a binary blob
+    data: Optional[bytes] = None
+
+
+class FetchScheduler:
+    """
+    Downloads GitHub blobs over the shared client with bounded concurrency
+    and a per-token rate budget. X-RateLimit-Remaining/Reset and Retry-After are honoured, and
+    403/429/5xx responses are retried with jittered exponential backoff.
+    """
+
+    def __init__(
+        self,
+        github_token: str,
+        concurrency: int = None,
+        max_retries: int = None,
+        cache: bool = False,
+    ):
+        self.github_token = github_token
+        self.cache = cache
+        self.concurrency = concurrency or settings.GITHUB_FETCH_CONCURRENCY
+        self.max_retries = (
+            settings.GITHUB_FETCH_MAX_RETRIES if max_retries is None else max_retries
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._budget_lock = asyncio.Lock()
+        self._remaining: Optional[int] = None
+        self._reset_at: float = 0.0
+
+    @property
+    def remaining(self) -> Optional[int]:
+        """Requests left in the token's rate limit, once a response reported it."""
+        return self._remaining
+
+    def _record_budget(self, response: httpx.Response):
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        reset = response.headers.get("X-RateLimit-Reset")
+        if remaining is not None and remaining.isdigit():
+            self._remaining = int(remaining)
+        if reset is not None and reset.isdigit():
+            self._reset_at = float(reset)
+
+    async def _wait_for_budget(self):
+        """Pause every request once the token is about to run out of quota."""
+        async with self._budget_lock:
+            if self._remaining is None or self._remaining > settings.GITHUB_RATE_LIMIT_RESERVE:
+                return
+            wait = self._reset_at - time.time()
+            if wait > settings.GITHUB_MAX_RETRY_WAIT:
+                raise httpx.HTTPError(f"rate limit exhausted for {int(wait)}s")
+            if wait > 0:
+                logger.warning(f"[fetch] rate budget low, waiting {wait:.0f}s for reset")
+                await asyncio.sleep(wait)
+            self._remaining = None
+
+    @staticmethod
+    def _is_retryable(response: httpx.Response) -> bool:
+        if response.status_code == 403:
+            # Plain 403s are permission errors; only rate limit 403s are retried
+            return (
+                response.headers.get("X-RateLimit-Remaining") == "0"
+                or "Retry-After" in response.headers
+            )
+        return response.status_code in RETRY_STATUSES
+
+    def _retry_delay(self, response: Optional[httpx.Response], attempt: int) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                return float(retry_after)
+            if response.headers.get("X-RateLimit-Remaining") == "0":
+                return max(self._reset_at - time.time(), 0) + 1
+        # Full jitter: uniform in [0, base * 2^attempt]
+        return random.uniform(0, settings.GITHUB_RETRY_BACKOFF * 2**attempt)
+
+    async def get_json(self, url: str, params: dict = None) -> dict:
+        """GET url under the scheduler's limits, retrying transient failures."""
+        return (await self._get(url, params)).json()
+
+    async def get_raw(self, url: str, params: dict = None) -> bytes:
+        """Like get_json, for the raw media type: the body is the file itself."""
+        response = await self._get(url, params, headers={"Accept": RAW_MEDIA_TYPE})
+        return response.content
+
+    async def _get(self, url: str, params: dict = None, headers: dict = None) -> httpx.Response:
+        attempt = 0
+        while True:
+            await self._wait_for_budget()
+            response = None
+            try:
+                async with self._semaphore:
+                    response = await github_request(
+                        self.github_token, url, params=params, headers=headers, cache=self.cache
+                    )
+                self._record_budget(response)
+                if not self._is_retryable(response):
+                    response.raise_for_status()
+                    return response
+                error = httpx.HTTPStatusError(
+                    f"{response.status_code} for {url}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as e:
+                error = e
+
+            if attempt >= self.max_retries:
+                raise error
+            delay = self._retry_delay(response, attempt)
+            if delay > settings.GITHUB_MAX_RETRY_WAIT:
+                raise error
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, url: str, params: dict = None, headers: dict = None):
+        """
+        Streamed GET (redirects followed) under the scheduler's limits. Not
+        retried: the body can only be consumed once.
+        """
+        await self._wait_for_budget()
+        async with self._semaphore:
+            async with github_stream(
+                self.github_token, url, params=params, headers=headers, follow_redirects=True
+            ) as response:
+                # Rate limit headers come with the API response, not the redirect target
+                self._record_budget(response.history[0] if response.history else response)
+                response.raise_for_status()
+                yield response
+
+    async def fetch_blob(self, owner: str, repo: str, sha: str) -> FetchResult:
+        url = f"{settings.GITHUB_API_URL}/repos/{owner}/{repo}/git/blobs/{sha}"
+        try:
+            # Raw bytes rather than the base64 JSON body, a third larger
+            data = await self.get_raw(url)
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to fetch blob {sha}: {str(e)}")
+            return FetchResult(sha, None, False, failed=True, error=str(e))
+
+        try:
+            return FetchResult(sha, data.decode("utf-8"), False, size=len(data))
+        except UnicodeDecodeError:
+            return FetchResult(sha, None, True, size=len(data), data=data)  # binary file
+
+    async def fetch_blobs(
+        self,
+        owner: str,
+        repo: str,
+        shas: Iterable[str],
+        on_result: Optional[Callable[[FetchResult], Awaitable[None]]] = None,
+    ) -> List[FetchResult]:
+        """
+        Fetch all shas; on_result is awaited as each download finishes and
+        is the only one to see the raw bytes of binary blobs, which are not
+        kept in the returned results then.
+        """
+
+        async def fetch(sha):
+            result = await self.fetch_blob(owner, repo, sha)
+            if on_result is not None:
+                await on_result(result)
+                result = result._replace(data=None)
+            return result
+
+        return await asyncio.gather(*(fetch(sha) for sha in shas))
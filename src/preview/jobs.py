@@ -0,0 +1,383 @@
+# src/preview/jobs.py
+"""
+Snapshot jobs: update_codebase as a persistent, resumable job. A job is
+claimed by a worker (manage.py process_snapshot_jobs, or the bot itself with
+PREVIEW_SNAPSHOT_JOB_MODE=inline), which records its progress on the row.
+Only one job per (repository, branch) runs at a time, since incremental
+snapshots build on the previous state of the branch.
+"""
+import asyncio
+import logging
+import time
+from datetime import timedelta
+from typing import Awaitable, Callable, List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from accounts.models import Branch, User
+from core.background import on_shutdown, run_in_background, spawn
+from .changes import merge_changes
+from .models import RepositoryCodeState, SnapshotJob
+from .services import update_codebase
+from .variants import build_state_variants, prune_pinned_variants
+
+logger = logging.getLogger(__name__)
+
+# Inline jobs run as tasks of the background loop, which outlives the
+# request that started them; keep references until done
+_inline_tasks = set()
+
+
+async def enqueue_snapshot(user, repo_obj, branch_obj, commit_sha) -> SnapshotJob:
+    """
+    Job for the commit, created if needed. A finished job is queued again:
+    rerunning it is cheap and picks up blobs that failed to download.
+    """
+    job, created = await SnapshotJob.objects.aget_or_create(
+        repository=repo_obj,
+        branch=branch_obj,
+        commit_sha=commit_sha,
+        defaults={"user": user},
+    )
+    if not created and job.is_finished:
+        await SnapshotJob.objects.filter(id=job.id, status=job.status).aupdate(
+            **_requeued(user)
+        )
+        await job.arefresh_from_db()
+    logger.info(f"[jobs] job {job.id} for {commit_sha[:8]} is {job.status}")
+    return job
+
+
+def _requeued(user, **fields) -> dict:
+    """Field values that put a finished job back in the queue."""
+    return {
+        "status": "queued",
+        "user": user,
+        "error": "",
+        "files_total": 0,
+        "files_done": 0,
+        "bytes_fetched": 0,
+        "finished_at": None,
+        **fields,
+    }
+
+
+@transaction.atomic
+def enqueue_push(user, repo_obj, branch_obj, before, after, changes) -> SnapshotJob:
+    """
+    Queue a snapshot of a pushed head. A job of the branch that has not
+    started yet is moved on to the new head instead, so a burst of pushes
+    ends in one snapshot; changes (see preview.changes) are merged onto it.
+    """
+    queued = SnapshotJob.objects.filter(
+        repository=repo_obj, branch=branch_obj, status="queued"
+    ).order_by("-created_at")
+    if connection.features.has_select_for_update:
+        queued = queued.select_for_update()
+    job = queued.first()
+    target = SnapshotJob.objects.filter(
+        repository=repo_obj, branch=branch_obj, commit_sha=after
+    ).first()
+
+    if job is not None and target is None:
+        logger.info(f"[jobs] job {job.id} moved from {job.commit_sha[:8]} to {after[:8]}")
+        job.changes = merge_changes(job.changes, job.commit_sha, changes)
+        job.commit_sha = after
+        job.user = user
+        job.save(update_fields=["changes", "commit_sha", "user", "updated_at"])
+        return job
+
+    if target is None:
+        return SnapshotJob.objects.create(
+            repository=repo_obj,
+            branch=branch_obj,
+            commit_sha=after,
+            user=user,
+            changes=changes,
+        )
+    if target.is_finished:
+        # The branch came back to a commit snapshotted before
+        SnapshotJob.objects.filter(id=target.id, status=target.status).update(
+            **_requeued(user, changes=None)
+        )
+        target.refresh_from_db()
+    return target
+
+
+async def refresh_moved_branches(repository, moved) -> List[SnapshotJob]:
+    """
+    Queue snapshots for branches whose head moved, limited to the ones that
+    already have a preview; other branches are snapshotted when selected.
+    """
+    jobs = []
+    user = None
+    for branch in moved:
+        has_preview = await RepositoryCodeState.objects.filter(
+            repository=repository, branch=branch
+        ).aexists()
+        if not has_preview:
+            continue
+        if user is None:
+            user = await User.objects.aget(id=repository.user_id)
+        jobs.append(await enqueue_snapshot(user, repository, branch, branch.last_commit_sha))
+    return jobs
+
+
+@transaction.atomic
+def claim_jobs(limit: int, job_id: int = None) -> List[SnapshotJob]:
+    """
+    Start up to limit queued jobs whose branch has no job running. Claims
+    are serialized per branch by locking its Branch row: a concurrent claim
+    of another job of the branch skips it, and the running check is redone
+    under the lock so it sees claims committed meanwhile.
+    """
+    running = SnapshotJob.objects.filter(
+        status__in=SnapshotJob.ACTIVE_STATUSES,
+        repository_id=OuterRef("repository_id"),
+        branch_id=OuterRef("branch_id"),
+    )
+    rows = (
+        SnapshotJob.objects.filter(status="queued")
+        .exclude(Exists(running))
+        .order_by("created_at")
+    )
+    if job_id is not None:
+        rows = rows.filter(id=job_id)
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    if skip_locked:
+        rows = rows.select_for_update(skip_locked=True)
+
+    candidates = {}
+    for id_, branch_id in rows.values_list("id", "branch_id"):
+        candidates.setdefault(branch_id, id_)
+        if len(candidates) >= limit:
+            break
+
+    branches = Branch.objects.filter(id__in=list(candidates)).order_by("id")
+    if connection.features.has_select_for_update:
+        branches = branches.select_for_update(skip_locked=skip_locked)
+    locked = set(branches.values_list("id", flat=True))
+    busy = set(
+        SnapshotJob.objects.filter(
+            status__in=SnapshotJob.ACTIVE_STATUSES, branch_id__in=locked
+        ).values_list("branch_id", flat=True)
+    )
+    ids = [id_ for branch_id, id_ in candidates.items() if branch_id in locked - busy]
+
+    now = timezone.now()
+    SnapshotJob.objects.filter(id__in=ids).update(
+        status="fetching_tree",
+        attempts=F("attempts") + 1,
+        locked_at=now,
+        started_at=now,
+    )
+    return list(
+        SnapshotJob.objects.filter(id__in=ids).select_related(
+            "user", "repository", "branch"
+        )
+    )
+
+
+def release_stale_jobs() -> int:
+    """Queue jobs again whose worker stopped sending heartbeats (crashed)."""
+    cutoff = timezone.now() - timedelta(seconds=settings.PREVIEW_SNAPSHOT_JOB_STALE_AFTER)
+    return SnapshotJob.objects.filter(
+        status__in=SnapshotJob.ACTIVE_STATUSES, locked_at__lt=cutoff
+    ).update(status="queued", locked_at=None)
+
+
+class _JobProgress:
+    """Progress callback for update_codebase that persists it on the job."""
+
+    def __init__(self, job: SnapshotJob):
+        self.job = job
+        self._saved_at = 0.0
+
+    async def __call__(self, stage, files_total=None, files_done=None, bytes_fetched=None):
+        job = self.job
+        stage_changed = stage != job.status
+        job.status = stage
+        if files_total is not None:
+            job.files_total = files_total
+        if files_done is not None:
+            job.files_done = files_done
+        if bytes_fetched is not None:
+            job.bytes_fetched = bytes_fetched
+
+        # Counters change per blob; write them (and the heartbeat) at most
+        # once per interval, stage changes right away
+        now = time.monotonic()
+        if stage_changed or now - self._saved_at >= settings.PREVIEW_SNAPSHOT_PROGRESS_INTERVAL:
+            self._saved_at = now
+            job.locked_at = timezone.now()
+            await job.asave(
+                update_fields=[
+                    "status",
+                    "files_total",
+                    "files_done",
+                    "bytes_fetched",
+                    "locked_at",
+                    "updated_at",
+                ]
+            )
+
+
+async def run_job(job: SnapshotJob) -> SnapshotJob:
+    """Run a claimed job to completion and record the outcome."""
+    try:
+        code_state = await update_codebase(
+            job.user,
+            job.repository,
+            job.branch,
+            job.commit_sha,
+            job.user.access_token,
+            progress=_JobProgress(job),
+            changes=job.changes,
+        )
+        job.status = "done"
+        job.code_state = code_state
+        job.error = ""
+    except asyncio.CancelledError:
+        # Back to the queue rather than left active until it goes stale
+        await SnapshotJob.objects.filter(id=job.id).aupdate(status="queued", locked_at=None)
+        logger.warning(f"[jobs] job {job.id} cancelled, re-queued")
+        raise
+    except Exception as e:
+        logger.error(f"[jobs] job {job.id} failed: {e}", exc_info=True)
+        job.status = "failed"
+        job.error = str(e)
+    job.locked_at = None
+    job.finished_at = timezone.now()
+    await job.asave(
+        update_fields=[
+            "status",
+            "code_state",
+            "error",
+            "files_total",
+            "files_done",
+            "bytes_fetched",
+            "locked_at",
+            "finished_at",
+            "updated_at",
+        ]
+    )
+    logger.info(f"[jobs] job {job.id} {job.status}")
+
+    if job.status == "done":
+        # After the job is marked done so waiting users are not held up;
+        # variants that are missing are built when first served anyway
+        try:
+            await sync_to_async(build_state_variants)(job.code_state)
+            await sync_to_async(prune_pinned_variants)(job.repository_id)
+        except Exception as e:
+            logger.error(f"[jobs] variants of job {job.id} failed: {e}", exc_info=True)
+    return job
+
+
+async def _run_inline(job: SnapshotJob):
+    await run_job(job)
+    # Pushes that arrived meanwhile were coalesced into one queued job
+    next_job = (
+        await SnapshotJob.objects.filter(
+            repository_id=job.repository_id, branch_id=job.branch_id, status="queued"
+        )
+        .order_by("created_at")
+        .afirst()
+    )
+    if next_job is not None:
+        await _start_inline(next_job)
+
+
+async def _spawn_inline(job: SnapshotJob) -> bool:
+    claimed = await sync_to_async(claim_jobs)(1, job_id=job.id)
+    if not claimed:
+        return False
+    task = spawn(_run_inline(claimed[0]))
+    _inline_tasks.add(task)
+    task.add_done_callback(_inline_tasks.discard)
+    return True
+
+
+async def _start_inline(job: SnapshotJob) -> bool:
+    return await run_in_background(_spawn_inline(job))
+
+
+@on_shutdown
+async def cancel_inline_jobs():
+    """Cancel running inline jobs, which puts them back in the queue."""
+    tasks = list(_inline_tasks)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def dispatch_job(job: SnapshotJob):
+    """
+    Start job on the background loop in inline mode, where no worker would
+    pick it up; a job whose branch is busy follows the running one.
+    """
+    if settings.PREVIEW_SNAPSHOT_JOB_MODE == "inline":
+        await _start_inline(job)
+
+
+async def wait_for_job(
+    job: SnapshotJob,
+    on_progress: Optional[Callable[[SnapshotJob], Awaitable[None]]] = None,
+    timeout: float = None,
+) -> SnapshotJob:
+    """
+    Poll job until it is finished, awaiting on_progress whenever its status
+    or counters change. In inline mode the job is run here once it can start.
+    Gives up after timeout seconds (PREVIEW_SNAPSHOT_WAIT_TIMEOUT by default)
+    and returns the job as last seen; it keeps running in the meantime.
+    """
+    inline = settings.PREVIEW_SNAPSHOT_JOB_MODE == "inline"
+    timeout = timeout or settings.PREVIEW_SNAPSHOT_WAIT_TIMEOUT
+    deadline = time.monotonic() + timeout
+    await sync_to_async(release_stale_jobs)()
+    last_seen = None
+    while True:
+        await job.arefresh_from_db()
+        if job.status == "queued" and inline:
+            await _start_inline(job)
+        if job.is_finished:
+            return job
+        if time.monotonic() >= deadline:
+            logger.warning(f"[jobs] gave up waiting for job {job.id} ({job.status})")
+            return job
+
+        seen = (job.status, job.files_done, job.files_total, job.bytes_fetched)
+        if seen != last_seen and on_progress is not None:
+            await on_progress(job)
+        last_seen = seen
+        await asyncio.sleep(settings.PREVIEW_SNAPSHOT_POLL_INTERVAL)
+
+
+async def run_worker(concurrency: int = None, poll_interval: float = None, once: bool = False):
+    """Claim and run jobs, up to concurrency at a time, until cancelled."""
+    concurrency = concurrency or settings.PREVIEW_SNAPSHOT_WORKER_CONCURRENCY
+    poll_interval = poll_interval or settings.PREVIEW_SNAPSHOT_POLL_INTERVAL
+    running = set()
+
+    while True:
+        released = await sync_to_async(release_stale_jobs)()
+        if released:
+            logger.warning(f"[jobs] re-queued {released} stale jobs")
+
+        free = concurrency - len(running)
+        jobs = await sync_to_async(claim_jobs)(free) if free > 0 else []
+        for job in jobs:
+            running.add(asyncio.create_task(run_job(job)))
+
+        if once and not running:
+            return
+        if running:
+            _, running = await asyncio.wait(
+                running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED
+            )
+        else:
+            await asyncio.sleep(poll_interval)
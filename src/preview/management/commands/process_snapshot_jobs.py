@@ -0,0 +1,25 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from preview.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = "Runs queued snapshot jobs (PREVIEW_SNAPSHOT_JOB_MODE=queue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, help="Jobs run at the same time"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no job is left"
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Processing snapshot jobs...")
+        try:
+            asyncio.run(
+                run_worker(concurrency=options["concurrency"], once=options["once"])
+            )
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,29 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand
+from preview.jobs import run_worker
+from preview.webhooks import handle_push
+
+
+class Command(BaseCommand):
+    help = "Replays recorded GitHub push payloads as if the webhook received them"
+
+    def add_arguments(self, parser):
+        parser.add_argument("payloads", nargs="+", help="JSON files, replayed in order")
+        parser.add_argument(
+            "--run", action="store_true", help="Run the queued snapshot jobs afterwards"
+        )
+
+    def handle(self, *args, **options):
+        asyncio.run(self._replay(options["payloads"], options["run"]))
+
+    async def _replay(self, paths, run):
+        for path in paths:
+            with open(path) as f:
+                payload = json.load(f)
+            # Jobs are left queued; --run works through them with a worker
+            result = await handle_push(payload, dispatch=False)
+            self.stdout.write(f"{path}: {result['status']}, jobs {result['jobs']}")
+        if run:
+            await run_worker(once=True)
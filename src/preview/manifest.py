@@ -0,0 +1,62 @@
+# src/preview/manifest.py
+"""
+File manifests (path -> blob SHA) and the diff between two of them, used
+to snapshot a commit incrementally from its recursive tree: the stored
+state is compared with the new tree in one pass, however many files
+changed and whether or not the old commit is still reachable.
+"""
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .models import RepositoryCodeState
+from .overlay import effective_files
+
+
+class ManifestDiff(NamedTuple):
+    added: Dict[str, str]
+    modified: Dict[str, str]
+    removed: List[str]
+    # new path -> (old path, blob SHA)
+    renamed: Dict[str, Tuple[str, str]]
+
+
+def stored_manifest(code_state: RepositoryCodeState) -> Dict[str, Optional[str]]:
+    """Manifest of a stored state; rows from before blobs map to None."""
+    return dict(effective_files(code_state).values_list("path", "blob_id"))
+
+
+def tree_manifest(tree: dict) -> Dict[str, str]:
+    """Manifest of a recursive git tree as returned by the GitHub API."""
+    return {
+        item["path"]: item["sha"]
+        for item in tree.get("tree", [])
+        if item["type"] == "blob"
+    }
+
+
+def diff_manifests(old: Dict[str, Optional[str]], new: Dict[str, str]) -> ManifestDiff:
+    """
+    Files added, modified, removed and renamed from old to new. A rename
+    is an exact one: a removed path whose blob reappears under an added path.
+    Paths without a known SHA in old count as modified.
+    """
+    added, modified = {}, {}
+    for path, sha in new.items():
+        if path not in old:
+            added[path] = sha
+        elif old[path] != sha:
+            modified[path] = sha
+
+    removed_by_sha: Dict[str, List[str]] = {}
+    for path in sorted(old):
+        if path not in new and old[path]:
+            removed_by_sha.setdefault(old[path], []).append(path)
+
+    renamed = {}
+    for path in sorted(added):
+        sources = removed_by_sha.get(added[path])
+        if sources:
+            renamed[path] = (sources.pop(0), added.pop(path))
+
+    renamed_from = {old_path for old_path, _ in renamed.values()}
+    removed = [path for path in old if path not in new and path not in renamed_from]
+    return ManifestDiff(added, modified, removed, renamed)
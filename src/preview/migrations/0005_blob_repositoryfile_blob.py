@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0004_repositoryfile_file_type_repositoryfile_size_bytes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha', models.CharField(max_length=40, primary_key=True, serialize=False)),
+                ('content', models.TextField(blank=True, null=True)),
+                ('is_binary', models.BooleanField(default=False)),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='repositoryfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, db_constraint=False, help_text='Git blob holding the content; rows may reference a blob that has not been stored yet', null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='files', to='preview.blob'),
+        ),
+    ]
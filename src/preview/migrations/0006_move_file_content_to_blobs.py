@@ -0,0 +1,38 @@
+import hashlib
+
+from django.db import migrations
+
+
+def move_content_to_blobs(apps, schema_editor):
+    """Store existing inline file contents as git blobs and point rows at them."""
+    Blob = apps.get_model("preview", "Blob")
+    RepositoryFile = apps.get_model("preview", "RepositoryFile")
+
+    files = RepositoryFile.objects.filter(blob__isnull=True, content__isnull=False)
+    batch = []
+    for f in files.iterator(chunk_size=500):
+        data = f.content.encode("utf-8")
+        sha = hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+        Blob.objects.get_or_create(
+            sha=sha,
+            defaults={"content": f.content, "is_binary": False, "size_bytes": len(data)},
+        )
+        f.blob_id = sha
+        f.content = None
+        batch.append(f)
+        if len(batch) >= 500:
+            RepositoryFile.objects.bulk_update(batch, ["blob", "content"])
+            batch = []
+    if batch:
+        RepositoryFile.objects.bulk_update(batch, ["blob", "content"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("preview", "0005_blob_repositoryfile_blob"),
+    ]
+
+    operations = [
+        migrations.RunPython(move_content_to_blobs, migrations.RunPython.noop),
+    ]
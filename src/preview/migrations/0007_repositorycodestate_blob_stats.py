@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0006_move_file_content_to_blobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositorycodestate',
+            name='blobs_fetched',
+            field=models.PositiveIntegerField(default=0, help_text='Blobs downloaded from GitHub for this state'),
+        ),
+        migrations.AddField(
+            model_name='repositorycodestate',
+            name='blobs_reused',
+            field=models.PositiveIntegerField(default=0, help_text='Blobs that were already stored when the state was created'),
+        ),
+    ]
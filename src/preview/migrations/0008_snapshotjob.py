@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-18 15:54
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_githubresponsecache'),
+        ('preview', '0007_repositorycodestate_blob_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('commit_sha', models.CharField(max_length=40)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('fetching_tree', 'Fetching tree'), ('fetching_blobs', 'Fetching blobs'), ('writing', 'Writing'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=20)),
+                ('files_total', models.PositiveIntegerField(default=0, help_text='Blobs that have to be downloaded')),
+                ('files_done', models.PositiveIntegerField(default=0)),
+                ('bytes_fetched', models.PositiveBigIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True, default='')),
+                ('locked_at', models.DateTimeField(blank=True, help_text='Heartbeat of the worker running the job', null=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('branch', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_jobs', to='accounts.branch')),
+                ('code_state', models.ForeignKey(blank=True, help_text='Resulting code state once the job is done', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='snapshot_jobs', to='preview.repositorycodestate')),
+                ('repository', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_jobs', to='accounts.repository')),
+                ('user', models.ForeignKey(help_text='User whose GitHub token the job runs with', on_delete=django.db.models.deletion.CASCADE, related_name='snapshot_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+                'unique_together': {('repository', 'branch', 'commit_sha')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0008_snapshotjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='snapshotjob',
+            name='changes',
+            field=models.JSONField(blank=True, help_text='Files changed since a base commit, collected from push webhooks: {"base": sha, "files": {path: status}}', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0009_snapshotjob_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='repositoryfile',
+            name='previous_path',
+            field=models.CharField(blank=True, help_text='Path the file had before a rename', max_length=500, null=True),
+        ),
+        migrations.AlterField(
+            model_name='repositoryfile',
+            name='change_type',
+            field=models.CharField(choices=[('added', 'Added'), ('modified', 'Modified'), ('removed', 'Removed'), ('renamed', 'Renamed'), ('unchanged', 'Unchanged')], default='unchanged', max_length=20),
+        ),
+    ]
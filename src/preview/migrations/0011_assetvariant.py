@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0010_repositoryfile_previous_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AssetVariant',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_type', models.CharField(max_length=100)),
+                ('prefix', models.CharField(blank=True, default='', help_text='Preview URL prefix the links were rewritten to', max_length=100)),
+                ('encoding', models.CharField(choices=[('identity', 'Identity'), ('gzip', 'gzip'), ('br', 'Brotli')], max_length=10)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='variants', to='preview.blob')),
+            ],
+            options={
+                'unique_together': {('blob', 'content_type', 'prefix', 'encoding')},
+            },
+        ),
+    ]
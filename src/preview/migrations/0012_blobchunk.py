@@ -0,0 +1,28 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:16
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0011_assetvariant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlobChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField()),
+                ('offset', models.BigIntegerField(help_text='Position of the first byte in the blob')),
+                ('data', models.BinaryField()),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='preview.blob')),
+            ],
+            options={
+                'ordering': ['index'],
+                'unique_together': {('blob', 'index')},
+            },
+        ),
+    ]
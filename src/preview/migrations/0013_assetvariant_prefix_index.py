@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-18 16:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('preview', '0012_blobchunk'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='assetvariant',
+            name='prefix',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Preview URL prefix the links were rewritten to', max_length=100),
+        ),
+    ]
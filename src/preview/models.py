@@ -1,6 +1,7 @@
 from django.db import models
 from accounts.models import Repository
 from accounts.models import Branch
+from accounts.models import User
 
 
 class RepositoryCodeState(models.Model):
@@ -24,6 +25,12 @@ class RepositoryCodeState(models.Model):
     )
     commit_sha = models.CharField(max_length=40, db_index=True, null=True)
     is_initial = models.BooleanField(default=False)
+    blobs_reused = models.PositiveIntegerField(
+        default=0, help_text="Blobs that were already stored when the state was created"
+    )
+    blobs_fetched = models.PositiveIntegerField(
+        default=0, help_text="Blobs downloaded from GitHub for this state"
+    )
     created_at = models.DateTimeField(
         auto_now_add=True, help_text="Timestamp when the record was created"
     )
@@ -39,6 +46,75 @@ class RepositoryCodeState(models.Model):
         return f"Code state for {self.repository.name} ({self.commit_sha[:8]})"
 
 
+class Blob(models.Model):
+    """
+    File content addressed by its git blob SHA. Identical files across
+    branches, commits and users share a single row.
+    """
+
+    sha = models.CharField(max_length=40, primary_key=True)
+    content = models.TextField(null=True, blank=True)
+    is_binary = models.BooleanField(default=False)
+    size_bytes = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha
+
+
+class BlobChunk(models.Model):
+    """
+    A slice of a binary blob's raw bytes. Binary files are stored in chunks
+    of PREVIEW_BLOB_CHUNK_SIZE so they can be streamed (and served in byte
+    ranges) one row at a time instead of being loaded whole.
+    """
+
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name="chunks")
+    index = models.PositiveIntegerField()
+    offset = models.BigIntegerField(help_text="Position of the first byte in the blob")
+    data = models.BinaryField()
+
+    class Meta:
+        unique_together = ("blob", "index")
+        ordering = ["index"]
+
+    def __str__(self):
+        return f"{self.blob_id} chunk {self.index}"
+
+
+class AssetVariant(models.Model):
+    """
+    A text blob as served: rewritten for a preview URL prefix (HTML and CSS
+    only, empty prefix otherwise) and encoded for transfer. Built once per
+    blob, content type, prefix and encoding instead of on every request.
+    """
+
+    ENCODING_CHOICES = [
+        ("identity", "Identity"),
+        ("gzip", "gzip"),
+        ("br", "Brotli"),
+    ]
+
+    blob = models.ForeignKey(Blob, on_delete=models.CASCADE, related_name="variants")
+    content_type = models.CharField(max_length=100)
+    prefix = models.CharField(
+        max_length=100,
+        blank=True,
+        default="",
+        db_index=True,
+        help_text="Preview URL prefix the links were rewritten to",
+    )
+    encoding = models.CharField(max_length=10, choices=ENCODING_CHOICES)
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ("blob", "content_type", "prefix", "encoding")
+
+    def __str__(self):
+        return f"{self.blob_id} {self.content_type} {self.prefix} ({self.encoding})"
+
+
 class RepositoryFile(models.Model):
     code_state = models.ForeignKey(
         RepositoryCodeState,
@@ -47,6 +123,16 @@ class RepositoryFile(models.Model):
         help_text="The code state this file belongs to",
     )
     path = models.CharField(max_length=500)
+    blob = models.ForeignKey(
+        Blob,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        null=True,
+        blank=True,
+        related_name="files",
+        help_text="Git blob holding the content; rows may reference a blob "
+        "that has not been stored yet",
+    )
     file_type = models.CharField(
         max_length=10,
         choices=[("html", "HTML"), ("css", "CSS"), ("js", "JavaScript")],
@@ -62,10 +148,17 @@ class RepositoryFile(models.Model):
             ("added", "Added"),
             ("modified", "Modified"),
             ("removed", "Removed"),
+            ("renamed", "Renamed"),
             ("unchanged", "Unchanged"),
         ],
         default="unchanged",
     )
+    previous_path = models.CharField(
+        max_length=500,
+        null=True,
+        blank=True,
+        help_text="Path the file had before a rename",
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -78,22 +171,114 @@ class RepositoryFile(models.Model):
     def __str__(self):
         return f"{self.path} ({self.file_type})"
 
+    FILE_TYPES = {
+        "html": "html",
+        "htm": "html",
+        "css": "css",
+        "js": "js",
+        "jsx": "js",
+    }
+
+    @classmethod
+    def detect_file_type(cls, path: str) -> str:
+        """file_type of a path, by extension; set by save() and by bulk writers."""
+        ext = path.split(".")[-1].lower() if "." in path else ""
+        return cls.FILE_TYPES.get(ext, "other")
+
     def save(self, *args, **kwargs):
         # Auto-detect type
         if not self.file_type or self.file_type == "other":
-            ext = self.get_file_extension()
-            self.file_type = {
-                "html": "html",
-                "htm": "html",
-                "css": "css",
-                "js": "js",
-                "jsx": "js",
-            }.get(ext, "other")
+            self.file_type = self.detect_file_type(self.path)
 
         # Calculate size
-        self.size_bytes = len(self.content.encode("utf-8"))
+        if self.content is not None:
+            self.size_bytes = len(self.content.encode("utf-8"))
 
         super().save(*args, **kwargs)
 
+    def get_content(self):
+        """Content of the file, read from its blob when it has one."""
+        if self.blob_id:
+            try:
+                return self.blob.content if self.blob else None
+            except Blob.DoesNotExist:
+                return None
+        return self.content
+
     def get_file_extension(self):
         return self.path.split(".")[-1].lower() if "." in self.path else ""
+
+
+class SnapshotJob(models.Model):
+    """
+    A request to snapshot a (repository, branch, commit) and its progress.
+    Jobs are run by manage.py process_snapshot_jobs (or inline by the bot);
+    the same commit requested twice shares one job.
+    """
+
+    STATUS_CHOICES = [
+        ("queued", "Queued"),
+        ("fetching_tree", "Fetching tree"),
+        ("fetching_blobs", "Fetching blobs"),
+        ("writing", "Writing"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+    ACTIVE_STATUSES = ("fetching_tree", "fetching_blobs", "writing")
+    FINISHED_STATUSES = ("done", "failed")
+
+    repository = models.ForeignKey(
+        Repository, on_delete=models.CASCADE, related_name="snapshot_jobs"
+    )
+    branch = models.ForeignKey(
+        Branch, on_delete=models.CASCADE, related_name="snapshot_jobs"
+    )
+    commit_sha = models.CharField(max_length=40)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="snapshot_jobs",
+        help_text="User whose GitHub token the job runs with",
+    )
+    code_state = models.ForeignKey(
+        RepositoryCodeState,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="snapshot_jobs",
+        help_text="Resulting code state once the job is done",
+    )
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default="queued", db_index=True
+    )
+    files_total = models.PositiveIntegerField(
+        default=0, help_text="Blobs that have to be downloaded"
+    )
+    files_done = models.PositiveIntegerField(default=0)
+    bytes_fetched = models.PositiveBigIntegerField(default=0)
+    changes = models.JSONField(
+        null=True,
+        blank=True,
+        help_text="Files changed since a base commit, collected from push "
+        'webhooks: {"base": sha, "files": {path: status}}',
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    locked_at = models.DateTimeField(
+        null=True, blank=True, help_text="Heartbeat of the worker running the job"
+    )
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ("repository", "branch", "commit_sha")
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Snapshot {self.commit_sha[:8]} of {self.repository_id} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
@@ -0,0 +1,151 @@
+# src/preview/overlay.py
+"""
+Incremental code states only store the rows that changed since the previous
+state of the same branch. The effective file set of a state is the overlay of
+its chain: every state back to the last is_initial one, where the most recent
+row per path wins and "removed" rows hide the path.
+"""
+import logging
+from typing import Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from .models import RepositoryCodeState, RepositoryFile
+
+logger = logging.getLogger(__name__)
+
+
+def _base_state_id(code_state: RepositoryCodeState) -> int:
+    """Id of the is_initial state the chain of code_state starts from."""
+    if code_state.is_initial:
+        return code_state.id
+    base_id = (
+        RepositoryCodeState.objects.filter(
+            repository_id=code_state.repository_id,
+            branch_id=code_state.branch_id,
+            is_initial=True,
+            id__lte=code_state.id,
+        )
+        .order_by("-id")
+        .values_list("id", flat=True)
+        .first()
+    )
+    # Legacy chains without an initial state: overlay everything before it
+    return base_id or 0
+
+
+def _chain_files(code_state: RepositoryCodeState, base_id: int):
+    return RepositoryFile.objects.filter(
+        code_state__repository_id=code_state.repository_id,
+        code_state__branch_id=code_state.branch_id,
+        code_state_id__gte=base_id,
+        code_state_id__lte=code_state.id,
+    )
+
+
+def chain_depth(code_state: RepositoryCodeState) -> int:
+    """Number of states that have to be overlaid to resolve code_state."""
+    if code_state.is_initial:
+        return 1
+    return RepositoryCodeState.objects.filter(
+        repository_id=code_state.repository_id,
+        branch_id=code_state.branch_id,
+        id__gte=_base_state_id(code_state),
+        id__lte=code_state.id,
+    ).count()
+
+
+def effective_files(code_state: RepositoryCodeState, path_prefix: str = ""):
+    """
+    QuerySet of the RepositoryFile rows that make up code_state, optionally
+    restricted to paths under path_prefix.
+    """
+    if code_state.is_initial:
+        files = code_state.files.exclude(change_type="removed").select_related("blob")
+        if path_prefix:
+            files = files.filter(path__startswith=path_prefix)
+        return files
+
+    rows = _chain_files(code_state, _base_state_id(code_state))
+    if path_prefix:
+        rows = rows.filter(path__startswith=path_prefix)
+    rows = rows.order_by("path", "-code_state_id")
+
+    if connection.features.can_distinct_on_fields:
+        # Postgres: DISTINCT ON (path) keeps the newest row per path
+        latest_ids = rows.distinct("path").values("id")
+    else:
+        latest_ids = []
+        last_path = None
+        for file_id, path in rows.values_list("id", "path"):
+            if path != last_path:
+                latest_ids.append(file_id)
+                last_path = path
+
+    return (
+        RepositoryFile.objects.filter(id__in=latest_ids)
+        .exclude(change_type="removed")
+        .select_related("blob")
+    )
+
+
+def resolve_file(
+    code_state: RepositoryCodeState, path: str, with_content: bool = True
+) -> Optional[RepositoryFile]:
+    """
+    Effective row for a single path, or None if it does not exist in code_state.
+    Without with_content only the row itself is read (enough for blob_id).
+    """
+    if code_state.is_initial:
+        rows = code_state.files.filter(path=path)
+    else:
+        rows = _chain_files(code_state, _base_state_id(code_state)).filter(
+            path=path
+        ).order_by("-code_state_id")
+    rows = rows.select_related("blob") if with_content else rows.defer("content")
+    f = rows.first()
+    if f is None or f.change_type == "removed":
+        return None
+    return f
+
+
+@transaction.atomic
+def compact_code_state(code_state: RepositoryCodeState) -> RepositoryCodeState:
+    """
+    Fold the chain of code_state into the state itself so it becomes a new
+    base: inherited rows are copied in as "unchanged", removed rows dropped.
+    """
+    if code_state.is_initial:
+        return code_state
+
+    inherited = effective_files(code_state).exclude(code_state=code_state)
+    RepositoryFile.objects.bulk_create(
+        [
+            RepositoryFile(
+                code_state=code_state,
+                path=f.path,
+                blob_id=f.blob_id,
+                file_type=f.file_type,
+                size_bytes=f.size_bytes,
+                content=f.content,
+                is_binary=f.is_binary,
+                change_type="unchanged",
+            )
+            for f in inherited.iterator()
+        ],
+        batch_size=500,
+    )
+    code_state.files.filter(change_type="removed").delete()
+
+    code_state.is_initial = True
+    code_state.save(update_fields=["is_initial", "updated_at"])
+    logger.info(f"[preview] compacted state_id={code_state.id} into a base snapshot")
+    return code_state
+
+
+def compact_if_needed(code_state: RepositoryCodeState) -> RepositoryCodeState:
+    """Compact once the chain is deeper than PREVIEW_SNAPSHOT_MAX_CHAIN_DEPTH."""
+    if chain_depth(code_state) > settings.PREVIEW_SNAPSHOT_MAX_CHAIN_DEPTH:
+        return compact_code_state(code_state)
+    return code_state
@@ -0,0 +1,97 @@
+# src/preview/rewrite.py
+"""
+Serving-time transformations of preview files: content types, and HTML/CSS
+whose root-absolute links are rewritten into the preview namespace.
+"""
+import mimetypes
+import re
+
+def preview_prefix(repo_id, commit_sha: str = None) -> str:
+    """URL prefix files are served under; pinned pages link within their commit."""
+    return f"/preview/{repo_id}/{commit_sha}" if commit_sha else f"/preview/{repo_id}"
+
+
+# Rewrite attributes like src="/foo.js" or href="/bar.css" to /preview/<repo_id>/foo.js
+_HTML_ABS_ATTR = re.compile(
+    r'(?P<attr>\s(?:src|href)=)(?P<q>["\'])/(?P<rest>[^"\']+)(?P=q)',
+    re.IGNORECASE
+)
+
+def rewrite_html_urls(html: str, prefix: str) -> str:
+    """
+    Rewrites <... src="/foo"> to <... src="/preview/<repo_id>/foo">.
+    prefix should be something like "/preview/123" (no trailing slash).
+    Leaves protocol-relative //... and absolute URLs intact.
+    """
+    def repl(m):
+        rest = m.group('rest')
+        # If rest starts with '/', it's likely protocol-relative (//...) -> skip rewriting.
+        # (The regex consumed only one leading '/', so protocol-relative will start with '/')
+        if rest.startswith('/'):
+            return m.group(0)
+        return f'{m.group("attr")}{m.group("q")}{prefix}/{rest}{m.group("q")}'
+    return _HTML_ABS_ATTR.sub(repl, html)
+
+# Rewrite CSS url('/foo.png') -> url('/preview/<repo_id>/foo.png')
+_CSS_URL_ABS = re.compile(r'url\(\s*(?P<q>[\'"]?)/(?P<rest>[^)\'"]+)(?P=q)\s*\)', re.IGNORECASE)
+
+def rewrite_css_urls(css: str, prefix: str) -> str:
+    def repl(m):
+        q = m.group('q') or ''
+        rest = m.group('rest')
+        # If rest starts with '/', it's protocol-relative (//...) -> skip
+        if rest.startswith('/'):
+            return m.group(0)
+        return f'url({q}{prefix}/{rest}{q})'
+    return _CSS_URL_ABS.sub(repl, css)
+
+
+# Types of common web assets that older mimetypes tables lack
+_FALLBACK_TYPES = {
+    "js": "application/javascript",
+    "css": "text/css",
+    "html": "text/html",
+    "htm": "text/html",
+    "woff": "font/woff",
+    "woff2": "font/woff2",
+    "ttf": "font/ttf",
+    "otf": "font/otf",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "ico": "image/x-icon",
+    "mp4": "video/mp4",
+    "webm": "video/webm",
+    "wasm": "application/wasm",
+}
+
+
+def guess_mime_type(path: str) -> str:
+    mime_type, _ = mimetypes.guess_type(path)
+    if not mime_type:
+        ext = path.rsplit(".", 1)[-1].lower() if "." in path else ""
+        mime_type = _FALLBACK_TYPES.get(ext, "application/octet-stream")
+    return mime_type
+
+
+# Served as text (UTF-8) unless the blob is binary
+TEXT_LIKE_TYPES = ("application/javascript", "application/json", "image/svg+xml")
+
+
+def is_text_like(mime_type: str) -> bool:
+    return mime_type.startswith("text/") or mime_type in TEXT_LIKE_TYPES
+
+
+def rewrite_text(content: str, mime_type: str, prefix: str) -> str:
+    """content as served under prefix: HTML and CSS links point into it."""
+    # If HTML, rewrite absolute src/href to point to preview namespace
+    if mime_type == "text/html":
+        # optional: inject <base href> to help relative paths if desired
+        # NOTE: injecting base can alter how relative paths resolve - test before enabling
+        # if '<base ' not in content.lower():
+        #     content = content.replace('<head>', '<head><base href="%s/">' % prefix, 1)
+        return rewrite_html_urls(content, prefix)
+
+    # If CSS, rewrite url(...) absolute paths
+    if mime_type == "text/css":
+        return rewrite_css_urls(content, prefix)
+    return content
@@ -1,165 +1,424 @@
 from .models import *
-import httpx
-import base64
+from accounts.services.github_client import github_request
+from .archive import aingest_archive
+from .blobstore import missing_data, save_blobs, split_chunks
+from .fetcher import FetchScheduler
+from .manifest import ManifestDiff, diff_manifests, stored_manifest, tree_manifest
+from .overlay import compact_if_needed, effective_files
+from .snapshot_cache import discard_snapshots
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
 import asyncio
+import httpx
 import logging
+import tarfile
+from typing import Dict
 
 async def _make_request(
     access_token: str, url: str, params: dict = None, headers: dict = None
 ) -> dict:
-    headers = {"Accept": "application/vnd.github.v3+json"}
     """Async helper method to make GitHub API requests"""
-    if headers is None:
-        headers = {**headers, "Authorization": f"Bearer {access_token}"}
-    else:
-        headers = {**headers, "Authorization": f"Bearer {access_token}"}
+    response = await github_request(access_token, url, params=params, headers=headers)
+    response.raise_for_status()
+    return response.json()
+
 
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers, params=params, timeout=10)
-        response.raise_for_status()
-        return response.json()
+async def _report(progress, stage, **counts):
+    """
+    Forward a pipeline step to the optional progress callback:
+    stage is a SnapshotJob status, counts are files_total, files_done and
+    bytes_fetched.
+    """
+    if progress is not None:
+        await progress(stage, **counts)
 
 
-async def get_file_content(owner, repo, path, ref, token):
-    url = f"https://api.github.com/repos/{owner}/{repo}/contents/{path}?ref={ref}"
+async def _with_heartbeat(aw, progress, stage):
+    """
+    Await aw, reporting stage every PREVIEW_SNAPSHOT_PROGRESS_INTERVAL so a
+    long step without counters of its own (the archive download) keeps the
+    job's heartbeat fresh.
+    """
+    if progress is None:
+        return await aw
+    task = asyncio.ensure_future(aw)
     try:
-        data = await _make_request(url=url, access_token=token)
-        if data.get("encoding") == "base64":
-            decoded = base64.b64decode(data["content"])
-            try:
-                decoded_text = decoded.decode("utf-8")
-                return decoded_text, False  # not binary
-            except UnicodeDecodeError:
-                return None, True  # binary file
-        return None, True
-    except Exception as e:
-        logging.error(f"Failed to fetch content for {path}: {str(e)}")
-        return None, True
-
-
-async def _fetch_contents(owner, repo, paths, branch_name, github_token):
-    """Fetch multiple file contents in parallel"""
-    tasks = [
-        get_file_content(owner, repo, path, branch_name, github_token) for path in paths
+        while True:
+            done, _ = await asyncio.wait(
+                {task}, timeout=settings.PREVIEW_SNAPSHOT_PROGRESS_INTERVAL
+            )
+            if done:
+                return task.result()
+            await _report(progress, stage)
+    finally:
+        task.cancel()
+
+
+async def _store_blobs(owner, repo, ref, shas, github_token, progress=None, prefetched=None):
+    """
+    Make sure a Blob row exists for every sha in shas.
+    The incoming SHAs are diffed against the blobs already stored (by any
+    branch or earlier state), only the missing ones are fetched: from the
+    tarball of ref when more than PREVIEW_ARCHIVE_INGEST_THRESHOLD are
+    missing, otherwise (and for anything the archive lacked) one by one.
+    Blobs that fail to download are left out of the store (is_binary=False
+    in the result) so retry_missing_blobs can pick them up later; binary
+    blobs stored without their bytes count as missing.
+    prefetched maps SHAs to unsaved Blobs whose content is already at hand.
+    Returns ({sha: is_binary}, reused_count, fetched_count).
+    """
+    shas = set(shas)
+    stored = {
+        sha: is_binary
+        async for sha, is_binary in Blob.objects.filter(sha__in=list(shas))
+        .exclude(missing_data())
+        .values_list("sha", "is_binary")
+    }
+    missing = [sha for sha in shas if sha not in stored]
+    reused = len(stored)
+    prefetched_blobs = [prefetched[sha] for sha in missing if sha in (prefetched or {})]
+    if prefetched_blobs:
+        stored.update({blob.sha: blob.is_binary for blob in prefetched_blobs})
+        missing = [sha for sha in missing if sha not in stored]
+    await _report(progress, "fetching_blobs", files_total=len(missing), files_done=0)
+
+    scheduler = FetchScheduler(github_token)
+    archived = {}
+    if len(missing) > settings.PREVIEW_ARCHIVE_INGEST_THRESHOLD:
+        try:
+            archived = await _with_heartbeat(
+                aingest_archive(owner, repo, ref, missing, scheduler), progress, "fetching_blobs"
+            )
+        except (httpx.HTTPError, tarfile.TarError) as e:
+            logging.error(f"Archive ingestion failed for {owner}/{repo}@{ref}: {str(e)}")
+        stored.update(archived)
+        missing = [sha for sha in missing if sha not in archived]
+
+    done = len(archived)
+    fetched_bytes = 0
+
+    async def on_result(result):
+        nonlocal done, fetched_bytes
+        done += 1
+        fetched_bytes += result.size
+        if result.is_binary:
+            # Stored as each arrives so raw bytes never pile up in memory
+            blob = Blob(sha=result.sha, content=None, is_binary=True, size_bytes=result.size)
+            await sync_to_async(save_blobs)([blob], split_chunks(result.sha, result.data))
+        await _report(
+            progress, "fetching_blobs", files_done=done, bytes_fetched=fetched_bytes
+        )
+
+    # Fetch contents in parallel (bounded), one request per missing blob
+    results = await scheduler.fetch_blobs(owner, repo, missing, on_result=on_result)
+
+    failed = [result.sha for result in results if result.failed]
+    if failed:
+        # Not stored, so the next sync of this state fetches them again
+        logging.warning(
+            f"[snapshot] {len(failed)} blobs of {owner}/{repo}@{ref} failed to download"
+        )
+
+    binary = [result.sha for result in results if result.is_binary]
+    blobs_to_create = prefetched_blobs + [
+        Blob(
+            sha=result.sha,
+            content=result.content,
+            is_binary=False,
+            size_bytes=len(result.content.encode("utf-8")),
+        )
+        for result in results
+        if not result.failed and not result.is_binary
     ]
-    return await asyncio.gather(*tasks)
+    await sync_to_async(save_blobs)(blobs_to_create, [])
 
+    stored.update({blob.sha: False for blob in blobs_to_create})
+    stored.update({sha: True for sha in binary})
+    stored.update({sha: False for sha in failed})
+    return stored, reused, len(archived) + len(blobs_to_create) + len(binary)
 
-async def create_initial_snapshot(user, repo_obj, branch_obj, commit_sha, github_token):
-    owner = user.github_login
-    repo = repo_obj.name
 
-    # Create initial code state
-    code_state = await RepositoryCodeState.objects.acreate(
+async def _fetch_pushed_blobs(owner, repo, commit_sha, paths, github_token):
+    """
+    Blob SHA of each path at commit_sha in one GraphQL query, with the
+    content of text files GitHub returns in full.
+    Returns ({path: sha}, {sha: unsaved Blob}); raises ValueError when a
+    path is not a file at the commit.
+    """
+    paths = list(paths)
+    if not paths:
+        return {}, {}
+    variables = {"owner": owner, "name": repo}
+    declarations, fields = [], []
+    for i, path in enumerate(paths):
+        variables[f"e{i}"] = f"{commit_sha}:{path}"
+        declarations.append(f"$e{i}: String!")
+        fields.append(
+            f"f{i}: object(expression: $e{i}) "
+            "{ ... on Blob { oid isBinary isTruncated text } }"
+        )
+    query = (
+        f"query($owner: String!, $name: String!, {', '.join(declarations)}) "
+        f"{{ repository(owner: $owner, name: $name) {{ {' '.join(fields)} }} }}"
+    )
+    response = await github_request(
+        github_token,
+        settings.GITHUB_GRAPHQL_URL,
+        method="POST",
+        json={"query": query, "variables": variables},
+    )
+    response.raise_for_status()
+    payload = response.json()
+    repository = (payload.get("data") or {}).get("repository")
+    if not repository:
+        raise ValueError(f"GraphQL response without repository: {payload.get('errors')}")
+
+    shas, blobs = {}, {}
+    for i, path in enumerate(paths):
+        node = repository.get(f"f{i}") or {}
+        if "oid" not in node:
+            raise ValueError(f"{path} is not a file at {commit_sha}")
+        shas[path] = node["oid"]
+        # Binary files and truncated text are left for the regular blob download
+        if not node["isBinary"] and not node["isTruncated"] and node["text"] is not None:
+            blobs[node["oid"]] = Blob(
+                sha=node["oid"],
+                content=node["text"],
+                is_binary=False,
+                size_bytes=len(node["text"].encode("utf-8")),
+            )
+    return shas, blobs
+
+
+async def _blob_sizes(shas) -> Dict[str, int]:
+    """size_bytes of the stored blobs among shas."""
+    return {
+        sha: size
+        async for sha, size in Blob.objects.filter(sha__in=list(set(shas))).values_list(
+            "sha", "size_bytes"
+        )
+    }
+
+
+def _file_row(path, sha, binary_blobs, sizes, **fields) -> RepositoryFile:
+    """
+    Unsaved file row for a blob. Rows are bulk-created, which skips
+    RepositoryFile.save(), so type and size are filled in here; a blob that
+    failed to download has size 0 until retry_missing_blobs stores it.
+    """
+    return RepositoryFile(
+        path=path,
+        blob_id=sha,
+        file_type=RepositoryFile.detect_file_type(path),
+        size_bytes=sizes.get(sha, 0),
+        is_binary=binary_blobs[sha],
+        **fields,
+    )
+
+
+@transaction.atomic
+def _write_code_state(
+    repo_obj, branch_obj, commit_sha, is_initial, files, reused, fetched
+):
+    """
+    Create the code state together with its files. Blobs are stored before
+    this, so a snapshot interrupted earlier leaves no half-written state and
+    a rerun only downloads the blobs it is still missing.
+    """
+    code_state = RepositoryCodeState.objects.create(
         repository=repo_obj,
         branch=branch_obj,
         commit_sha=commit_sha,
-        is_initial=True,
+        is_initial=is_initial,
+        blobs_reused=reused,
+        blobs_fetched=fetched,
     )
+    for f in files:
+        f.code_state = code_state
+    RepositoryFile.objects.bulk_create(files, batch_size=500)
+    logging.info(
+        f"[snapshot] state_id={code_state.id}: reused {reused} blobs, fetched {fetched}"
+    )
+    return code_state
+
+
+async def _fetch_tree(owner, repo, commit_sha, github_token) -> dict:
+    """Recursive git tree of commit_sha."""
+    tree_url = f"{settings.GITHUB_API_URL}/repos/{owner}/{repo}/git/trees/{commit_sha}?recursive=1"
+    return await _make_request(url=tree_url, access_token=github_token)
+
+
+async def create_initial_snapshot(
+    user, repo_obj, branch_obj, commit_sha, github_token, progress=None, tree_data=None
+):
+    owner = user.github_login
+    repo = repo_obj.name
 
     # Get repo tree (recursive)
-    tree_url = f"https://api.github.com/repos/{owner}/{repo}/git/trees/{commit_sha}?recursive=1"
-    tree_data = await _make_request(url=tree_url, access_token=github_token)
+    await _report(progress, "fetching_tree")
+    if tree_data is None:
+        tree_data = await _fetch_tree(owner, repo, commit_sha, github_token)
 
-    # Collect all file paths first
-    file_paths = [
-        item["path"] for item in tree_data.get("tree", []) if item["type"] == "blob"
-    ]
+    # Collect all blobs first (path -> blob sha)
+    tree_blobs = tree_manifest(tree_data)
 
-    # Fetch all contents in parallel
-    contents = await _fetch_contents(
-        owner, repo, file_paths, branch_obj.name, github_token
+    # Only blobs never stored before are downloaded
+    binary_blobs, reused, fetched = await _store_blobs(
+        owner, repo, commit_sha, tree_blobs.values(), github_token, progress
     )
 
     # Prepare files for bulk creation
+    sizes = await _blob_sizes(tree_blobs.values())
     files_to_create = [
-        RepositoryFile(
-            code_state=code_state,
-            path=path,
-            content=content if not is_binary else None,
-            is_binary=is_binary,
-            change_type="added",
-        )
-        for path, (content, is_binary) in zip(file_paths, contents)
+        _file_row(path, sha, binary_blobs, sizes, change_type="added")
+        for path, sha in tree_blobs.items()
     ]
 
-    # Bulk create all files
-    await RepositoryFile.objects.abulk_create(files_to_create)
-    return code_state
+    await _report(progress, "writing")
+    return await sync_to_async(_write_code_state)(
+        repo_obj, branch_obj, commit_sha, True, files_to_create, reused, fetched
+    )
+
+
+async def _push_diff(owner, repo, new_sha, changes, github_token):
+    """
+    ManifestDiff of a push change set, with the SHAs and text of the
+    changed files from one GraphQL query. Returns (diff, prefetched blobs).
+    """
+    files = changes["files"]
+    shas, prefetched = await _fetch_pushed_blobs(
+        owner,
+        repo,
+        new_sha,
+        [path for path, status in files.items() if status != "removed"],
+        github_token,
+    )
+    diff = ManifestDiff(
+        added={path: shas[path] for path, status in files.items() if status == "added"},
+        modified={
+            path: shas[path] for path, status in files.items() if status == "modified"
+        },
+        removed=[path for path, status in files.items() if status == "removed"],
+        renamed={},
+    )
+    return diff, prefetched
+
+
+async def _compare_diff(owner, repo, old_sha, new_sha, github_token) -> ManifestDiff:
+    """ManifestDiff from the compare API (at most 300 files, old_sha must be reachable)."""
+    compare_url = (
+        f"{settings.GITHUB_API_URL}/repos/{owner}/{repo}/compare/{old_sha}...{new_sha}"
+    )
+    compare_data = await _make_request(url=compare_url, access_token=github_token)
+    diff = ManifestDiff({}, {}, [], {})
+    for f in compare_data.get("files", []):
+        if f["status"] == "removed":
+            diff.removed.append(f["filename"])
+        elif f["status"] == "renamed":
+            diff.renamed[f["filename"]] = (f["previous_filename"], f["sha"])
+        elif f["status"] in ("added", "copied"):
+            diff.added[f["filename"]] = f["sha"]
+        else:
+            diff.modified[f["filename"]] = f["sha"]
+    return diff
 
 
 async def create_incremental_snapshot(
-    user, repo_obj, branch_obj, old_sha, new_sha, github_token
+    user, repo_obj, branch_obj, previous_state, new_sha, github_token, progress=None, changes=None
 ):
+    """
+    Snapshot new_sha as the files changed since previous_state. With the
+    changes of a push (see preview.changes) starting at the previous commit,
+    their SHAs and text come from a single GraphQL query. Otherwise the
+    stored manifest of previous_state is diffed against the tree of new_sha;
+    the compare API is only left for trees GitHub truncates.
+    """
     owner = user.github_login
     repo = repo_obj.name
+    old_sha = previous_state.commit_sha
 
     # Get changed files list
-    compare_url = (
-        f"https://api.github.com/repos/{owner}/{repo}/compare/{old_sha}...{new_sha}"
-    )
-    compare_data = await _make_request(url=compare_url, access_token=github_token)
-
-    # Create new code state
-    code_state = await RepositoryCodeState.objects.acreate(
-        repository=repo_obj,
-        branch=branch_obj,
-        commit_sha=new_sha,
-        is_initial=False,
-    )
+    await _report(progress, "fetching_tree")
+    diff = None
+    prefetched = {}
+    if (
+        changes is not None
+        and changes["base"] == old_sha
+        and len(changes["files"]) <= settings.PREVIEW_PUSH_MAX_FILES
+    ):
+        try:
+            diff, prefetched = await _push_diff(owner, repo, new_sha, changes, github_token)
+        except (httpx.HTTPError, ValueError) as e:
+            logging.warning(f"[snapshot] push changes of {owner}/{repo} unusable: {str(e)}")
 
-    # Separate files by type for parallel fetching
-    modified_files = [
-        f["filename"]
-        for f in compare_data.get("files", [])
-        if f["status"] in ("added", "modified")
-    ]
-    removed_files = [
-        f["filename"] for f in compare_data.get("files", []) if f["status"] == "removed"
-    ]
+    if diff is None:
+        tree_data = await _fetch_tree(owner, repo, new_sha, github_token)
+        old_manifest = await sync_to_async(stored_manifest)(previous_state)
+        if not old_manifest:
+            # Nothing stored to diff against: start a new chain from the tree
+            logging.warning(
+                f"[snapshot] state_id={previous_state.id} has no files, taking a full snapshot"
+            )
+            return await create_initial_snapshot(
+                user, repo_obj, branch_obj, new_sha, github_token, progress, tree_data
+            )
+        if tree_data.get("truncated"):
+            diff = await _compare_diff(owner, repo, old_sha, new_sha, github_token)
+        else:
+            diff = diff_manifests(old_manifest, tree_manifest(tree_data))
 
-    # Fetch contents in parallel only for modified/added files
-    contents = await _fetch_contents(
-        owner, repo, modified_files, branch_obj.name, github_token
+    changed_files = {**diff.added, **diff.modified}
+    changed_files.update((path, sha) for path, (_, sha) in diff.renamed.items())
+    binary_blobs, reused, fetched = await _store_blobs(
+        owner, repo, new_sha, changed_files.values(), github_token, progress, prefetched
     )
 
     # Prepare files for bulk creation
+    sizes = await _blob_sizes(changed_files.values())
     files_to_create = [
-        RepositoryFile(
-            code_state=code_state,
-            path=path,
-            content=content if not is_binary else None,
-            is_binary=is_binary,
-            change_type="modified",  # Will be updated below
-        )
-        for path, (content, is_binary) in zip(modified_files, contents)
+        _file_row(path, sha, binary_blobs, sizes, change_type=change_type)
+        for change_type, files in (("added", diff.added), ("modified", diff.modified))
+        for path, sha in files.items()
     ]
+    files_to_create.extend(
+        _file_row(
+            path, sha, binary_blobs, sizes, change_type="renamed", previous_path=previous_path
+        )
+        for path, (previous_path, sha) in diff.renamed.items()
+    )
 
-    # Add removed files
+    # Removed rows hide the path in the overlay, the old path of a rename too
+    removed_files = diff.removed + [old for old, _ in diff.renamed.values()]
     files_to_create.extend(
         RepositoryFile(
-            code_state=code_state,
             path=path,
+            file_type=RepositoryFile.detect_file_type(path),
             content=None,
             is_binary=False,
             change_type="removed",
         )
         for path in removed_files
     )
+    logging.info(
+        f"[snapshot] {owner}/{repo}@{new_sha[:8]}: {len(diff.added)} added, "
+        f"{len(diff.modified)} modified, {len(diff.removed)} removed, "
+        f"{len(diff.renamed)} renamed"
+    )
 
-    # Set correct change types (since we separated files earlier)
-    file_status_map = {
-        f["filename"]: f["status"] for f in compare_data.get("files", [])
-    }
-    for file in files_to_create:
-        file.change_type = file_status_map[file.path]
+    await _report(progress, "writing")
+    code_state = await sync_to_async(_write_code_state)(
+        repo_obj, branch_obj, new_sha, False, files_to_create, reused, fetched
+    )
 
-    # Bulk create all files
-    await RepositoryFile.objects.abulk_create(files_to_create)
-    return code_state
+    # Keep overlay lookups cheap by folding long chains into a new base
+    return await sync_to_async(compact_if_needed)(code_state)
 
 
-async def update_codebase(user, repo_obj, branch_obj, commit_sha, github_token):
+async def update_codebase(
+    user, repo_obj, branch_obj, commit_sha, github_token, progress=None, changes=None
+):
     code_state = await RepositoryCodeState.objects.filter(
         repository=repo_obj, branch=branch_obj
     ).afirst()
@@ -170,9 +429,57 @@ async def update_codebase(user, repo_obj, branch_obj, commit_sha, github_token):
 
     if not code_state:
         return await create_initial_snapshot(
-            user, repo_obj, branch_obj, commit_sha, github_token
+            user, repo_obj, branch_obj, commit_sha, github_token, progress
         )
     if code_state.commit_sha != commit_sha:
         return await create_incremental_snapshot(
-            user, repo_obj, branch_obj, code_state.commit_sha, commit_sha, github_token
+            user,
+            repo_obj,
+            branch_obj,
+            code_state,
+            commit_sha,
+            github_token,
+            progress,
+            changes,
+        )
+    return await retry_missing_blobs(user, repo_obj, code_state, github_token, progress)
+
+
+async def retry_missing_blobs(user, repo_obj, code_state, github_token, progress=None):
+    """Fetch the blobs of code_state that failed to download or lack their bytes."""
+    missing_files = await sync_to_async(
+        lambda: list(
+            effective_files(code_state)
+            .select_related(None)
+            .filter(blob_id__isnull=False)
+            .exclude(
+                Exists(Blob.objects.filter(sha=OuterRef("blob_id")).exclude(missing_data()))
+            )
         )
+    )()
+    if not missing_files:
+        return code_state
+
+    binary_blobs, _, fetched = await _store_blobs(
+        user.github_login,
+        repo_obj.name,
+        code_state.commit_sha,
+        {f.blob_id for f in missing_files},
+        github_token,
+        progress,
+    )
+    await _report(progress, "writing")
+    sizes = await _blob_sizes(binary_blobs)
+    for f in missing_files:
+        f.is_binary = binary_blobs[f.blob_id]
+        f.size_bytes = sizes.get(f.blob_id, 0)
+    await RepositoryFile.objects.abulk_update(missing_files, ["is_binary", "size_bytes"])
+    if fetched:
+        # Materialized snapshots were written without these files
+        await sync_to_async(discard_snapshots)(code_state.repository_id)
+
+    logging.info(
+        f"[snapshot] state_id={code_state.id}: recovered {fetched} of "
+        f"{len(missing_files)} missing blobs"
+    )
+    return code_state
@@ -0,0 +1,191 @@
+# src/preview/snapshot_cache.py
+import base64
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import Callable, Dict
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+
+logger = logging.getLogger(__name__)
+
+_STAGING_PREFIX = ".staging-"
+# Staging dirs older than this are leftovers from a crashed build
+_STALE_STAGING_SECONDS = 60 * 60
+
+_evict_lock = threading.Lock()
+
+
+def snapshot_dir(repo_id, state_id) -> str:
+    """Directory a (repository_id, code_state.id) snapshot is materialized into."""
+    return os.path.join(settings.PREVIEW_CACHE_DIR, f"{repo_id}_{state_id}")
+
+
+def get_or_build_snapshot(code_state, load_files: Callable[[], Dict[str, Dict]]) -> str:
+    """
+    Return the materialized directory for code_state, building it only once.
+
+    Code states are immutable, so a directory that exists is always complete:
+    it is written into a staging dir and renamed into place in one step.
+    load_files is only called on a cache miss and must return
+      { "path/in/repo": { "content": str_or_bytes, "is_binary": bool } }
+    """
+    base_dir = settings.PREVIEW_CACHE_DIR
+    project_dir = snapshot_dir(code_state.repository_id, code_state.id)
+
+    if os.path.isdir(project_dir):
+        _touch(project_dir)
+        return project_dir
+
+    os.makedirs(base_dir, exist_ok=True)
+    staging_dir = tempfile.mkdtemp(prefix=_STAGING_PREFIX, dir=base_dir)
+    try:
+        files = load_files()
+        _write_files(staging_dir, files)
+        os.rename(staging_dir, project_dir)
+        logger.info(
+            "[preview] materialized %d files for state_id=%s", len(files), code_state.id
+        )
+    except OSError:
+        # Another worker renamed its copy into place first - use that one
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        if not os.path.isdir(project_dir):
+            raise
+    except Exception:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        raise
+
+    evict_snapshots(keep=project_dir)
+    return project_dir
+
+
+def discard_snapshots(repo_id):
+    """
+    Remove the materialized snapshots of a repository, so they are rebuilt
+    with blobs recovered since they were written.
+    """
+    base_dir = settings.PREVIEW_CACHE_DIR
+    try:
+        names = os.listdir(base_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.startswith(f"{repo_id}_"):
+            shutil.rmtree(os.path.join(base_dir, name), ignore_errors=True)
+
+
+def evict_snapshots(keep: str = None):
+    """
+    Drop least recently used snapshots until both the count and the size
+    budget (PREVIEW_CACHE_MAX_SNAPSHOTS / PREVIEW_CACHE_MAX_BYTES) are met.
+    """
+    base_dir = settings.PREVIEW_CACHE_DIR
+    max_snapshots = settings.PREVIEW_CACHE_MAX_SNAPSHOTS
+    max_bytes = settings.PREVIEW_CACHE_MAX_BYTES
+
+    with _evict_lock:
+        try:
+            names = os.listdir(base_dir)
+        except FileNotFoundError:
+            return
+
+        now = time.time()
+        snapshots = []
+        for name in names:
+            path = os.path.join(base_dir, name)
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                continue
+            if name.startswith(_STAGING_PREFIX):
+                if now - mtime > _STALE_STAGING_SECONDS:
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if os.path.isdir(path):
+                snapshots.append((mtime, path, _dir_size(path)))
+
+        # Oldest first
+        snapshots.sort()
+        total_bytes = sum(size for _, _, size in snapshots)
+        count = len(snapshots)
+
+        for _, path, size in snapshots:
+            if count <= max_snapshots and total_bytes <= max_bytes:
+                break
+            if path == keep:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            count -= 1
+            total_bytes -= size
+            logger.info("[preview] evicted snapshot %s", os.path.basename(path))
+
+
+def _touch(path: str):
+    """Bump mtime so eviction treats the snapshot as recently used."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+def _write_files(project_dir: str, files: Dict[str, Dict]):
+    for path, info in files.items():
+        # normalize path and prevent absolute paths / traversal
+        safe_path = path.lstrip("/\\")
+        try:
+            target_path = safe_join(project_dir, safe_path)
+        except SuspiciousFileOperation:
+            logger.warning("[preview] skipping unsafe path %r", path)
+            continue
+
+        target_dir = os.path.dirname(target_path)
+        if target_dir:
+            os.makedirs(target_dir, exist_ok=True)
+
+        content = info.get("content", "")
+        is_binary = bool(info.get("is_binary", False))
+
+        try:
+            if is_binary:
+                # try to decode base64 first (common for storing binaries in text fields)
+                try:
+                    # If content is already bytes-like, skip decoding
+                    if isinstance(content, bytes):
+                        data = content
+                    else:
+                        data = base64.b64decode(content)
+                except Exception:
+                    # fallback: write the raw string as latin-1 bytes
+                    data = (content or "").encode("latin-1")
+                with open(target_path, "wb") as fh:
+                    fh.write(data)
+            else:
+                # text mode
+                with open(target_path, "w", encoding="utf-8", errors="replace") as fh:
+                    fh.write(content or "")
+        except Exception as e:
+            # fail-safe: write as binary if text write errors
+            try:
+                with open(target_path, "wb") as fh:
+                    if isinstance(content, str):
+                        fh.write(content.encode("utf-8", errors="replace"))
+                    else:
+                        fh.write(content)
+            except Exception:
+                logger.error(f"[preview] failed to write {target_path}: {e}")
@@ -0,0 +1,222 @@
+# src/preview/storage.py
+import logging
+import os
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Union
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+
+from .blobstore import iter_range, missing_data, open_blob, read_blob
+from .models import Blob, RepositoryCodeState
+from .overlay import effective_files, resolve_file
+from .rewrite import guess_mime_type, is_text_like
+from .snapshot_cache import get_or_build_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class BlobUnavailable(Exception):
+    """
+    A file whose blob failed to download and has not been recovered yet:
+    it exists in the code state, but its content cannot be served.
+    """
+
+
+def get_latest_code_state(repo_id) -> Optional[RepositoryCodeState]:
+    """Latest code state of a repo (cheap: no file rows are loaded)."""
+    return RepositoryCodeState.objects.filter(
+        repository_id=repo_id
+    ).order_by("-created_at").first()
+
+
+def get_pinned_code_state(repo_id, commit_sha: str) -> Optional[RepositoryCodeState]:
+    """Code state of a repo at commit_sha, the latest one if it was stored twice."""
+    return RepositoryCodeState.objects.filter(
+        repository_id=repo_id, commit_sha=commit_sha
+    ).order_by("-created_at").first()
+
+
+def blob_etag(code_state: RepositoryCodeState, path: str) -> Optional[str]:
+    """
+    Blob SHA of a file, which identifies its content without loading it.
+    None for missing files and rows stored before blobs existed.
+    """
+    f = resolve_file(code_state, path, with_content=False)
+    return f.blob_id if f is not None else None
+
+
+def fetch_files_for_state(code_state: RepositoryCodeState) -> Dict[str, Dict]:
+    """
+    Load all files of a code state as a dict:
+      { "path/in/repo": { "content": str_or_bytes, "is_binary": bool } }
+    Binary files whose bytes are not stored and files whose blob is missing
+    are left out.
+    """
+    files: Dict[str, Dict] = {}
+    for f in effective_files(code_state):
+        if f.is_binary:
+            data = read_blob(f.blob_id) if f.blob_id else None
+            if data is not None:
+                files[f.path] = {"content": data, "is_binary": True}
+            continue
+        content = f.get_content()
+        if content is None and f.blob_id:
+            continue
+        files[f.path] = {"content": content or "", "is_binary": False}
+
+    logger.info(f"[preview] fetched {len(files)} files for state_id={code_state.id}")
+    return files
+
+
+def _is_unavailable(code_state: RepositoryCodeState, path: str) -> bool:
+    """
+    Whether path is a file of code_state whose blob is still to be fetched:
+    never stored, or binary without its bytes (but not over the size limit).
+    """
+    f = resolve_file(code_state, path, with_content=False)
+    if f is None or not f.blob_id:
+        return False
+    return not Blob.objects.filter(sha=f.blob_id).exclude(missing_data()).exists()
+
+
+class PreviewFile(NamedTuple):
+    path: str
+    content: Union[str, bytes]
+    is_binary: bool
+    # Blob SHA of the content, if known
+    sha: Optional[str] = None
+
+
+class BinaryFile(NamedTuple):
+    """A binary file served as a stream: read(start, end) yields its bytes in that range."""
+
+    path: str
+    size: int
+    read: Callable[[int, int], Iterator[bytes]]
+    sha: Optional[str] = None
+
+
+def _read_file(target: str, start: int, end: int, block_size: int = 64 * 1024) -> Iterator[bytes]:
+    with open(target, "rb") as fh:
+        fh.seek(start)
+        remaining = end - start
+        while remaining > 0:
+            block = fh.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+
+class FilesystemStorage:
+    """Serves a code state from its materialized snapshot directory."""
+
+    def __init__(self, code_state: RepositoryCodeState):
+        self.code_state = code_state
+        self.root = get_or_build_snapshot(
+            code_state, lambda: fetch_files_for_state(code_state)
+        )
+
+    def _resolve(self, path: str) -> Optional[str]:
+        try:
+            return safe_join(self.root, path)
+        except SuspiciousFileOperation:
+            return None
+
+    def exists(self, path: str) -> bool:
+        target = self._resolve(path)
+        return bool(target) and os.path.isfile(target)
+
+    def etag(self, path: str) -> Optional[str]:
+        return blob_etag(self.code_state, path)
+
+    def listdir(self, path: str) -> Optional[List[str]]:
+        target = self._resolve(path)
+        if not target or not os.path.isdir(target):
+            return None
+        try:
+            return sorted(os.listdir(target))
+        except OSError:
+            return []
+
+    def open(self, path: str) -> Optional[Union[PreviewFile, BinaryFile]]:
+        """The file, or None; raises BlobUnavailable for a file left out of the snapshot."""
+        target = self._resolve(path)
+        if not target or not os.path.isfile(target):
+            if target and _is_unavailable(self.code_state, path):
+                raise BlobUnavailable(path)
+            return None
+        sha = blob_etag(self.code_state, path)
+        if not is_text_like(guess_mime_type(path)):
+            return BinaryFile(
+                path,
+                os.path.getsize(target),
+                lambda start, end: _read_file(target, start, end),
+                sha,
+            )
+        with open(target, "rb") as fh:
+            return PreviewFile(path, fh.read(), False, sha)
+
+
+class DatabaseStorage:
+    """
+    Serves a code state straight from RepositoryFile rows.
+    A file costs one indexed lookup by path (across the overlay chain for
+    incremental states) and a directory listing one path-prefix query that
+    never loads file contents.
+    """
+
+    def __init__(self, code_state: RepositoryCodeState):
+        self.code_state = code_state
+
+    def exists(self, path: str) -> bool:
+        return resolve_file(self.code_state, path, with_content=False) is not None
+
+    def etag(self, path: str) -> Optional[str]:
+        return blob_etag(self.code_state, path)
+
+    def listdir(self, path: str) -> Optional[List[str]]:
+        prefix = f"{path.rstrip('/')}/" if path.strip("/") else ""
+        paths = effective_files(self.code_state, path_prefix=prefix).values_list(
+            "path", flat=True
+        )
+        entries = {p[len(prefix):].split("/", 1)[0] for p in paths}
+        entries.discard("")
+        if not entries:
+            return None
+        return sorted(entries)
+
+    def open(self, path: str) -> Optional[Union[PreviewFile, BinaryFile]]:
+        """The file, or None; raises BlobUnavailable when its blob is missing."""
+        f = resolve_file(self.code_state, path)
+        if f is None:
+            return None
+        if f.is_binary and f.blob_id:
+            # Streamed from its chunks; not servable if its bytes are not stored
+            content = open_blob(f.blob_id)
+            if content is None:
+                if _is_unavailable(self.code_state, path):
+                    raise BlobUnavailable(path)
+                return None
+            return BinaryFile(
+                f.path,
+                content.size,
+                lambda start, end: iter_range(content, start, end),
+                f.blob_id,
+            )
+        content = f.get_content()
+        if content is None and f.blob_id and not f.is_binary:
+            raise BlobUnavailable(path)
+        return PreviewFile(f.path, content or "", f.is_binary, f.blob_id)
+
+
+STORAGE_BACKENDS = {
+    "filesystem": FilesystemStorage,
+    "database": DatabaseStorage,
+}
+
+
+def get_storage(code_state: RepositoryCodeState):
+    """Storage backend selected by settings.PREVIEW_STORAGE_BACKEND."""
+    return STORAGE_BACKENDS[settings.PREVIEW_STORAGE_BACKEND](code_state)
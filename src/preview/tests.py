@@ -1,3 +1,439 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import hmac
+import io
+import tarfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+
+from accounts.models import Branch, Repository, User
+from .archive import aingest_archive, git_blob_sha
+from .blobstore import read_blob
+from .changes import apply_change, merge_changes, push_changes
+from .fetcher import FetchScheduler
+from .manifest import diff_manifests
+from .jobs import claim_jobs
+from .models import AssetVariant, Blob, RepositoryCodeState, RepositoryFile, SnapshotJob
+from .rewrite import preview_prefix
+from .storage import BinaryFile
+from .variants import build_state_variants, encodings, get_variant, prune_pinned_variants
+from .views import _binary_response, _byte_range
+
+ARCHIVE_FILES = {
+    "index.html": b"<h1>Hello</h1>",
+    "css/site.css": b"body { color: red; }",
+    "img/logo.png": b"\x89PNG\r\n\x1a\n" + bytes(range(256)) * 4,
+    "media/clip.mp4": b"\x00\xff" * 2048,
+}
+
+
+def build_tarball(files) -> bytes:
+    """A gzipped tarball laid out like GitHub's: one top-level directory, plus a symlink."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as tar:
+        for path, data in files.items():
+            info = tarfile.TarInfo(f"octo-site-abc1234/{path}")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo("octo-site-abc1234/latest.html")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "index.html"
+        tar.addfile(link)
+    return buffer.getvalue()
+
+
+class _ArchiveServer:
+    """Local stand-in for the GitHub tarball endpoint, redirecting like the real one."""
+
+    def __init__(self, tarball: bytes):
+        self.requests = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests.append(self.path)
+                if "/tarball/" in self.path:
+                    self.send_response(302)
+                    self.send_header("Location", "/codeload/archive.tar.gz")
+                    self.send_header("X-RateLimit-Remaining", "4999")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-gzip")
+                self.send_header("Content-Length", str(len(tarball)))
+                self.end_headers()
+                self.wfile.write(tarball)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(PREVIEW_BINARY_MAX_BYTES=2048, PREVIEW_BLOB_CHUNK_SIZE=512)
+class ArchiveIngestTests(TransactionTestCase):
+    def setUp(self):
+        self.server = _ArchiveServer(build_tarball(ARCHIVE_FILES))
+        self.addCleanup(self.server.close)
+        self.shas = {path: git_blob_sha(data) for path, data in ARCHIVE_FILES.items()}
+
+    def ingest(self, wanted):
+        async def run():
+            scheduler = FetchScheduler("token")
+            found = await aingest_archive("octo", "site", "abc1234", wanted, scheduler)
+            return found, scheduler.remaining
+
+        with override_settings(GITHUB_API_URL=self.server.url):
+            return asyncio.run(run())
+
+    def test_stores_wanted_members(self):
+        wanted = set(self.shas.values()) | {"0" * 40}
+        found, remaining = self.ingest(wanted)
+
+        self.assertEqual(
+            found,
+            {
+                self.shas["index.html"]: False,
+                self.shas["css/site.css"]: False,
+                self.shas["img/logo.png"]: True,
+                self.shas["media/clip.mp4"]: True,
+            },
+        )
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(remaining, 4999)
+        self.assertEqual(Blob.objects.get(sha=self.shas["index.html"]).content, "<h1>Hello</h1>")
+        logo = Blob.objects.get(sha=self.shas["img/logo.png"])
+        self.assertEqual((logo.content, logo.size_bytes), (None, 1032))
+        self.assertEqual(read_blob(logo.sha), ARCHIVE_FILES["img/logo.png"])
+
+    def test_members_over_the_limit_are_not_stored(self):
+        sha = self.shas["media/clip.mp4"]
+        found, _ = self.ingest({sha})
+
+        self.assertEqual(found, {sha: True})
+        clip = Blob.objects.get(sha=sha)
+        self.assertEqual(clip.size_bytes, 4096)
+        self.assertIsNone(read_blob(sha))
+
+    def test_unwanted_members_are_skipped(self):
+        found, _ = self.ingest({self.shas["css/site.css"]})
+
+        self.assertEqual(found, {self.shas["css/site.css"]: False})
+        self.assertEqual(Blob.objects.count(), 1)
+
+
+def make_repository():
+    """A user with one repository and its main branch."""
+    user = User.objects.create(username="octo", github_login="octo", github_id=1)
+    repository = Repository.objects.create(
+        user=user, repo_id=10, name="site", full_name="octo/site", default_branch="main"
+    )
+    branch = Branch.objects.create(repository=repository, name="main", last_commit_sha="b" * 40)
+    return user, repository, branch
+
+
+class VariantTests(TestCase):
+    def setUp(self):
+        _, self.repository, branch = make_repository()
+        self.html = Blob.objects.create(sha="1" * 40, content='<a href="/about.html">')
+        self.states = []
+        for commit_sha in ("a" * 40, "b" * 40):
+            state = RepositoryCodeState.objects.create(
+                repository=self.repository, branch=branch, commit_sha=commit_sha
+            )
+            RepositoryFile.objects.create(code_state=state, path="index.html", blob=self.html)
+            self.states.append(state)
+
+    def prefixes(self):
+        return set(AssetVariant.objects.values_list("prefix", flat=True))
+
+    def test_only_latest_prefix_is_prebuilt(self):
+        created = build_state_variants(self.states[1])
+
+        self.assertEqual(created, len(encodings()))
+        self.assertEqual(self.prefixes(), {preview_prefix(self.repository.id)})
+
+    def test_pinned_variants_of_superseded_commits_are_pruned(self):
+        build_state_variants(self.states[1])
+        for state in self.states:
+            pinned = preview_prefix(self.repository.id, state.commit_sha)
+            self.assertIsNotNone(get_variant(self.html.sha, "text/html", pinned, "gzip"))
+
+        deleted = prune_pinned_variants(self.repository.id)
+
+        self.assertEqual(deleted, len(encodings()))
+        self.assertEqual(
+            self.prefixes(),
+            {
+                preview_prefix(self.repository.id),
+                preview_prefix(self.repository.id, "b" * 40),
+            },
+        )
+
+
+class ManifestDiffTests(SimpleTestCase):
+    def test_added_modified_removed(self):
+        diff = diff_manifests({"a.txt": "1", "b.txt": "2"}, {"a.txt": "9", "c.txt": "3"})
+
+        self.assertEqual(diff.added, {"c.txt": "3"})
+        self.assertEqual(diff.modified, {"a.txt": "9"})
+        self.assertEqual(diff.removed, ["b.txt"])
+        self.assertEqual(diff.renamed, {})
+
+    def test_rename_keeps_the_sha(self):
+        diff = diff_manifests({"old.css": "1"}, {"new.css": "1"})
+
+        self.assertEqual(diff.renamed, {"new.css": ("old.css", "1")})
+        self.assertEqual((diff.added, diff.removed), ({}, []))
+
+    def test_copy_is_an_addition(self):
+        diff = diff_manifests({"a.js": "1"}, {"a.js": "1", "b.js": "1"})
+
+        self.assertEqual(diff.added, {"b.js": "1"})
+        self.assertEqual((diff.removed, diff.renamed), ([], {}))
+
+    def test_each_removed_path_is_renamed_once(self):
+        old = {"x/a.png": "1", "y/a.png": "1"}
+        diff = diff_manifests(old, {"z/a.png": "1"})
+
+        self.assertEqual(diff.renamed, {"z/a.png": ("x/a.png", "1")})
+        self.assertEqual(diff.removed, ["y/a.png"])
+
+    def test_two_copies_of_one_removed_blob(self):
+        diff = diff_manifests({"a.txt": "1"}, {"b.txt": "1", "c.txt": "1"})
+
+        self.assertEqual(diff.renamed, {"b.txt": ("a.txt", "1")})
+        self.assertEqual(diff.added, {"c.txt": "1"})
+        self.assertEqual(diff.removed, [])
+
+    def test_rows_without_a_sha(self):
+        diff = diff_manifests({"kept.txt": None, "gone.txt": None}, {"kept.txt": "1"})
+
+        self.assertEqual(diff.modified, {"kept.txt": "1"})
+        self.assertEqual(diff.removed, ["gone.txt"])
+        self.assertEqual(diff.renamed, {})
+
+
+def push(*commits, **fields):
+    """A push payload from 'before' to 'after' with the given commits."""
+    return {"before": "b" * 40, "after": "c" * 40, "commits": list(commits), **fields}
+
+
+class ChangeSetTests(SimpleTestCase):
+    def test_apply_change_is_relative_to_the_base(self):
+        cases = [
+            (None, "added", {"f": "added"}),
+            ("added", "modified", {"f": "added"}),
+            ("modified", "added", {"f": "modified"}),
+            ("modified", "removed", {"f": "removed"}),
+            # Deleted and created again: the file existed at the base
+            ("removed", "added", {"f": "modified"}),
+            # Created and deleted again: nothing changed since the base
+            ("added", "removed", {}),
+        ]
+        for earlier, status, expected in cases:
+            with self.subTest(earlier=earlier, status=status):
+                files = {"f": earlier} if earlier else {}
+                apply_change(files, "f", status)
+                self.assertEqual(files, expected)
+
+    def test_push_changes_folds_commits_in_order(self):
+        changes = push_changes(
+            push(
+                {"added": ["new.html", "tmp.txt"], "modified": ["index.html"]},
+                {"removed": ["tmp.txt", "old.css"], "modified": ["new.html"]},
+            )
+        )
+
+        self.assertEqual(
+            changes,
+            {
+                "base": "b" * 40,
+                "files": {"new.html": "added", "index.html": "modified", "old.css": "removed"},
+            },
+        )
+
+    def test_push_changes_unknown_pushes(self):
+        commit = {"modified": ["index.html"]}
+        self.assertIsNone(push_changes(push(commit, created=True)))
+        self.assertIsNone(push_changes(push(commit, forced=True)))
+        self.assertIsNone(push_changes(push()))
+
+    def test_merge_changes(self):
+        earlier = {"base": "a" * 40, "files": {"tmp.txt": "added", "index.html": "modified"}}
+        later = {"base": "b" * 40, "files": {"tmp.txt": "removed", "about.html": "added"}}
+
+        self.assertEqual(
+            merge_changes(earlier, "b" * 40, later),
+            {"base": "a" * 40, "files": {"index.html": "modified", "about.html": "added"}},
+        )
+        # The earlier set is left untouched
+        self.assertEqual(earlier["files"], {"tmp.txt": "added", "index.html": "modified"})
+
+    def test_merge_changes_needs_both_sets_lined_up(self):
+        changes = {"base": "a" * 40, "files": {}}
+        self.assertIsNone(merge_changes(None, "b" * 40, changes))
+        self.assertIsNone(merge_changes(changes, "b" * 40, None))
+        self.assertIsNone(merge_changes(changes, "b" * 40, {"base": "f" * 40, "files": {}}))
+
+
+class ByteRangeTests(SimpleTestCase):
+    def test_byte_range(self):
+        cases = [
+            ("", None),
+            ("bytes=0-99", (0, 100)),
+            ("bytes=10-19", (10, 20)),
+            ("bytes=0-0", (0, 1)),
+            # Open-ended, and an end past the file
+            ("bytes=90-", (90, 100)),
+            ("bytes=90-500", (90, 100)),
+            # Suffix ranges: the last bytes, all of them if longer than the file
+            ("bytes=-10", (90, 100)),
+            ("bytes=-500", (0, 100)),
+            # Unsatisfiable: start >= size
+            ("bytes=100-", (100, 100)),
+            ("bytes=-0", (100, 100)),
+            # Ignored: the whole file is sent
+            ("bytes=-", None),
+            ("bytes=20-10", None),
+            ("bytes=0-1,5-9", None),
+            ("items=0-1", None),
+        ]
+        for header, expected in cases:
+            with self.subTest(header=header):
+                self.assertEqual(_byte_range(header, 100), expected)
+
+
+class BinaryResponseTests(SimpleTestCase):
+    data = bytes(range(100))
+    sha = "1" * 40
+
+    def respond(self, **headers):
+        binary_file = BinaryFile(
+            "clip.bin", len(self.data), lambda start, end: iter([self.data[start:end]]), self.sha
+        )
+        request = RequestFactory().get("/", headers=headers)
+        return _binary_response(request, binary_file, "application/octet-stream")
+
+    def test_whole_file(self):
+        response = self.respond()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Length"], "100")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(b"".join(response.streaming_content), self.data)
+
+    def test_partial_content(self):
+        response = self.respond(Range="bytes=10-19")
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], "bytes 10-19/100")
+        self.assertEqual(response["Content-Length"], "10")
+        self.assertEqual(b"".join(response.streaming_content), self.data[10:20])
+
+    def test_unsatisfiable_range(self):
+        response = self.respond(Range="bytes=100-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */100")
+
+    def test_if_range(self):
+        matching = self.respond(Range="bytes=-10", If_Range=f'"{self.sha}"')
+        stale = self.respond(Range="bytes=-10", If_Range='"0000"')
+
+        self.assertEqual(matching.status_code, 206)
+        self.assertEqual(b"".join(matching.streaming_content), self.data[90:])
+        # A changed file is sent whole instead of a range of the new one
+        self.assertEqual(stale.status_code, 200)
+        self.assertEqual(b"".join(stale.streaming_content), self.data)
+
+
+class ClaimJobsTests(TestCase):
+    def setUp(self):
+        self.user, self.repository, self.main = make_repository()
+        self.dev = Branch.objects.create(repository=self.repository, name="dev")
+
+    def queue(self, branch, commit_sha):
+        return SnapshotJob.objects.create(
+            repository=self.repository, branch=branch, commit_sha=commit_sha, user=self.user
+        )
+
+    def test_one_job_per_branch_oldest_first(self):
+        first = self.queue(self.main, "a" * 40)
+        self.queue(self.main, "b" * 40)
+        other = self.queue(self.dev, "c" * 40)
+
+        claimed = claim_jobs(10)
+
+        self.assertEqual({job.id for job in claimed}, {first.id, other.id})
+        self.assertTrue(all(job.status == "fetching_tree" for job in claimed))
+        self.assertTrue(all(job.attempts == 1 and job.locked_at for job in claimed))
+
+    def test_busy_branch_waits_for_its_running_job(self):
+        running = self.queue(self.main, "a" * 40)
+        waiting = self.queue(self.main, "b" * 40)
+        claim_jobs(1)
+
+        self.assertEqual(claim_jobs(10), [])
+        SnapshotJob.objects.filter(id=running.id).update(status="done")
+        self.assertEqual([job.id for job in claim_jobs(10)], [waiting.id])
+
+    def test_claim_by_id(self):
+        self.queue(self.main, "a" * 40)
+        other = self.queue(self.dev, "c" * 40)
+
+        self.assertEqual([job.id for job in claim_jobs(1, job_id=other.id)], [other.id])
+        self.assertEqual(claim_jobs(1, job_id=other.id), [])
+
+    def test_limit(self):
+        self.queue(self.main, "a" * 40)
+        self.queue(self.dev, "c" * 40)
+
+        self.assertEqual(len(claim_jobs(1)), 1)
+        self.assertEqual(len(claim_jobs(1)), 1)
+        self.assertEqual(claim_jobs(1), [])
+
+
+@override_settings(GITHUB_WEBHOOK_SECRET="secret")
+class WebhookTests(SimpleTestCase):
+    def deliver(self, event, body):
+        digest = hmac.new(b"secret", body, hashlib.sha256).hexdigest()
+        return self.client.post(
+            "/api/github/webhook",
+            body,
+            content_type="application/json",
+            headers={"X-GitHub-Event": event, "X-Hub-Signature-256": f"sha256={digest}"},
+        )
+
+    def test_ping(self):
+        response = self.deliver("ping", b"{}")
+        self.assertEqual((response.status_code, response.json()), (200, {"status": "ok"}))
+
+    def test_bad_signature_is_forbidden(self):
+        response = self.client.post(
+            "/api/github/webhook",
+            b"{}",
+            content_type="application/json",
+            headers={"X-GitHub-Event": "push", "X-Hub-Signature-256": "sha256=0"},
+        )
+        self.assertEqual(response.status_code, 403)
+
+    def test_malformed_push_is_rejected(self):
+        for body in (b"{not json", b"[]"):
+            with self.subTest(body=body):
+                self.assertEqual(self.deliver("push", body).status_code, 400)
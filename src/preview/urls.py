@@ -6,6 +6,12 @@ app_name = 'preview'
 urlpatterns = [
     # Root: choose index.html (if exists) or show directory listing
     path("<int:repo_id>/", views.preview_root, name="preview_root"),
+    # Commit-pinned files and directories; must come before the generic handler
+    re_path(
+        r"(?P<repo_id>\d+)/(?P<commit_sha>[0-9a-f]{40})/(?P<path>.*)$",
+        views.preview_pinned,
+        name="preview_pinned",
+    ),
     # File/Directory handler (anything under the repo)
     re_path(r"(?P<repo_id>\d+)/(?P<path>.*)$", views.preview_serve, name="preview_serve"),
 
@@ -0,0 +1,180 @@
+# src/preview/variants.py
+"""
+Pre-rendered text assets. Text files are served from AssetVariant rows:
+HTML and CSS already rewritten for their URL prefix, everything compressed
+with gzip (and brotli when the optional brotli package is installed), so a
+request costs one lookup instead of a regex pass and compression.
+Variants under the repository's latest prefix are built after each
+snapshot; commit-pinned ones, and anything missed, on the first request
+that needs them. Pinned variants of commits that are no longer a branch
+head are pruned after each snapshot, so they do not pile up per commit.
+"""
+import gzip
+import logging
+from typing import Iterable, List, Optional, Set, Tuple
+
+from django.db.models import OuterRef, Subquery
+
+from .models import AssetVariant, Blob, RepositoryCodeState
+from .overlay import effective_files
+from .rewrite import guess_mime_type, is_text_like, preview_prefix, rewrite_text
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Content types whose links depend on the URL prefix they are served under
+REWRITTEN_TYPES = ("text/html", "text/css")
+
+# Blobs loaded at once while building the variants of a state
+_BUILD_BATCH = 200
+
+
+def encodings() -> List[str]:
+    """Encodings variants are built in, most preferred first."""
+    return (["br"] if brotli is not None else []) + ["gzip", "identity"]
+
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    """Preferred encoding of ours that the Accept-Encoding header allows."""
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in encodings()[:-1]:
+        if accepted.get(encoding, accepted.get("*", 0)) > 0:
+            return encoding
+    return "identity"
+
+
+def variant_prefix(mime_type: str, prefix: str) -> str:
+    """Prefix a variant is stored under: files that are not rewritten share one."""
+    return prefix if mime_type in REWRITTEN_TYPES else ""
+
+
+def _encode(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=11)
+    if encoding == "gzip":
+        # Fixed mtime so the same content always compresses to the same bytes
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return data
+
+
+def build_variants(blob: Blob, mime_type: str, prefix: str) -> List[AssetVariant]:
+    """Unsaved variants of blob in every encoding; none for binary blobs."""
+    if blob.is_binary or blob.content is None:
+        return []
+    prefix = variant_prefix(mime_type, prefix)
+    data = rewrite_text(blob.content, mime_type, prefix).encode("utf-8")
+    return [
+        AssetVariant(
+            blob=blob,
+            content_type=mime_type,
+            prefix=prefix,
+            encoding=encoding,
+            data=_encode(data, encoding),
+        )
+        for encoding in encodings()
+    ]
+
+
+def get_variant(sha: str, mime_type: str, prefix: str, encoding: str) -> Optional[AssetVariant]:
+    """Stored variant of a blob, built (with its other encodings) if missing."""
+    prefix = variant_prefix(mime_type, prefix)
+    variant = AssetVariant.objects.filter(
+        blob_id=sha, content_type=mime_type, prefix=prefix, encoding=encoding
+    ).first()
+    if variant is not None:
+        return variant
+
+    blob = Blob.objects.filter(sha=sha).first()
+    if blob is None:
+        return None
+    variants = build_variants(blob, mime_type, prefix)
+    AssetVariant.objects.bulk_create(variants, ignore_conflicts=True)
+    return next((v for v in variants if v.encoding == encoding), None)
+
+
+def _text_files(rows: Iterable[Tuple[str, str]], prefix: str, types=None) -> Set[tuple]:
+    wanted = set()
+    for path, sha in rows:
+        mime_type = guess_mime_type(path)
+        if sha and is_text_like(mime_type) and (types is None or mime_type in types):
+            wanted.add((sha, mime_type, variant_prefix(mime_type, prefix)))
+    return wanted
+
+
+def build_state_variants(code_state: RepositoryCodeState) -> int:
+    """
+    Build the variants code_state is served with under the repository's
+    latest prefix: the text files it stores (inherited files have theirs
+    from earlier states). Returns the number of variants created.
+    """
+    latest = preview_prefix(code_state.repository_id)
+    wanted = _text_files(
+        code_state.files.exclude(change_type="removed").values_list("path", "blob_id"),
+        latest,
+    )
+    if not wanted:
+        return 0
+
+    shas = {sha for sha, _, _ in wanted}
+    built = set(
+        AssetVariant.objects.filter(blob_id__in=shas)
+        .values_list("blob_id", "content_type", "prefix")
+        .distinct()
+    )
+    pending = sorted(wanted - built)
+
+    created = 0
+    for i in range(0, len(pending), _BUILD_BATCH):
+        batch = pending[i : i + _BUILD_BATCH]
+        blobs = Blob.objects.in_bulk({sha for sha, _, _ in batch})
+        variants = [
+            variant
+            for sha, mime_type, prefix in batch
+            if sha in blobs
+            for variant in build_variants(blobs[sha], mime_type, prefix)
+        ]
+        AssetVariant.objects.bulk_create(variants, batch_size=100, ignore_conflicts=True)
+        created += len(variants)
+
+    logger.info(f"[preview] built {created} asset variants for state_id={code_state.id}")
+    return created
+
+
+def prune_pinned_variants(repository_id) -> int:
+    """
+    Delete the commit-pinned variants of a repository except those of its
+    branch heads (the latest state of each branch): older commits were
+    superseded or compacted away, and are rebuilt by get_variant if one is
+    still viewed. Returns the number of variants deleted.
+    """
+    heads = RepositoryCodeState.objects.filter(
+        repository_id=repository_id, branch_id=OuterRef("branch_id")
+    ).order_by("-created_at", "-id")
+    kept = {
+        preview_prefix(repository_id, commit_sha)
+        for commit_sha in RepositoryCodeState.objects.filter(repository_id=repository_id)
+        .filter(id=Subquery(heads.values("id")[:1]))
+        .values_list("commit_sha", flat=True)
+    }
+    deleted, _ = (
+        AssetVariant.objects.filter(prefix__startswith=f"{preview_prefix(repository_id)}/")
+        .exclude(prefix__in=kept)
+        .delete()
+    )
+    if deleted:
+        logger.info(f"[preview] pruned {deleted} pinned variants of repo_id={repository_id}")
+    return deleted
@@ -1,54 +1,28 @@
 # src/preview/views.py
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import JsonResponse, FileResponse, HttpResponse, Http404
+from django.conf import settings
+from django.http import JsonResponse, FileResponse, HttpResponse, Http404, StreamingHttpResponse
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
 from django.views.decorators.csrf import csrf_exempt
 from .models import RepositoryCodeState, RepositoryFile
+from .overlay import effective_files
+from .storage import (
+    BinaryFile,
+    BlobUnavailable,
+    get_latest_code_state,
+    get_pinned_code_state,
+    get_storage,
+)
+from .rewrite import guess_mime_type, is_text_like, preview_prefix, rewrite_text
+from .variants import get_variant, negotiate_encoding
 import json
-import os, tempfile
-import mimetypes
-from django.utils._os import safe_join
-
 import re
-import base64
-from typing import Tuple, Dict
-
-# -----------------------
-# HTML/CSS rewrite helpers
-# -----------------------
-
-# Rewrite attributes like src="/foo.js" or href="/bar.css" to /preview/<repo_id>/foo.js
-_HTML_ABS_ATTR = re.compile(
-    r'(?P<attr>\s(?:src|href)=)(?P<q>["\'])/(?P<rest>[^"\']+)(?P=q)',
-    re.IGNORECASE
-)
-
-def _rewrite_html_urls(html: str, prefix: str) -> str:
-    """
-    Rewrites <... src="/foo"> to <... src="/preview/<repo_id>/foo">.
-    prefix should be something like "/preview/123" (no trailing slash).
-    Leaves protocol-relative //... and absolute URLs intact.
-    """
-    def repl(m):
-        rest = m.group('rest')
-        # If rest starts with '/', it's likely protocol-relative (//...) -> skip rewriting.
-        # (The regex consumed only one leading '/', so protocol-relative will start with '/')
-        if rest.startswith('/'):
-            return m.group(0)
-        return f'{m.group("attr")}{m.group("q")}{prefix}/{rest}{m.group("q")}'
-    return _HTML_ABS_ATTR.sub(repl, html)
-
-# Rewrite CSS url('/foo.png') -> url('/preview/<repo_id>/foo.png')
-_CSS_URL_ABS = re.compile(r'url\(\s*(?P<q>[\'"]?)/(?P<rest>[^)\'"]+)(?P=q)\s*\)', re.IGNORECASE)
-
-def _rewrite_css_urls(css: str, prefix: str) -> str:
-    def repl(m):
-        q = m.group('q') or ''
-        rest = m.group('rest')
-        # If rest starts with '/', it's protocol-relative (//...) -> skip
-        if rest.startswith('/'):
-            return m.group(0)
-        return f'url({q}{prefix}/{rest}{q})'
-    return _CSS_URL_ABS.sub(repl, css)
 
 # -----------------------
 # Existing StackBlitz redirect view (unchanged)
@@ -69,12 +43,12 @@ def redirect_to_stackblitz(request, repo_id):
             })
 
         
-        files = code_state.files.all()
+        files = effective_files(code_state)
         
         files_data = {}
         for file in files:
             # if file.path.endswith('.json'): continue
-            files_data[file.path] = file.content
+            files_data[file.path] = file.get_content()
         
         if not files_data:
             files_data['index.html'] = '<h1>No files found.</h1>'
@@ -95,110 +69,6 @@ def redirect_to_stackblitz(request, repo_id):
         })
 
 
-# -----------------------
-# Helper: fetch files from DB for latest or specific state
-# -----------------------
-def fetch_files_from_db(repo_id) -> Tuple[RepositoryCodeState, Dict[str, Dict]]:
-    """
-    Fetch all files for the latest code state of a repo.
-    Returns (code_state, files) where files is a dict:
-      { "path/in/repo": { "content": str_or_bytes, "is_binary": bool } }
-    """
-    code_state = RepositoryCodeState.objects.filter(
-        repository_id=repo_id
-    ).order_by('-created_at').first()
-
-    if not code_state:
-        return None, {}
-
-    files: Dict[str, Dict] = {}
-    for f in code_state.files.all():
-        files[f.path] = {
-            "content": f.content or "",
-            "is_binary": getattr(f, "is_binary", False),
-        }
-    
-    # small debug log - remove or replace with proper logger if you want
-    print(f"[preview] fetched {len(files)} files for repo_id={repo_id}, state_id={code_state.id}")
-
-    return code_state, files
-
-
-# -----------------------
-# Helper: create (or reuse) per-state temp directory and materialize files
-# -----------------------
-def get_or_create_tempdir_for_project(code_state: RepositoryCodeState, files: Dict[str, Dict]) -> str:
-    """
-    Creates a temp dir that is unique for this code_state and writes the files into it.
-    We use both repository id and code_state id in the directory name to avoid collisions
-    and to ensure updates create a fresh directory (so file additions/removals are visible).
-    """
-    # base temp folder (system temp)
-    base_temp_dir = os.path.join(tempfile.gettempdir(), "repo_previews")
-    os.makedirs(base_temp_dir, exist_ok=True)
-
-    # unique folder per repo + code_state
-    repo_id = code_state.repository_id if hasattr(code_state, "repository_id") else getattr(code_state, "repository").id
-    snapshot_dirname = f"{repo_id}_{code_state.id}"
-    project_dir = os.path.join(base_temp_dir, snapshot_dirname)
-
-    # Always (re)create the directory for the snapshot to avoid stale files.
-    if os.path.exists(project_dir):
-        # Remove old snapshot directory and recreate - this ensures file deletions are reflected
-        try:
-            # os.remove or shutil.rmtree
-            import shutil
-            shutil.rmtree(project_dir)
-        except Exception:
-            pass
-
-    os.makedirs(project_dir, exist_ok=True)
-
-    # Materialize files
-    for path, info in files.items():
-        # normalize path and prevent absolute paths
-        safe_path = path.lstrip("/\\")
-        target_path = os.path.join(project_dir, safe_path)
-        target_dir = os.path.dirname(target_path)
-        if target_dir:
-            os.makedirs(target_dir, exist_ok=True)
-
-        content = info.get("content", "")
-        is_binary = bool(info.get("is_binary", False))
-
-        try:
-            if is_binary:
-                # try to decode base64 first (common for storing binaries in text fields)
-                try:
-                    # If content is already bytes-like, skip decoding
-                    if isinstance(content, bytes):
-                        data = content
-                    else:
-                        data = base64.b64decode(content)
-                except Exception:
-                    # fallback: write the raw string as latin-1 bytes
-                    data = (content or "").encode("latin-1")
-                with open(target_path, "wb") as fh:
-                    fh.write(data)
-            else:
-                # text mode
-                with open(target_path, "w", encoding="utf-8", errors="replace") as fh:
-                    fh.write(content or "")
-        except Exception as e:
-            # fail-safe: write as binary if text write errors
-            try:
-                with open(target_path, "wb") as fh:
-                    if isinstance(content, str):
-                        fh.write(content.encode("utf-8", errors="replace"))
-                    else:
-                        fh.write(content)
-            except Exception:
-                # last resort: skip file but print debug
-                print(f"[preview] failed to write {target_path}: {e}")
-
-    return project_dir
-
-
 # -----------------------
 # Existing repository_files_api (unchanged)
 # -----------------------
@@ -214,7 +84,7 @@ def repository_files_api(request, repo_id):
         if not code_state:
             return JsonResponse({'error': 'Repository not found'}, status=404)
         
-        files = code_state.files.all()
+        files = effective_files(code_state)
         files_data = []
         
         for file in files:
@@ -224,7 +94,7 @@ def repository_files_api(request, repo_id):
                 'file_name': getattr(file, 'path', None),
                 'file_type': file.file_type,
                 'size_bytes': file.size_bytes,
-                'content': file.content,
+                'content': file.get_content(),
                 'created_at': file.created_at.isoformat(),
                 'updated_at': file.updated_at.isoformat(),
             })
@@ -269,27 +139,21 @@ def preview_root(request, repo_id):
     - If index.html exists in snapshot, redirect to it
     - Otherwise show file browser for repo root
     """
-    code_state, files = fetch_files_from_db(repo_id)
+    code_state = get_latest_code_state(repo_id)
     if not code_state:
         return render(request, "preview/error.html", {
             "error": "No code state found for this repository."
         })
 
-    temp_dir = get_or_create_tempdir_for_project(code_state, files)
-    index_path = os.path.join(temp_dir, "index.html")
+    storage = get_storage(code_state)
 
-    if os.path.exists(index_path):
+    if storage.exists("index.html"):
         # Redirect so URL is explicit (/preview/<repo_id>/index.html)
         return redirect("preview:preview_serve", repo_id=repo_id, path="index.html")
 
     # No index.html → show file browser for root
-    try:
-        entries = sorted(os.listdir(temp_dir))
-    except Exception:
-        entries = []
-
     return render(request, "preview/file_browser.html", {
-        "files": entries,
+        "files": storage.listdir("") or [],
         "repo_id": repo_id,
         "path": "",
     })
@@ -301,83 +165,219 @@ def preview_serve(request, repo_id, path=""):
     - directories -> render file_browser for that dir
     - files -> return with proper Content-Type
       * HTML and CSS are rewritten so leading-/root-absolute links point into /preview/<repo_id>/...
+    The latest state can change at any time, so files are revalidated on
+    every load; an unchanged blob is answered with 304 Not Modified.
+    """
+    code_state = get_latest_code_state(repo_id)
+    if not code_state:
+        return HttpResponse("404 Not Found", status=404)
+
+    return _serve(request, code_state, path, repo_id)
+
+
+def preview_pinned(request, repo_id, commit_sha, path=""):
     """
-    code_state, files = fetch_files_from_db(repo_id)
+    Serve a file or directory of the snapshot at commit_sha. Its content
+    never changes, so files are cacheable for PREVIEW_IMMUTABLE_MAX_AGE.
+    """
+    code_state = get_pinned_code_state(repo_id, commit_sha)
     if not code_state:
         return HttpResponse("404 Not Found", status=404)
 
-    temp_dir = get_or_create_tempdir_for_project(code_state, files)
+    storage = get_storage(code_state)
+    if not path.strip("/") and storage.exists("index.html"):
+        return redirect(
+            "preview:preview_pinned",
+            repo_id=repo_id,
+            commit_sha=commit_sha,
+            path="index.html",
+        )
+    return _serve(request, code_state, path, repo_id, commit_sha, storage)
+
+
+def _serve(request, code_state, path, repo_id, commit_sha=None, storage=None):
+    storage = storage or get_storage(code_state)
 
     # normalize path (strip leading slash if any)
     path = (path or "").lstrip("/")
 
-    # safe_join prevents path traversal
-    try:
-        target_path = safe_join(temp_dir, path)
-    except Exception:
-        return HttpResponse("Invalid path", status=400)
+    # file -> serve with correct mime
+    response = _cached_file_response(request, storage, path, repo_id, commit_sha) if path else None
+    if response is not None:
+        return response
 
     # directory -> list
-    if os.path.isdir(target_path):
-        try:
-            entries = sorted(os.listdir(target_path))
-        except Exception:
-            entries = []
+    entries = storage.listdir(path)
+    if entries is not None:
         return render(request, "preview/file_browser.html", {
             "files": entries,
             "repo_id": repo_id,
-            "path": path,
+            "commit_sha": commit_sha,
+            "path": path.rstrip("/"),
         })
 
-    # file -> serve with correct mime
-    if os.path.isfile(target_path):
-        mime_type, _ = mimetypes.guess_type(target_path)
-        if not mime_type:
-            # fallback for JS in older Python/mimetypes environments
-            if target_path.endswith(".js"):
-                mime_type = "application/javascript"
-            elif target_path.endswith(".css"):
-                mime_type = "text/css"
-            elif target_path.endswith(".html") or target_path.endswith(".htm"):
-                mime_type = "text/html"
-            else:
-                mime_type = "application/octet-stream"
-
-        # Text-like files: open as text, rewrite if needed
-        text_like = mime_type.startswith("text/") or mime_type in ("application/javascript", "application/json", "image/svg+xml")
-        if text_like:
-            try:
-                with open(target_path, "r", encoding="utf-8", errors="replace") as fh:
-                    content = fh.read()
-            except Exception:
-                # fallback to binary read then decode
-                with open(target_path, "rb") as fh:
-                    content = fh.read().decode("utf-8", errors="replace")
-
-            # If HTML, rewrite absolute src/href to point to preview namespace
-            if mime_type == "text/html":
-                prefix = f"/preview/{repo_id}"
-                content = _rewrite_html_urls(content, prefix)
-                # optional: inject <base href> to help relative paths if desired
-                # NOTE: injecting base can alter how relative paths resolve - test before enabling
-                # if '<base ' not in content.lower():
-                #     content = content.replace('<head>', '<head><base href="%s/">' % prefix, 1)
-
-                return HttpResponse(content, content_type=f"{mime_type}; charset=utf-8")
-
-            # If CSS, rewrite url(...) absolute paths
-            if mime_type == "text/css":
-                prefix = f"/preview/{repo_id}"
-                content = _rewrite_css_urls(content, prefix)
-                return HttpResponse(content, content_type=f"{mime_type}; charset=utf-8")
-
-            # JS / JSON / SVG text-like
-            return HttpResponse(content, content_type=f"{mime_type}; charset=utf-8")
-
-        # Binary -> stream
-        try:
-            return FileResponse(open(target_path, "rb"), content_type=mime_type)
-        except Exception:
-            return HttpResponse("Error reading file", status=500)
-
     return HttpResponse("404 Not Found", status=404)
+
+
+def _cached_file_response(request, storage, path, repo_id, commit_sha):
+    """
+    File response with a strong ETag, the blob SHA (the rewrite prefix is
+    fixed per URL), or 304 when the client's copy is current; checking that
+    never loads the content. None if path is not a file.
+    """
+    mime_type = guess_mime_type(path)
+    response = None
+    if is_text_like(mime_type):
+        response = _variant_response(
+            request, storage, path, mime_type, preview_prefix(repo_id, commit_sha)
+        )
+
+    if response is None and request.headers.get("If-None-Match"):
+        sha = storage.etag(path)
+        if sha:
+            response = get_conditional_response(request, etag=f'"{sha}"')
+            if response is not None:
+                response["ETag"] = f'"{sha}"'
+
+    if response is None:
+        try:
+            preview_file = storage.open(path)
+        except BlobUnavailable:
+            # Neither an ETag nor caching: the content comes once the blob is fetched again
+            response = HttpResponse("503 Service Unavailable", status=503)
+            response["Retry-After"] = "30"
+            patch_cache_control(response, no_store=True)
+            return response
+        if preview_file is None:
+            return None
+        if isinstance(preview_file, BinaryFile):
+            response = _binary_response(request, preview_file, mime_type)
+        else:
+            response = _file_response(preview_file, repo_id, commit_sha)
+        if preview_file.sha:
+            response["ETag"] = f'"{preview_file.sha}"'
+
+    if commit_sha:
+        patch_cache_control(
+            response, public=True, max_age=settings.PREVIEW_IMMUTABLE_MAX_AGE, immutable=True
+        )
+    else:
+        patch_cache_control(response, no_cache=True)
+    return response
+
+
+def _variant_response(request, storage, path, mime_type, prefix):
+    """
+    Pre-rendered text file in the best encoding the client accepts, or None
+    to serve the file as is (binary blob, rows without a blob, no file).
+    """
+    sha = storage.etag(path)
+    if not sha:
+        return None
+    encoding = negotiate_encoding(request.headers.get("Accept-Encoding", ""))
+    # Each encoding is a representation of its own, with its own strong ETag
+    etag = f'"{sha}"' if encoding == "identity" else f'"{sha}-{encoding}"'
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        variant = get_variant(sha, mime_type, prefix, encoding)
+        if variant is None:
+            return None
+        response = HttpResponse(variant.data, content_type=f"{mime_type}; charset=utf-8")
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+    response["ETag"] = etag
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
+
+# A single byte range: "bytes=first-last", "bytes=first-" or "bytes=-suffix"
+_BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _byte_range(header: str, size: int):
+    """
+    (start, end) of the range a Range header asks for, end exclusive and
+    start >= size when it cannot be satisfied; None to send the whole file
+    (no header, several ranges or a malformed one).
+    """
+    match = _BYTE_RANGE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if not first:
+        # Suffix range: the last bytes of the file
+        return max(size - int(last), 0) if int(last) else size, size
+    if last and int(last) < int(first):
+        return None
+    return int(first), min(int(last) + 1, size) if last else size
+
+
+async def _aiter_blocks(blocks):
+    """
+    Async iterator over a sync one, advanced in a worker thread one block at
+    a time: Django's ASGI handler would otherwise drain a sync iterator into
+    a list, loading the whole file.
+    """
+    next_block = sync_to_async(next)
+    try:
+        while True:
+            block = await next_block(blocks, None)
+            if block is None:
+                return
+            yield block
+    finally:
+        close = getattr(blocks, "close", None)
+        if close is not None:
+            await sync_to_async(close)()
+
+
+def _binary_response(request, binary_file, mime_type) -> HttpResponse:
+    """
+    Stream a binary file with its Content-Length, or the byte range of a
+    Range header (206) as long as If-Range, if sent, matches its ETag.
+    """
+    size = binary_file.size
+    start, end, partial = 0, size, False
+    byte_range = _byte_range(request.headers.get("Range", ""), size)
+    if_range = request.headers.get("If-Range")
+    if byte_range is not None and (
+        if_range is None or (binary_file.sha and if_range == f'"{binary_file.sha}"')
+    ):
+        start, end = byte_range
+        partial = True
+        if start >= size:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    blocks = binary_file.read(start, end)
+    if isinstance(request, ASGIRequest):
+        blocks = _aiter_blocks(blocks)
+    response = StreamingHttpResponse(
+        blocks,
+        status=206 if partial else 200,
+        content_type=mime_type,
+    )
+    response["Content-Length"] = str(end - start)
+    response["Accept-Ranges"] = "bytes"
+    if partial:
+        response["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return response
+
+
+def _file_response(preview_file, repo_id, commit_sha=None) -> HttpResponse:
+    mime_type = guess_mime_type(preview_file.path)
+    content = preview_file.content
+
+    # Text-like files: decode, rewrite if needed
+    if is_text_like(mime_type) and not preview_file.is_binary:
+        if isinstance(content, bytes):
+            content = content.decode("utf-8", errors="replace")
+        content = rewrite_text(content, mime_type, preview_prefix(repo_id, commit_sha))
+        return HttpResponse(content, content_type=f"{mime_type}; charset=utf-8")
+
+    # Binary
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return HttpResponse(content, content_type=mime_type)
@@ -0,0 +1,105 @@
+# src/preview/webhooks.py
+"""
+GitHub push webhooks. A push moves Branch.last_commit_sha and queues a
+snapshot of the new head for every branch that has a preview, so previews
+are refreshed in the background instead of when a user selects the branch.
+Recorded payloads can be replayed with manage.py replay_github_push.
+"""
+import hashlib
+import hmac
+import json
+import logging
+from typing import Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from accounts.models import Branch
+from .changes import push_changes
+from .jobs import dispatch_job, enqueue_push
+from .models import RepositoryCodeState
+
+logger = logging.getLogger(__name__)
+
+BRANCH_REF_PREFIX = "refs/heads/"
+
+
+def verify_signature(body: bytes, signature: str) -> bool:
+    """Check X-Hub-Signature-256, the HMAC-SHA256 of the body keyed with GITHUB_WEBHOOK_SECRET."""
+    secret = settings.GITHUB_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode("utf-8"), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"sha256={digest}", signature)
+
+
+async def handle_push(payload: dict, dispatch: bool = True) -> dict:
+    """
+    Record the new head of the pushed branch and queue its snapshots; with
+    dispatch they are started right away in inline job mode.
+    """
+    ref = payload.get("ref", "")
+    if not ref.startswith(BRANCH_REF_PREFIX) or payload.get("deleted"):
+        # Tags, and deleted branches (left to the next branch sync)
+        return {"status": "ignored", "jobs": []}
+
+    name = ref[len(BRANCH_REF_PREFIX) :]
+    repository = payload["repository"]
+    after = payload["after"]
+    changes = push_changes(payload)
+
+    # Every user who linked the repository has a Branch row of their own
+    branches = [
+        branch
+        async for branch in Branch.objects.filter(
+            repository__repo_id=repository["id"], name=name
+        ).select_related("repository__user")
+    ]
+    await Branch.objects.filter(id__in=[b.id for b in branches]).aupdate(
+        last_commit_sha=after,
+        last_commit_url=f"{settings.GITHUB_API_URL}/repos/{repository['full_name']}"
+        f"/commits/{after}",
+    )
+
+    jobs = []
+    for branch in branches:
+        has_preview = await RepositoryCodeState.objects.filter(branch=branch).aexists()
+        if not has_preview:
+            continue
+        job = await sync_to_async(enqueue_push)(
+            branch.repository.user,
+            branch.repository,
+            branch,
+            payload["before"],
+            after,
+            changes,
+        )
+        if dispatch:
+            await dispatch_job(job)
+        jobs.append(job.id)
+
+    logger.info(
+        f"[webhook] push to {repository['full_name']}:{name} ({after[:8]}), "
+        f"{len(branches)} branches, jobs {jobs}"
+    )
+    return {"status": "ok", "jobs": jobs}
+
+
+async def handle_github_webhook(event: str, body: bytes) -> Tuple[int, dict]:
+    """
+    Dispatch a verified delivery by its X-GitHub-Event header; returns the
+    HTTP status and body. A malformed push is answered with 400 so GitHub
+    records the delivery as failed.
+    """
+    if event == "ping":
+        return 200, {"status": "ok"}
+    if event != "push":
+        return 200, {"status": "ignored"}
+    try:
+        payload = json.loads(body)
+    except ValueError as e:
+        logger.error(f"[webhook] invalid push payload: {str(e)}")
+        return 400, {"status": "error", "error": "Invalid JSON"}
+    if not isinstance(payload, dict):
+        return 400, {"status": "error", "error": "Invalid push payload"}
+    return 200, await handle_push(payload)
@@ -1,11 +1,23 @@
+import secrets
+
+from django.conf import settings
 from ninja_extra import api_controller, http_post
 from django.http import HttpRequest
+
+from core.background import run_in_background
 from .services.webhook import handle_telegram_webhook
 
 @api_controller("/telegram", tags=["Telegram"])
 class TelegramController:
-    @http_post("/webhook")
+    @http_post("/webhook", response={200: dict, 403: dict})
     async def webhook(self, request: HttpRequest):
+        # Telegram echoes the secret_token given to setWebhook in this header
+        expected = settings.TELEGRAM_WEBHOOK_SECRET
+        received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if expected and not secrets.compare_digest(received, expected):
+            return 403, {"status": "error", "error": "Invalid secret token"}
+
         # Get the raw request body (Telegram update payload)
         body = request.body
-        return await handle_telegram_webhook(body)
+        # The bot application lives on the process-wide loop, not the request's
+        return await run_in_background(handle_telegram_webhook(body))
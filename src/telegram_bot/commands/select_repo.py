@@ -1,14 +1,15 @@
-import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from accounts.models import User, Repository, Branch
-from accounts.services.github_service import GitHubService
+from accounts.services.enrichment import enrich_repository, needs_enrichment
 from ..helpers import get_github_user
-from preview.services import update_codebase
+from ..services.progress import ProgressReporter, render_job_progress
+from preview.jobs import enqueue_snapshot, wait_for_job
+from preview.fetcher import FetchScheduler
+from preview.models import RepositoryCodeState
 
 import logging
 logger = logging.getLogger(__name__)
-github_service = GitHubService()
 
 
 async def select_repo_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -54,11 +55,7 @@ async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYP
     repo_id = int(data.split(":")[1])
 
     # Fetch repo & update user preference
-    repo = (
-        await Repository.objects.prefetch_related("branches")
-        .filter(id=repo_id)
-        .afirst()
-    )
+    repo = await Repository.objects.filter(id=repo_id).afirst()
     user = await User.objects.filter(chat_id=query.from_user.id).afirst()
     if not repo or not user:
         logger.error("Either user or repo not found. User: %s, Repo: %s", user, repo)
@@ -66,10 +63,10 @@ async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         return
 
     try:
-        branch_data = await github_service.update_branches(user.access_token, repo)
-        url = f"https://api.github.com/repos/{repo.full_name}"
-        repo_data = await github_service._make_request(user.access_token, url)
-        await github_service._update_permissions(repo, repo_data.get("permissions", {}))
+        if needs_enrichment(repo):
+            # Not prefetched after login (or pushed to since): fetch it now
+            await enrich_repository(repo, FetchScheduler(user.access_token, cache=True))
+        branch_data = [b async for b in Branch.objects.filter(repository=repo)]
         user.selected_repo = repo
         await user.asave()
         repo_summary = f"Repository *{repo.full_name}* selected! The AI will now work on this repo."
@@ -96,20 +93,6 @@ async def select_repo_callback(update: Update, context: ContextTypes.DEFAULT_TYP
         )
 
 
-async def animate_loading(query, context, loading_message):
-    dots = ["", ".", "..", "..."]
-    i = 0
-    while not context.chat_data.get("setup_done"):
-        await asyncio.sleep(0.1)
-        i = (i + 1) % len(dots)
-        try:
-            await query.edit_message_text(
-                f"{loading_message}{dots[i]}", parse_mode="Markdown"
-            )
-        except Exception:
-            break
-
-
 async def select_branch_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -127,29 +110,38 @@ async def select_branch_callback(update: Update, context: ContextTypes.DEFAULT_T
 
     loading_message = f"Setting up codebase for *{branch.name}*"
     await query.edit_message_text(loading_message, parse_mode="Markdown")
-    # Init flag
-    context.chat_data["setup_done"] = False
-
-    # Animate the loading dots while update_codebase runs
-
-    # Run the animation in background
-    asyncio.create_task(
-        animate_loading(query=query, context=context, loading_message=loading_message)
+    # Snapshot runs as a job (deduplicated per commit); poll it for progress
+    job = await enqueue_snapshot(
+        user, user.selected_repo, branch, branch.last_commit_sha
     )
 
-    # Do the heavy work
-    await update_codebase(
-        user, user.selected_repo, branch, branch.last_commit_sha, user.access_token
-    )
+    reporter = ProgressReporter.for_query(query, parse_mode="Markdown")
+
+    async def show_progress(job):
+        reporter.update(f"{loading_message}\n{render_job_progress(job)}")
 
-    # Mark setup done so animation stops
-    context.chat_data["setup_done"] = True
-    await asyncio.sleep(0)  # let animate_loading break cleanly
+    job = await wait_for_job(job, on_progress=show_progress)
+    if not job.is_finished:
+        await reporter.finish(
+            f"Codebase for *{branch.name}* is still being set up. "
+            "Run /preview again in a few minutes."
+        )
+        return
+    if job.status == "failed":
+        await reporter.finish(
+            f"Failed to set up codebase for *{branch.name}*. Please try again."
+        )
+        return
+    code_state = await RepositoryCodeState.objects.filter(id=job.code_state_id).afirst()
 
     # Final message
-    await query.edit_message_text(
-        f"🌿 Branch set to *{branch.name}*", parse_mode="Markdown"
-    )
+    summary = f"🌿 Branch set to *{branch.name}*"
+    if code_state:
+        summary += (
+            f"\n♻️ {code_state.blobs_reused} files reused, "
+            f"⬇️ {code_state.blobs_fetched} downloaded"
+        )
+    await reporter.finish(summary)
 
     await context.bot.send_message(
         chat_id=query.from_user.id, text="Now run /preview to view your application."
@@ -0,0 +1,30 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from telegram_bot.services.bot import shutdown_bot
+from telegram_bot.services.update_queue import run_worker
+
+
+class Command(BaseCommand):
+    help = "Processes queued Telegram updates (TELEGRAM_UPDATE_MODE=queue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency", type=int, help="Updates processed at the same time"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when the queue is empty"
+        )
+
+    def handle(self, *args, **options):
+        async def main():
+            try:
+                await run_worker(concurrency=options["concurrency"], once=options["once"])
+            finally:
+                await shutdown_bot()
+
+        self.stdout.write("Processing Telegram updates...")
+        try:
+            asyncio.run(main())
+        except KeyboardInterrupt:
+            pass
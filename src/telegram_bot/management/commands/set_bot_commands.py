@@ -0,0 +1,12 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+from telegram_bot.services.bot import publish_commands
+
+
+class Command(BaseCommand):
+    help = "Registers the bot command list with Telegram (run once per deploy)"
+
+    def handle(self, *args, **options):
+        asyncio.run(publish_commands())
+        self.stdout.write(self.style.SUCCESS("Bot commands registered"))
@@ -1,3 +1,39 @@
 from django.db import models
 
-# Create your models here.
+
+class TelegramUpdate(models.Model):
+    """
+    Incoming webhook update waiting for (or done with) background processing.
+    The unique update_id makes Telegram redeliveries no-ops.
+    """
+
+    STATUS_CHOICES = [
+        ("pending", "Pending"),
+        ("processing", "Processing"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    ]
+
+    update_id = models.BigIntegerField(unique=True)
+    chat_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        db_index=True,
+        help_text="Chat (or user) the update belongs to; updates of one chat "
+        "are processed in update_id order",
+    )
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default="pending", db_index=True
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ["update_id"]
+
+    def __str__(self):
+        return f"Update {self.update_id} ({self.status})"
@@ -1,10 +1,25 @@
+import asyncio
+import logging
+import weakref
+
 from telegram.ext import Application, CommandHandler
 from .dispatcher import register_commands, set_commands
 from django.conf import settings
-import logging
+
+from core.background import on_shutdown
 
 logger = logging.getLogger(__name__)
 
+# One initialized Application per event loop, reused across webhook calls.
+# Webhooks are handled on the process-wide background loop (core.background),
+# so the web process has one; queue workers have one for their own loop.
+_apps: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Application]" = (
+    weakref.WeakKeyDictionary()
+)
+_locks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Lock]" = (
+    weakref.WeakKeyDictionary()
+)
+
 
 def build_bot():
     try:
@@ -20,15 +35,47 @@ def build_bot():
         raise
 
 
-async def start_bot():
-    """Initialize and start the bot for processing updates."""
-    try:
-        app = build_bot()
-        await app.initialize()
-        await set_commands(app)
-        await app.start()
-        logger.info("Bot started")
+async def get_bot_app() -> Application:
+    """
+    Return the long-lived bot application, building and initializing it on
+    first use. Commands are not re-registered with Telegram here; that
+    happens once per deploy (manage.py set_bot_commands).
+    """
+    loop = asyncio.get_running_loop()
+    app = _apps.get(loop)
+    if app is not None:
         return app
-    except Exception as e:
-        logger.error(f"Failed to start bot: {e}")
-        raise
+
+    lock = _locks.setdefault(loop, asyncio.Lock())
+    async with lock:
+        app = _apps.get(loop)
+        if app is None:
+            app = build_bot()
+            await app.initialize()
+            _apps[loop] = app
+            logger.info("Bot application ready")
+    return app
+
+
+@on_shutdown
+async def shutdown_bot():
+    """Shut down the running loop's application; runs at shutdown of the background loop."""
+    app = _apps.pop(asyncio.get_running_loop(), None)
+    if app is not None:
+        await app.shutdown()
+        logger.info("Bot shut down")
+
+
+async def publish_commands():
+    """Register the command list with Telegram; run at deploy time."""
+    app = build_bot()
+    async with app:
+        await set_commands(app)
+    logger.info("Bot commands registered")
+
+
+def run_bot():
+    """Run the bot with long polling (local development)."""
+    app = build_bot()
+    app.post_init = set_commands
+    app.run_polling()
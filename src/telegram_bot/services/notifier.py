@@ -0,0 +1,202 @@
+# src/telegram_bot/services/notifier.py
+"""
+Outbound messaging without a full bot Application: a bare Bot with a pooled
+HTTP client, a send queue and rate limiting that follows Telegram's limits
+(about 30 messages/s overall and 1 message/s per chat).
+"""
+import asyncio
+import logging
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+from django.conf import settings
+from telegram import Bot
+from telegram.error import RetryAfter
+from telegram.request import HTTPXRequest
+
+from core.background import on_shutdown, run_in_background
+
+logger = logging.getLogger(__name__)
+
+# Idle per-chat slots are pruned once this many chats have been seen
+_MAX_CHAT_SLOTS = 1000
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Delay requested by a RetryAfter (an int today, a timedelta in newer releases)."""
+    delay = error.retry_after
+    if isinstance(delay, (int, float)):
+        return float(delay)
+    return delay.total_seconds()
+
+
+class _Interval:
+    """Hands out send slots at least `interval` seconds apart."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.next_at = 0.0
+
+    def reserve(self, now: float) -> float:
+        """Reserve the next slot and return how long to wait for it."""
+        at = max(now, self.next_at)
+        self.next_at = at + self.interval
+        return at - now
+
+
+class _ChatSlot:
+    def __init__(self, interval: float):
+        # Lock keeps messages to one chat in order; asyncio locks are FIFO
+        self.lock = asyncio.Lock()
+        self.interval = _Interval(interval)
+
+
+class _Message(NamedTuple):
+    chat_id: int
+    text: str
+    kwargs: dict
+    future: asyncio.Future
+
+
+class Notifier:
+    """
+    Queues outgoing messages and delivers them through one shared Bot.
+    Each send resolves to the sent Message or the error that stopped it;
+    RetryAfter responses are retried after the delay Telegram asks for.
+    """
+
+    def __init__(self):
+        # Left uninitialized: initialize() would cost an extra getMe round trip
+        self._request = HTTPXRequest(
+            connection_pool_size=settings.TELEGRAM_SEND_CONCURRENCY
+        )
+        self.bot = Bot(token=settings.TELEGRAM_BOT_TOKEN, request=self._request)
+        self.max_retries = settings.TELEGRAM_SEND_MAX_RETRIES
+        self._queue: "asyncio.Queue[_Message]" = asyncio.Queue()
+        self._global = _Interval(1 / settings.TELEGRAM_GLOBAL_RATE_LIMIT)
+        self._chats: Dict[int, _ChatSlot] = {}
+        self._semaphore = asyncio.Semaphore(settings.TELEGRAM_SEND_CONCURRENCY)
+        self._tasks = set()
+        self._worker = asyncio.create_task(self._run())
+
+    def send(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        """Queue a message; the returned future resolves once it is delivered."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(_Message(chat_id, text, kwargs, future))
+        return future
+
+    async def broadcast(self, chat_ids: Iterable[int], text: str, **kwargs) -> Dict[str, int]:
+        """
+        Send the same message to many chats. Telegram has no multi-recipient
+        call, so the batch is queued at once and spread over the global limit.
+        """
+        futures = [self.send(chat_id, text, **kwargs) for chat_id in chat_ids]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        failed = sum(isinstance(r, Exception) for r in results)
+        logger.info(f"[notify] broadcast to {len(results)} chats, {failed} failed")
+        return {"sent": len(results) - failed, "failed": failed}
+
+    async def _run(self):
+        while True:
+            message = await self._queue.get()
+            await self._semaphore.acquire()
+            task = asyncio.create_task(self._deliver(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _chat_slot(self, chat_id: int) -> _ChatSlot:
+        slot = self._chats.get(chat_id)
+        if slot is None:
+            if len(self._chats) >= _MAX_CHAT_SLOTS:
+                self._prune_chats()
+            slot = self._chats[chat_id] = _ChatSlot(settings.TELEGRAM_CHAT_RATE_LIMIT)
+        return slot
+
+    def _prune_chats(self):
+        now = asyncio.get_running_loop().time()
+        for chat_id, slot in list(self._chats.items()):
+            if not slot.lock.locked() and slot.interval.next_at <= now:
+                del self._chats[chat_id]
+
+    async def _deliver(self, message: _Message):
+        loop = asyncio.get_running_loop()
+        try:
+            slot = self._chat_slot(message.chat_id)
+            async with slot.lock:
+                attempt = 0
+                while True:
+                    # The global slot is taken only once the chat is due, so a
+                    # chat waiting on its own limit does not hold one back
+                    wait = slot.interval.reserve(loop.time())
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    wait = self._global.reserve(loop.time())
+                    if wait > 0:
+                        await asyncio.sleep(wait)
+                    try:
+                        result = await self.bot.send_message(
+                            chat_id=message.chat_id, text=message.text, **message.kwargs
+                        )
+                        break
+                    except RetryAfter as e:
+                        if attempt >= self.max_retries:
+                            raise
+                        attempt += 1
+                        delay = retry_after_seconds(e)
+                        logger.warning(
+                            f"[notify] flood control for {message.chat_id}, retrying in {delay}s"
+                        )
+                        await asyncio.sleep(delay)
+            if not message.future.done():
+                message.future.set_result(result)
+        except Exception as e:
+            logger.error(f"[notify] failed to send to {message.chat_id}: {e}")
+            if not message.future.done():
+                message.future.set_exception(e)
+        finally:
+            self._semaphore.release()
+
+    async def close(self):
+        """Stop the worker and release the HTTP pool; queued messages are dropped."""
+        self._worker.cancel()
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(self._worker, *self._tasks, return_exceptions=True)
+        await self._request.shutdown()
+
+
+# One notifier per process, on the background loop (core.background): sends
+# from request loops, the bot and workers all share its queue and limits
+_notifier: Optional[Notifier] = None
+
+
+def get_notifier() -> Notifier:
+    """The process-wide notifier; call it on the background loop."""
+    global _notifier
+    if _notifier is None:
+        _notifier = Notifier()
+    return _notifier
+
+
+@on_shutdown
+async def close_notifier():
+    global _notifier
+    notifier, _notifier = _notifier, None
+    if notifier is not None:
+        await notifier.close()
+
+
+async def _send(chat_id: int, text: str, kwargs: dict):
+    return await get_notifier().send(chat_id, text, **kwargs)
+
+
+async def send_message(chat_id: int, text: str, **kwargs):
+    """Send one message through the shared notifier and wait for delivery."""
+    return await run_in_background(_send(chat_id, text, kwargs))
+
+
+async def _broadcast(chat_ids: List[int], text: str, kwargs: dict) -> Dict[str, int]:
+    return await get_notifier().broadcast(chat_ids, text, **kwargs)
+
+
+async def broadcast(chat_ids: Iterable[int], text: str, **kwargs) -> Dict[str, int]:
+    return await run_in_background(_broadcast(list(chat_ids), text, kwargs))
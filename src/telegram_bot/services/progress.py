@@ -0,0 +1,118 @@
+# src/telegram_bot/services/progress.py
+import asyncio
+import logging
+from typing import Awaitable, Callable, Optional
+
+from django.conf import settings
+from django.template.defaultfilters import filesizeformat
+from telegram.error import BadRequest, RetryAfter, TelegramError
+
+from .notifier import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# Attempts at the final edit when Telegram keeps answering with RetryAfter
+_FINISH_ATTEMPTS = 3
+
+
+class ProgressReporter:
+    """
+    Keeps one message up to date while a long command runs.
+    update() only records the latest text; a background task edits the
+    message at most once per interval with whatever is latest, so bursts of
+    updates coalesce into one edit and unchanged text is never re-sent.
+    A RetryAfter pushes the next edit back by the delay Telegram asks for.
+    """
+
+    def __init__(self, edit: Callable[[str], Awaitable], interval: float = None):
+        self._edit = edit
+        self.interval = settings.TELEGRAM_PROGRESS_INTERVAL if interval is None else interval
+        self._pending: Optional[str] = None
+        self._sent: Optional[str] = None
+        self._next_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    @classmethod
+    def for_query(cls, query, interval: float = None, **edit_kwargs):
+        """Reporter editing the message of a callback query."""
+
+        async def edit(text):
+            await query.edit_message_text(text, **edit_kwargs)
+
+        return cls(edit, interval)
+
+    def update(self, text: str):
+        self._pending = text
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wakeup.set()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            delay = self._next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if not await self._flush():
+                self._wakeup.set()  # retry once the backoff has passed
+
+    async def _flush(self) -> bool:
+        """Send the pending text; False when Telegram asked to retry later."""
+        text = self._pending
+        if text is None or text == self._sent:
+            return True
+        loop = asyncio.get_running_loop()
+        try:
+            await self._edit(text)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            logger.warning(f"Progress edit rate limited, backing off {delay}s")
+            self._next_at = loop.time() + delay
+            return False
+        except BadRequest as e:
+            # "Message is not modified" and friends are not worth retrying
+            logger.warning(f"Progress edit rejected: {e}")
+        except TelegramError as e:
+            # Network trouble: skip this edit, the next update tries again
+            logger.warning(f"Progress edit failed: {e}")
+            self._next_at = loop.time() + self.interval
+            return True
+        self._sent = text
+        self._next_at = loop.time() + self.interval
+        return True
+
+    async def finish(self, text: str = None):
+        """Stop the periodic edits and show text (or the latest update) now."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if text is not None:
+            self._pending = text
+
+        loop = asyncio.get_running_loop()
+        for _ in range(_FINISH_ATTEMPTS):
+            delay = self._next_at - loop.time()
+            if delay > 0:
+                await asyncio.sleep(min(delay, settings.TELEGRAM_PROGRESS_MAX_WAIT))
+            if await self._flush():
+                return
+        logger.error("Gave up on the final progress edit")
+
+
+def render_job_progress(job) -> str:
+    """One-line progress of a SnapshotJob: stage, files, bytes and a bar."""
+    if job.status == "fetching_blobs" and job.files_total:
+        filled = round(10 * job.files_done / job.files_total)
+        bar = "▓" * filled + "░" * (10 - filled)
+        return (
+            f"{bar} ⬇️ {job.files_done}/{job.files_total} files, "
+            f"{filesizeformat(job.bytes_fetched)}"
+        )
+    return f"{job.get_status_display()}..."
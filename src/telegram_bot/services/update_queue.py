@@ -0,0 +1,133 @@
+# src/telegram_bot/services/update_queue.py
+"""
+DB-backed queue between the webhook and the bot handlers. The webhook only
+stores the update; workers (manage.py process_telegram_updates) claim and
+process them. A chat never has more than one update in flight, so handlers
+of one chat still run in update_id order.
+"""
+import asyncio
+import logging
+from datetime import timedelta
+from typing import List, Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+from telegram import Update
+
+from ..models import TelegramUpdate
+from .bot import get_bot_app
+
+logger = logging.getLogger(__name__)
+
+
+def _ordering_key(data: dict) -> Optional[int]:
+    update = Update.de_json(data, None)
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        return update.effective_user.id
+    return None
+
+
+async def enqueue_update(data: dict) -> bool:
+    """Store an update for the workers; returns False for a redelivery."""
+    _, created = await TelegramUpdate.objects.aget_or_create(
+        update_id=data["update_id"],
+        defaults={"chat_id": _ordering_key(data), "payload": data},
+    )
+    if not created:
+        logger.info(f"Skipping duplicate update ID: {data['update_id']}")
+    return created
+
+
+@transaction.atomic
+def claim_updates(limit: int) -> List[TelegramUpdate]:
+    """
+    Mark up to limit pending updates as processing: per chat only the oldest
+    pending one, and only if nothing of that chat is being processed.
+    """
+    busy = TelegramUpdate.objects.filter(
+        status="processing", chat_id=OuterRef("chat_id")
+    )
+    earlier = TelegramUpdate.objects.filter(
+        status="pending", chat_id=OuterRef("chat_id"), update_id__lt=OuterRef("update_id")
+    )
+    rows = (
+        TelegramUpdate.objects.filter(status="pending")
+        .exclude(Exists(busy))
+        .exclude(Exists(earlier))
+        .order_by("update_id")
+    )
+    if connection.features.has_select_for_update_skip_locked:
+        rows = rows.select_for_update(skip_locked=True)
+
+    ids = list(rows.values_list("id", flat=True)[:limit])
+    TelegramUpdate.objects.filter(id__in=ids).update(
+        status="processing", attempts=F("attempts") + 1, locked_at=timezone.now()
+    )
+    return list(TelegramUpdate.objects.filter(id__in=ids))
+
+
+def release_stale_updates() -> int:
+    """Hand updates of crashed workers back to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=settings.TELEGRAM_UPDATE_STALE_AFTER)
+    return TelegramUpdate.objects.filter(
+        status="processing", locked_at__lt=cutoff
+    ).update(status="pending", locked_at=None)
+
+
+def purge_processed_updates() -> int:
+    """Drop finished updates once Telegram can no longer redeliver them."""
+    cutoff = timezone.now() - timedelta(seconds=settings.TELEGRAM_UPDATE_RETENTION)
+    deleted, _ = TelegramUpdate.objects.filter(
+        status__in=["done", "failed"], updated_at__lt=cutoff
+    ).delete()
+    return deleted
+
+
+async def process_queued_update(row: TelegramUpdate):
+    bot_app = await get_bot_app()
+    try:
+        update = Update.de_json(row.payload, bot_app.bot)
+        await bot_app.process_update(update)
+        row.status = "done"
+        row.error = ""
+        logger.info(f"Processed update ID: {row.update_id}")
+    except Exception as e:
+        logger.error(f"Error processing update {row.update_id}: {e}", exc_info=True)
+        row.status = "failed"
+        row.error = str(e)
+    row.locked_at = None
+    await row.asave(update_fields=["status", "error", "locked_at", "updated_at"])
+
+
+async def run_worker(concurrency: int = None, poll_interval: float = None, once: bool = False):
+    """Claim and process updates, up to concurrency at a time, until cancelled (or drained, with once)."""
+    concurrency = concurrency or settings.TELEGRAM_WORKER_CONCURRENCY
+    poll_interval = poll_interval or settings.TELEGRAM_WORKER_POLL_INTERVAL
+    # Claimed rows never share a chat with a running one, so a slow handler
+    # only holds back its own chat
+    running = set()
+
+    while True:
+        released = await sync_to_async(release_stale_updates)()
+        if released:
+            logger.warning(f"Re-queued {released} stale updates")
+
+        free = concurrency - len(running)
+        rows = await sync_to_async(claim_updates)(free) if free > 0 else []
+        for row in rows:
+            running.add(asyncio.create_task(process_queued_update(row)))
+
+        if once and not running:
+            return
+        if running:
+            _, running = await asyncio.wait(
+                running, timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED
+            )
+        else:
+            await sync_to_async(purge_processed_updates)()
+            await asyncio.sleep(poll_interval)
@@ -1,20 +1,17 @@
 import json
 import logging
 import traceback
+from django.conf import settings
 from telegram import Update
-from telegram.ext import Application, CommandHandler, ContextTypes
-from .bot import start_bot
+from .bot import get_bot_app
+from .update_queue import enqueue_update
 from ..helpers import get_github_user
 
 logger = logging.getLogger(__name__)
 
 async def handle_telegram_webhook(request_body: bytes):
     """Processes the raw request body from Telegram asynchronously."""
-    bot_app = None
     try:
-        # Initialize bot for this request
-        bot_app = await start_bot()
-
         # Decode and parse JSON
         try:
             data = json.loads(request_body.decode('utf-8'))
@@ -24,6 +21,17 @@ async def handle_telegram_webhook(request_body: bytes):
 
         logger.info(f"Incoming update: {data}")
 
+        if settings.TELEGRAM_UPDATE_MODE == "queue":
+            # Acknowledge right away; process_telegram_updates does the work
+            if not isinstance(data, dict) or not isinstance(data.get("update_id"), int):
+                logger.error(f"Invalid Telegram update: {data}")
+                return {"status": "error", "error": "Invalid Telegram update"}
+            await enqueue_update(data)
+            return {"status": "ok"}
+
+        # Long-lived application, initialized on the first update only
+        bot_app = await get_bot_app()
+
         # Convert JSON to Telegram Update object
         update = Update.de_json(data, bot_app.bot)
        
@@ -33,19 +41,9 @@ async def handle_telegram_webhook(request_body: bytes):
        
 
         await bot_app.process_update(update)
-        Application.bot.set_my_commands([('start', 'Starts the bot')])
         logger.info(f"Processed update ID: {update.update_id}")
         return {"status": "ok"}
     except Exception as e:
         logger.error(f"Error processing Telegram update: {e}")
         logger.error(f"Traceback: {traceback.format_exc()}")
         return {"status": "error", "error": str(e)}
-    finally:
-        # Clean up bot
-        if bot_app is not None:
-            try:
-                await bot_app.stop()
-                await bot_app.shutdown()
-                logger.info("Bot stopped and shut down")
-            except Exception as e:
-                logger.error(f"Error shutting down bot: {e}")
\ No newline at end of file
@@ -1,3 +1,58 @@
-from django.test import TestCase
+from datetime import timedelta
 
-# Create your tests here.
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import TelegramUpdate
+from .services.update_queue import claim_updates, release_stale_updates
+
+
+def queue_update(update_id, chat_id):
+    return TelegramUpdate.objects.create(
+        update_id=update_id, chat_id=chat_id, payload={"update_id": update_id}
+    )
+
+
+def claimed_ids(limit=10):
+    return sorted(row.update_id for row in claim_updates(limit))
+
+
+class ClaimUpdatesTests(TestCase):
+    def setUp(self):
+        for update_id, chat_id in [(1, 10), (2, 10), (3, 20), (4, None), (5, None)]:
+            queue_update(update_id, chat_id)
+
+    def test_one_update_per_chat_in_update_order(self):
+        # Updates without a chat have no order to keep
+        self.assertEqual(claimed_ids(), [1, 3, 4, 5])
+        self.assertEqual(claimed_ids(), [])
+
+        TelegramUpdate.objects.filter(update_id=1).update(status="done")
+        self.assertEqual(claimed_ids(), [2])
+
+    def test_failed_update_does_not_block_its_chat(self):
+        claimed_ids()
+        TelegramUpdate.objects.filter(update_id=1).update(status="failed")
+
+        self.assertEqual(claimed_ids(), [2])
+
+    def test_limit_takes_the_oldest(self):
+        self.assertEqual(claimed_ids(limit=2), [1, 3])
+
+    def test_claim_marks_rows_processing(self):
+        claim_updates(1)
+
+        row = TelegramUpdate.objects.get(update_id=1)
+        self.assertEqual((row.status, row.attempts), ("processing", 1))
+        self.assertIsNotNone(row.locked_at)
+
+    @override_settings(TELEGRAM_UPDATE_STALE_AFTER=60)
+    def test_stale_updates_are_claimed_again(self):
+        claimed_ids()
+        TelegramUpdate.objects.filter(update_id=1).update(
+            locked_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        self.assertEqual(release_stale_updates(), 1)
+        self.assertEqual(claimed_ids(), [1])
+        self.assertEqual(TelegramUpdate.objects.get(update_id=1).attempts, 2)